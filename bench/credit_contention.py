@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+# =========================================
+# BENCHMARK DA RESERVA DE CRÉDITOS SOB CONTENÇÃO
+# =========================================
+# Dispara --debits reservas de 1 crédito com --concurrency em voo, contra
+# o CreditEngine do app (upsert condicional + ledger num round trip):
+#   hot      todas no mesmo membro, com saldo para --debits * --funded
+#            (o resto tem que ser recusado)
+#   spread   espalhadas em --members membros
+#   legacy   o fluxo de antes (SELECT do User, confere, credits -= cost,
+#            commit) no mesmo membro quente, para comparar
+# Para cada caso: reservas/s, p50/p99, aceitas/recusadas/erros e a
+# conferência dos totais: saldo final == saldo inicial - aceitas, e soma do
+# ledger == movimentos (hot/spread). No legacy, "lost" = débitos aceitos
+# que não saíram do saldo.
+#
+#   python bench/credit_contention.py
+#   python bench/credit_contention.py --database-url postgresql://postgres@/credits?host=/tmp/pgdata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput e totais da reserva de créditos sob contenção")
+    parser.add_argument("--debits", type=int, default=1000, help="reservas por caso")
+    parser.add_argument("--concurrency", type=int, default=64, help="reservas em voo")
+    parser.add_argument("--funded", type=float, default=0.8,
+                        help="fração das reservas do caso hot que cabe no saldo")
+    parser.add_argument("--members", type=int, default=50, help="membros do caso spread")
+    parser.add_argument("--cases", default="hot,spread,legacy")
+    parser.add_argument("--database-url", default=None, help="banco VAZIO (padrão: sqlite temporário)")
+    parser.add_argument("--out", default=None, help="grava o resultado em JSON")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    if args.database_url is None:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='credits-'), 'bench.db')}"
+    # database.py lê o DATABASE_URL no import
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, ROOT)
+
+
+def migrate():
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    command.upgrade(config, "head")
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+async def run_debits(debit, members, concurrency):
+    """debit(member_id) -> saldo novo ou None. Retorna (resultados, latências, segundos)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(member_id):
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                return await debit(member_id)
+            except Exception as e:
+                return e
+            finally:
+                latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(member_id) for member_id in members))
+    return results, sorted(latencies), time.perf_counter() - started
+
+
+async def balances_and_ledger(session_factory, member_ids):
+    from sqlalchemy import func, select
+    from models import CreditLedgerEntry, User
+
+    async with session_factory() as db:
+        balances = dict((await db.execute(
+            select(User.memberstack_id, User.credits).where(User.memberstack_id.in_(member_ids))
+        )).all())
+        ledger = dict((await db.execute(
+            select(CreditLedgerEntry.memberstack_id, func.sum(CreditLedgerEntry.delta))
+            .where(CreditLedgerEntry.memberstack_id.in_(member_ids))
+            .group_by(CreditLedgerEntry.memberstack_id)
+        )).all())
+    return balances, ledger
+
+
+def legacy_debit(session_factory):
+    # fluxo antigo do generate_image/generate_nanobanana_2: lê, confere, escreve
+    from sqlalchemy import select
+    from models import User
+
+    async def debit(member_id):
+        async with session_factory() as db:
+            user = await db.scalar(select(User).where(User.memberstack_id == member_id))
+            if user.credits < 1:
+                return None
+            user.credits -= 1
+            await db.commit()
+            return user.credits
+
+    return debit
+
+
+def summarize(name, results, latencies, seconds, initial, balances, ledger):
+    accepted = sum(1 for r in results if isinstance(r, int))
+    errors = [r for r in results if isinstance(r, Exception)]
+    spent = sum(initial.values()) - sum(balances.values())
+    row = {
+        "case": name,
+        "debits": len(results),
+        "seconds": round(seconds, 3),
+        "debits_per_s": round(len(results) / seconds, 1),
+        "p50_ms": ms(latencies[len(latencies) // 2]),
+        "p99_ms": ms(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]),
+        "accepted": accepted,
+        "refused": sum(1 for r in results if r is None),
+        "errors": len(errors),
+        "first_error": repr(errors[0])[:200] if errors else None,
+        "spent": spent,
+        "lost": accepted - spent,
+        "negative_balances": sum(1 for b in balances.values() if b < 0),
+    }
+    if ledger is not None:
+        # grant inicial + débitos aceitos, membro a membro
+        row["ledger_ok"] = all(ledger.get(m, 0) == balances.get(m) for m in initial)
+    row["totals_ok"] = row["lost"] == 0 and not row["negative_balances"] and row.get("ledger_ok", True)
+    return row
+
+
+async def benchmark(args):
+    from credits import CreditEngine
+    from database import SessionLocal, engine
+    from models import CreditLedgerEntry, User
+
+    credit_engine = CreditEngine()
+    credit_engine.configure(SessionLocal, User, CreditLedgerEntry)
+    cases = [case.strip() for case in args.cases.split(",") if case.strip()]
+
+    rows = []
+    for case in cases:
+        if case == "spread":
+            members = [f"{case}-{i}" for i in range(args.members)]
+            targets = [members[i % len(members)] for i in range(args.debits)]
+            initial = {member: args.debits for member in members}
+        elif case in ("hot", "legacy"):
+            members = [f"{case}-member"]
+            targets = members * args.debits
+            initial = {members[0]: int(args.debits * args.funded)}
+        else:
+            raise SystemExit(f"caso desconhecido: {case}")
+
+        # saldo inicial pelo mesmo caminho do webhook do Memberstack (entra no ledger)
+        for member, amount in initial.items():
+            await credit_engine.grant(member, amount, "bench")
+
+        if case == "legacy":
+            debit = legacy_debit(SessionLocal)
+        else:
+            async def debit(member_id):
+                return await credit_engine.reserve(member_id, 1, "bench")
+
+        results, latencies, seconds = await run_debits(debit, targets, args.concurrency)
+        balances, ledger = await balances_and_ledger(SessionLocal, members)
+        row = summarize(case, results, latencies, seconds, initial, balances,
+                        None if case == "legacy" else ledger)
+        rows.append(row)
+        print(f"   {case:<7} {row['debits']} débitos em {row['seconds']}s = {row['debits_per_s']}/s  "
+              f"p50 {row['p50_ms']} ms p99 {row['p99_ms']} ms  aceitas {row['accepted']} "
+              f"recusadas {row['refused']} erros {row['errors']}  lost {row['lost']}  "
+              f"{'✅ totais ok' if row['totals_ok'] else '❌ totais divergem'}")
+
+    await engine.dispose()
+    return {"database": engine.dialect.name, "concurrency": args.concurrency, "cases": rows}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    migrate()
+
+    result = asyncio.run(benchmark(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 {args.out}")
+
+    # só o engine novo tem que fechar os totais
+    if not all(row["totals_ok"] for row in result["cases"] if row["case"] != "legacy"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
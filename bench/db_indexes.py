@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# =========================================
+# BENCHMARK DOS ÍNDICES DE creations (0002)
+# =========================================
+# Monta um banco novo no schema 0001_baseline (sem índices), semeia
+# --rows creations espalhadas em --members membros e mede as duas
+# consultas quentes antes e depois de cada revisão em --revisions:
+#   status        SELECT por replicate_id (/status, /replicate-webhook)
+#   my-creations  primeira página da galeria (/my-creations/{member_id})
+# Para cada fase: p50/p95 de --samples consultas com chaves sorteadas e o
+# plano (EXPLAIN QUERY PLAN no sqlite, EXPLAIN ANALYZE no Postgres), além
+# do tempo do próprio upgrade.
+#
+# --duplicates semeia replicate_ids repetidos (mesmo membro) para exercitar
+# a limpeza que a 0002 faz antes do índice único.
+#
+#   python bench/db_indexes.py                      # sqlite temporário, 1M linhas
+#   python bench/db_indexes.py --database-url postgresql://postgres@/bench?host=/tmp/pgdata
+#   python bench/db_indexes.py --rows 100000 --revisions 0002_creations_indexes,head
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_BATCH = 10000
+GALLERY_PAGE = 24
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plano e latência das consultas de creations antes/depois dos índices")
+    parser.add_argument("--database-url", default=None,
+                        help="banco VAZIO para semear (padrão: sqlite temporário)")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--members", type=int, default=20_000)
+    parser.add_argument("--duplicates", type=int, default=0,
+                        help="replicate_ids gravados duas vezes no seed")
+    parser.add_argument("--samples", type=int, default=30, help="consultas por fase")
+    parser.add_argument("--revisions", default="0002_creations_indexes",
+                        help="revisões aplicadas em sequência, medindo depois de cada uma")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="grava o resultado em JSON")
+    return parser.parse_args(argv)
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {
+        "p50_ms": ms(ordered[len(ordered) // 2]),
+        "p95_ms": ms(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+    }
+
+
+async def seed(engine, args, rng):
+    from sqlalchemy import text
+
+    start = datetime(2025, 1, 1)
+    insert = text(
+        "INSERT INTO creations (memberstack_id, replicate_id, prompt, model, status, result_url, created_at) "
+        "VALUES (:memberstack_id, :replicate_id, :prompt, :model, :status, :result_url, :created_at)"
+    )
+    rows = []
+    for i in range(args.rows):
+        member = f"mem_{rng.randrange(args.members)}"
+        rows.append({
+            "memberstack_id": member,
+            "replicate_id": f"pred_{i:09d}",
+            "prompt": "benchmark prompt",
+            "model": "bench",
+            "status": "succeeded",
+            "result_url": f"https://res.cloudinary.com/bench/{i}.png",
+            "created_at": start + timedelta(seconds=i * 30),
+        })
+        if i < args.duplicates:
+            # segunda gravação da mesma prediction, ainda sem resultado
+            rows.append({**rows[-1], "status": "processing", "result_url": None})
+        if len(rows) >= SEED_BATCH:
+            async with engine.begin() as conn:
+                await conn.execute(insert, rows)
+            rows = []
+    if rows:
+        async with engine.begin() as conn:
+            await conn.execute(insert, rows)
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM ANALYZE creations"))
+    else:
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+
+
+async def measure(engine, args, rng):
+    from sqlalchemy import text
+
+    queries = {
+        "status": (
+            "SELECT id, status, result_url FROM creations WHERE replicate_id = :key",
+            lambda: {"key": f"pred_{rng.randrange(args.rows):09d}"},
+        ),
+        "my-creations": (
+            "SELECT id, replicate_id, status, result_url, created_at FROM creations "
+            f"WHERE memberstack_id = :key ORDER BY created_at DESC, id DESC LIMIT {GALLERY_PAGE + 1}",
+            lambda: {"key": f"mem_{rng.randrange(args.members)}"},
+        ),
+    }
+    explain = "EXPLAIN ANALYZE " if engine.dialect.name == "postgresql" else "EXPLAIN QUERY PLAN "
+    result = {}
+    async with engine.connect() as conn:
+        for name, (sql, params) in queries.items():
+            statement = text(sql)
+            await conn.execute(statement, params())  # aquece o cache de páginas
+            samples = []
+            for _ in range(args.samples):
+                bound = params()
+                t0 = time.perf_counter()
+                (await conn.execute(statement, bound)).all()
+                samples.append(time.perf_counter() - t0)
+            plan = (await conn.execute(text(explain + sql), params())).all()
+            result[name] = {
+                **summary(samples),
+                "plan": [" | ".join(str(col) for col in row) for row in plan],
+            }
+    return result
+
+
+def upgrade(revision):
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    t0 = time.perf_counter()
+    command.upgrade(config, revision)
+    return round(time.perf_counter() - t0, 2)
+
+
+def print_phase(name, phase):
+    print(f"\n== {name}")
+    if "upgrade_seconds" in phase:
+        print(f"   upgrade: {phase['upgrade_seconds']} s")
+    for query, data in phase["queries"].items():
+        print(f"   {query:13} p50 {data['p50_ms']} ms  p95 {data['p95_ms']} ms")
+        for line in data["plan"]:
+            print(f"      {line}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    workdir = None
+    if args.database_url is None:
+        workdir = tempfile.mkdtemp(prefix="db-indexes-")
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # database.py monta o engine a partir do DATABASE_URL no import
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import text
+    from database import engine
+
+    async def run(step, *extra):
+        try:
+            return await step(engine, *extra)
+        finally:
+            await engine.dispose()
+
+    async def count_creations(engine):
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT COUNT(*) FROM creations"))).scalar()
+
+    upgrade("0001_baseline")
+    t0 = time.perf_counter()
+    asyncio.run(run(seed, args, rng))
+    print(f"🌱 {args.rows} creations ({args.members} membros, {args.duplicates} duplicadas) "
+          f"em {time.perf_counter() - t0:.1f}s — {engine.dialect.name}")
+
+    phases = {"0001_baseline": {"queries": asyncio.run(run(measure, args, rng))}}
+    print_phase("0001_baseline", phases["0001_baseline"])
+    for revision in filter(None, args.revisions.split(",")):
+        seconds = upgrade(revision)
+        phases[revision] = {"upgrade_seconds": seconds, "queries": asyncio.run(run(measure, args, rng))}
+        print_phase(revision, phases[revision])
+
+    remaining = asyncio.run(run(count_creations))
+    print(f"\ncreations depois do upgrade: {remaining}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "dialect": engine.dialect.name,
+                "rows": args.rows,
+                "members": args.members,
+                "duplicates": args.duplicates,
+                "creations_after": remaining,
+                "phases": phases,
+            }, f, indent=2)
+        print(f"💾 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
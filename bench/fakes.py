@@ -0,0 +1,380 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import base64
+import hashlib
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+# =========================================
+# DUBLÊS LOCAIS DO REPLICATE E DO CLOUDINARY
+# =========================================
+# Um processo só, um app só (os prefixos não colidem):
+# - /v1/...    API do Replicate: create (por modelo ou por versão), get e
+#              cancel de predictions. A prediction passa por starting ->
+#              processing -> succeeded/failed em --run-time segundos e, se o
+#              create pediu webhook, o resultado é POSTado assinado no
+#              formato Standard Webhooks (o mesmo que o main.py confere)
+# - /v1_1/...  Cloudinary: upload (inclusive upload_large em chunks),
+#              destroy, delete_resources e listagem (sempre vazia)
+# - /outputs/  arquivos de output das predictions (--output-bytes)
+# - /_bench/   contadores e latências dos webhooks para o bench/run.py
+#
+# Latência e falhas injetadas são configuráveis por upstream. Tudo em
+# memória; o processo é descartado no fim de cada rodada.
+#
+# Uso isolado:  python bench/fakes.py --port 18900 --run-time 5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replicate/Cloudinary falsos para benchmark")
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18900)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser):
+    # também usado pelo bench/run.py, que repassa os mesmos flags
+    group = parser.add_argument_group("fakes")
+    group.add_argument("--replicate-latency", type=float, default=0.05,
+                       help="latência média das chamadas à API do Replicate (s)")
+    group.add_argument("--replicate-error-rate", type=float, default=0.0,
+                       help="fração das chamadas que voltam 500")
+    group.add_argument("--replicate-throttle-rate", type=float, default=0.0,
+                       help="fração das chamadas que voltam 429 + Retry-After")
+    group.add_argument("--run-time", type=float, default=3.0,
+                       help="duração média de uma prediction até terminar (s)")
+    group.add_argument("--prediction-failure-rate", type=float, default=0.0,
+                       help="fração das predictions que terminam em failed")
+    group.add_argument("--webhook-secret", default=os.getenv("REPLICATE_WEBHOOK_SECRET"),
+                       help="whsec_... usado para assinar os webhooks (sem: não assina)")
+    group.add_argument("--cloudinary-latency", type=float, default=0.1,
+                       help="latência média de um upload/delete no Cloudinary (s)")
+    group.add_argument("--cloudinary-error-rate", type=float, default=0.0,
+                       help="fração das chamadas ao Cloudinary que voltam 500")
+    group.add_argument("--output-bytes", type=int, default=256 * 1024,
+                       help="tamanho do arquivo de output de cada prediction")
+    return group
+
+
+def _jitter(mean):
+    # exponencial em volta da média: cauda longa como a de uma API real
+    return random.expovariate(1 / mean) if mean > 0 else 0.0
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime())
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(0.50) * 1000, 1),
+        "p95_ms": round(rank(0.95) * 1000, 1),
+        "p99_ms": round(rank(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+
+def sign_webhook(secret, webhook_id, timestamp, body: bytes):
+    key = base64.b64decode(secret.removeprefix("whsec_"))
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    return "v1," + base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+
+
+class FakeUpstreams:
+    def __init__(self, options):
+        self.options = options
+        self.predictions = {}
+        self._webhooks = {}
+        self._tasks = set()
+        self._webhook_client = None
+        self._output = b"\0" * options.output_bytes
+
+        self.counters = {}
+        # requests simultâneos por operação (agora / pico): um dispatch
+        # serializado no app aparece como pico 1
+        self.inflight = {}
+        self.peak_inflight = {}
+        self.webhook_latencies = []
+        self.webhook_statuses = {}
+
+    def count(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    @asynccontextmanager
+    async def track(self, name):
+        self.inflight[name] = self.inflight.get(name, 0) + 1
+        self.peak_inflight[name] = max(self.peak_inflight.get(name, 0), self.inflight[name])
+        try:
+            yield
+        finally:
+            self.inflight[name] -= 1
+
+    async def start(self):
+        self._webhook_client = httpx.AsyncClient(timeout=30)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await self._webhook_client.aclose()
+
+    async def inject(self, upstream, latency, error_rate, throttle_rate=0.0):
+        """Latência + falha injetada. Retorna a resposta de erro ou None."""
+        await asyncio.sleep(_jitter(latency))
+        roll = random.random()
+        if roll < error_rate:
+            self.count(f"{upstream}_injected_500")
+            return JSONResponse(status_code=500, content={"detail": "injected failure"})
+        if roll < error_rate + throttle_rate:
+            self.count(f"{upstream}_injected_429")
+            return JSONResponse(status_code=429, content={"detail": "throttled"}, headers={"Retry-After": "1"})
+        return None
+
+    # -----------------------------
+    # Replicate
+    # -----------------------------
+    def create(self, request, model, body):
+        prediction_id = uuid.uuid4().hex[:26]
+        base = str(request.base_url).rstrip("/")
+        prediction = {
+            "id": prediction_id,
+            "model": model,
+            "version": body.get("version") or "bench",
+            "status": "starting",
+            "input": body.get("input") or {},
+            "output": None,
+            "logs": "",
+            "error": None,
+            "metrics": {},
+            "created_at": _now(),
+            "started_at": None,
+            "completed_at": None,
+            "urls": {
+                "get": f"{base}/v1/predictions/{prediction_id}",
+                "cancel": f"{base}/v1/predictions/{prediction_id}/cancel",
+            },
+        }
+        self.predictions[prediction_id] = prediction
+        self._webhooks[prediction_id] = body.get("webhook")
+        self.count("predictions_created")
+
+        self._spawn(self._run(prediction, base))
+        return prediction
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, prediction, base):
+        run_time = _jitter(self.options.run_time)
+        await asyncio.sleep(run_time * 0.1)
+        if prediction["status"] != "starting":
+            return
+        prediction["status"] = "processing"
+        prediction["started_at"] = _now()
+
+        await asyncio.sleep(run_time * 0.9)
+        if prediction["status"] != "processing":
+            return
+
+        if random.random() < self.options.prediction_failure_rate:
+            prediction["status"] = "failed"
+            prediction["error"] = "injected prediction failure"
+        else:
+            prediction["status"] = "succeeded"
+            prediction["output"] = f"{base}/outputs/{prediction['id']}.mp4"
+        prediction["completed_at"] = _now()
+        self.count(f"predictions_{prediction['status']}")
+        await self._deliver(prediction)
+
+    async def _deliver(self, prediction):
+        url = self._webhooks.get(prediction["id"])
+        if not url:
+            return
+
+        body = json.dumps(prediction).encode()
+        webhook_id = f"msg_{uuid.uuid4().hex}"
+        timestamp = str(int(time.time()))
+        headers = {"content-type": "application/json", "webhook-id": webhook_id, "webhook-timestamp": timestamp}
+        if self.options.webhook_secret:
+            headers["webhook-signature"] = sign_webhook(self.options.webhook_secret, webhook_id, timestamp, body)
+
+        started = time.perf_counter()
+        try:
+            response = await self._webhook_client.post(url, content=body, headers=headers)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.webhook_latencies.append(time.perf_counter() - started)
+        self.webhook_statuses[status] = self.webhook_statuses.get(status, 0) + 1
+
+    def cancel(self, prediction):
+        if prediction["status"] in ["starting", "processing"]:
+            prediction["status"] = "canceled"
+            prediction["completed_at"] = _now()
+            self.count("predictions_canceled")
+            self._spawn(self._deliver(prediction))
+        return prediction
+
+    def stats(self):
+        statuses = {}
+        for prediction in self.predictions.values():
+            statuses[prediction["status"]] = statuses.get(prediction["status"], 0) + 1
+        return {
+            "counters": self.counters,
+            "peak_inflight": self.peak_inflight,
+            "predictions": statuses,
+            "webhooks": {**percentiles(self.webhook_latencies), "status": self.webhook_statuses},
+        }
+
+
+def create_app(options):
+    fakes = FakeUpstreams(options)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await fakes.start()
+        yield
+        await fakes.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.fakes = fakes
+
+    async def replicate_fault():
+        return await fakes.inject(
+            "replicate", options.replicate_latency,
+            options.replicate_error_rate, options.replicate_throttle_rate
+        )
+
+    @app.post("/v1/models/{owner}/{name}/predictions")
+    async def create_model_prediction(owner: str, name: str, request: Request):
+        fakes.count("replicate_create")
+        async with fakes.track("replicate_create"):
+            if error := await replicate_fault():
+                return error
+        return JSONResponse(status_code=201, content=fakes.create(request, f"{owner}/{name}", await request.json()))
+
+    @app.post("/v1/predictions")
+    async def create_version_prediction(request: Request):
+        fakes.count("replicate_create")
+        async with fakes.track("replicate_create"):
+            if error := await replicate_fault():
+                return error
+        body = await request.json()
+        return JSONResponse(status_code=201, content=fakes.create(request, body.get("version", "bench"), body))
+
+    @app.get("/v1/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str):
+        fakes.count("replicate_get")
+        async with fakes.track("replicate_get"):
+            if error := await replicate_fault():
+                return error
+        prediction = fakes.predictions.get(prediction_id)
+        if not prediction:
+            return JSONResponse(status_code=404, content={"detail": "Not found."})
+        return prediction
+
+    @app.post("/v1/predictions/{prediction_id}/cancel")
+    async def cancel_prediction(prediction_id: str):
+        fakes.count("replicate_cancel")
+        if error := await replicate_fault():
+            return error
+        prediction = fakes.predictions.get(prediction_id)
+        if not prediction:
+            return JSONResponse(status_code=404, content={"detail": "Not found."})
+        return fakes.cancel(prediction)
+
+    @app.get("/outputs/{filename}")
+    async def output_file(filename: str):
+        fakes.count("output_fetch")
+        return Response(fakes._output, media_type="video/mp4")
+
+    # -----------------------------
+    # Cloudinary
+    # -----------------------------
+    async def cloudinary_fault():
+        return await fakes.inject("cloudinary", options.cloudinary_latency, options.cloudinary_error_rate)
+
+    @app.post("/v1_1/{cloud}/{resource_type}/upload")
+    async def upload(cloud: str, resource_type: str, request: Request):
+        fakes.count("cloudinary_upload")
+        form = await request.form()
+        if error := await cloudinary_fault():
+            return error
+
+        file = form.get("file")
+        size = file.size if hasattr(file, "size") else len(str(file or ""))
+        folder = form.get("folder")
+        # chunks do upload_large compartilham o X-Unique-Upload-Id
+        public_id = form.get("public_id") or (request.headers.get("x-unique-upload-id") or uuid.uuid4().hex)[:20]
+        if folder and not public_id.startswith(f"{folder}/"):
+            public_id = f"{folder}/{public_id}"
+
+        base = str(request.base_url).rstrip("/")
+        return {
+            "public_id": public_id,
+            "version": 1,
+            "resource_type": "image" if resource_type == "auto" else resource_type,
+            "type": "upload",
+            "bytes": size,
+            "created_at": _now(),
+            "secure_url": f"{base}/res/{cloud}/{public_id}",
+            "url": f"{base}/res/{cloud}/{public_id}",
+        }
+
+    @app.post("/v1_1/{cloud}/{resource_type}/destroy")
+    async def destroy(cloud: str, resource_type: str):
+        fakes.count("cloudinary_destroy")
+        if error := await cloudinary_fault():
+            return error
+        return {"result": "ok"}
+
+    @app.delete("/v1_1/{cloud}/resources/{resource_type}/{upload_type}")
+    async def delete_resources(cloud: str, resource_type: str, upload_type: str, request: Request):
+        fakes.count("cloudinary_delete_resources")
+        if error := await cloudinary_fault():
+            return error
+        body = await request.body()
+        public_ids = json.loads(body).get("public_ids", []) if body else request.query_params.getlist("public_ids[]")
+        return {"deleted": {public_id: "deleted" for public_id in public_ids}, "partial": False}
+
+    @app.get("/v1_1/{cloud}/resources/{resource_type}/{upload_type}")
+    async def list_resources(cloud: str, resource_type: str, upload_type: str):
+        fakes.count("cloudinary_list")
+        return {"resources": []}
+
+    # -----------------------------
+    # Controle do benchmark
+    # -----------------------------
+    @app.get("/_bench/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/_bench/stats")
+    async def bench_stats():
+        return fakes.stats()
+
+    return app
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    uvicorn.run(create_app(options), host=options.host, port=options.port, log_level="warning")
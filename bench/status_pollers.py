@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+from fakes import add_arguments
+from run import (
+    ROOT, PNG, Processes, app_environment, fake_arguments, free_port, grant_credits, wait_ready
+)
+
+# =========================================
+# BENCHMARK DO /status COM VÁRIOS POLLERS POR PREDICTION
+# =========================================
+# Cenário da galeria: várias abas fazendo poll da mesma prediction longa.
+# Cria --predictions predictions de um modelo com Creation (--model; o
+# /status só consulta o Replicate para elas) que não terminam durante a
+# medição e, para cada P em --pollers, põe P pollers por prediction
+# chamando GET /status/{id} a cada --interval segundos por --seconds.
+#
+# Mede, por P: polls feitos, GETs que chegaram ao Replicate falso e os
+# contadores do /status-cache/stats (hits, misses, coalesced). Com o cache
+# + singleflight, os GETs no upstream ficam ~constantes (um por prediction
+# a cada STATUS_CACHE_TTL) enquanto os polls crescem com P.
+#
+#   python bench/status_pollers.py
+#   python bench/status_pollers.py --pollers 1,10,50 --app-env STATUS_CACHE_TTL=0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GETs no Replicate por número de pollers do /status")
+    parser.add_argument("--pollers", default="1,2,5,10,20", help="pollers por prediction, por fase")
+    parser.add_argument("--predictions", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=1.0, help="segundos entre polls de um poller")
+    parser.add_argument("--seconds", type=float, default=10, help="duração de cada fase")
+    parser.add_argument("--model", default="nano-banana", help="slug de um modelo com Creation")
+    parser.add_argument("--database-url", default=None, help="padrão: sqlite temporário")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="variável extra para o app (repetível), ex. STATUS_CACHE_TTL=0")
+    parser.add_argument("--out", default=None, help="grava o resultado em JSON")
+    add_arguments(parser)
+    # predictions "processing" durante todas as fases
+    parser.set_defaults(run_time=3600)
+    return parser.parse_args(argv)
+
+
+async def create_predictions(client, args, member_id):
+    sys.path.insert(0, ROOT)
+    from model_registry import MODEL_REGISTRY
+
+    spec = MODEL_REGISTRY[args.model]
+    if not spec.tracked:
+        raise SystemExit(f"{args.model} não grava Creation: o /status não consulta o Replicate")
+
+    ids = []
+    for i in range(args.predictions):
+        files = [
+            (field.name, (f"{field.name}.png", PNG + os.urandom(16), "image/png"))
+            for field in spec.images if field.required
+        ]
+        response = await client.post(
+            f"/generate/{args.model}", data={"prompt": f"poller bench {i}", "member_id": member_id},
+            files=files or None
+        )
+        response.raise_for_status()
+        ids.append(response.json()["prediction_id"])
+    return ids
+
+
+async def poll_phase(client, fake_client, args, prediction_ids, pollers):
+    before_gets = (await fake_client.get("/_bench/stats")).json()["counters"].get("replicate_get", 0)
+    before_cache = (await client.get("/status-cache/stats")).json()
+    polls = errors = 0
+    deadline = time.monotonic() + args.seconds
+
+    async def poller(prediction_id):
+        nonlocal polls, errors
+        # abas abertas em momentos diferentes
+        await asyncio.sleep(random.uniform(0, args.interval))
+        while time.monotonic() < deadline:
+            response = await client.get(f"/status/{prediction_id}")
+            polls += 1
+            errors += response.status_code != 200
+            await asyncio.sleep(args.interval)
+
+    await asyncio.gather(*(poller(pid) for pid in prediction_ids for _ in range(pollers)))
+
+    gets = (await fake_client.get("/_bench/stats")).json()["counters"].get("replicate_get", 0) - before_gets
+    cache = (await client.get("/status-cache/stats")).json()
+    return {
+        "pollers": pollers,
+        "polls": polls,
+        "errors": errors,
+        "upstream_gets": gets,
+        "gets_per_poll": round(gets / polls, 3) if polls else None,
+        **{key: cache[key] - before_cache[key] for key in ("hits", "misses", "coalesced")},
+    }
+
+
+async def benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="bench-pollers-")
+    app_port, fake_port = free_port(), free_port()
+    env = app_environment(args, app_port, fake_port, workdir)
+
+    migrate = subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, capture_output=True, text=True)
+    if migrate.returncode:
+        raise SystemExit(f"init_db.py falhou:\n{migrate.stdout}{migrate.stderr}")
+
+    processes = Processes(workdir)
+    try:
+        fakes = processes.spawn("fakes", [sys.executable, os.path.join("bench", "fakes.py"),
+                                          *fake_arguments(args, fake_port)])
+        app = processes.spawn("app", [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning",
+        ], env=env)
+
+        async with (
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=60,
+                              limits=httpx.Limits(max_connections=200, keepalive_expiry=4)) as client,
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{fake_port}", timeout=30) as fake_client,
+        ):
+            await wait_ready(fake_client, "/_bench/health", fakes, processes, "fakes")
+            await wait_ready(client, "/", app, processes, "app")
+
+            member_id = "bench-poller"
+            await grant_credits(client, member_id)
+            prediction_ids = await create_predictions(client, args, member_id)
+            print(f"🚀 {len(prediction_ids)} predictions, {args.seconds:.0f}s por fase, poll a cada {args.interval}s")
+
+            phases = []
+            for pollers in [int(p) for p in args.pollers.split(",")]:
+                phase = await poll_phase(client, fake_client, args, prediction_ids, pollers)
+                phases.append(phase)
+                print(f"   {pollers:>3} pollers/prediction: {phase['polls']:>5} polls -> "
+                      f"{phase['upstream_gets']:>4} GETs no Replicate ({phase['gets_per_poll']}/poll)  "
+                      f"hits {phase['hits']} misses {phase['misses']} coalesced {phase['coalesced']}")
+    finally:
+        processes.stop()
+
+    return {"predictions": args.predictions, "interval": args.interval, "seconds": args.seconds,
+            "app_env": args.app_env, "phases": phases}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(benchmark(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
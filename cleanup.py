@@ -0,0 +1,200 @@
+import os
+import logging
+import asyncio
+from datetime import datetime, timezone, timedelta
+import cloudinary.api
+from upload_cache import upload_cache, UPLOAD_CACHE_TTL, UPLOAD_CACHE_HIT_MARGIN
+from prediction_context import prediction_contexts
+from result_cache import result_cache
+from resilience import cloudinary_call
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# CLEANUP DOS ASSETS TEMPORÁRIOS
+# =========================================
+# - fila em background: public_ids são agrupados em chamadas
+#   cloudinary.api.delete_resources (até 100 por chamada)
+# - varredura periódica: lista as pastas *-temp por prefixo e remove assets
+#   mais velhos que TEMP_ASSET_MAX_AGE (sobras de restarts, predictions sem
+#   webhook, etc.)
+
+TEMP_FOLDERS = [
+    "sora2-temp",
+    "sora2-pro-temp",
+    "kling-temp",
+    "gen4-temp",
+    "veo3-temp",
+    "veo3-fast-temp",
+    "nanobanana-temp",
+    "seedream-temp",
+    "flux-kontext-temp",
+    "flux-2-pro-temp",
+    "batch-temp",
+]
+
+CLEANUP_BATCH_SIZE = 100  # limite do delete_resources
+CLEANUP_FLUSH_INTERVAL = float(os.getenv("CLEANUP_FLUSH_INTERVAL", "5"))
+
+TEMP_SWEEP_ENABLED = os.getenv("TEMP_SWEEP_ENABLED", "true").lower() in ["true", "1", "yes"]
+TEMP_SWEEP_INTERVAL = int(os.getenv("TEMP_SWEEP_INTERVAL", "3600"))
+# Nunca menor que a vida de uma entrada do cache de uploads
+TEMP_ASSET_MAX_AGE = max(
+    int(os.getenv("TEMP_ASSET_MAX_AGE", str(24 * 3600))),
+    UPLOAD_CACHE_TTL + UPLOAD_CACHE_HIT_MARGIN
+)
+
+
+class TempAssetCleaner:
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+        self.queued = 0
+        self.deleted = 0
+        self.failed = 0
+        self.swept = 0
+
+    # -----------------------------
+    # Fila
+    # -----------------------------
+    def enqueue(self, public_ids):
+        for public_id in public_ids or []:
+            self._queue.put_nowait(public_id)
+            self.queued += 1
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = {await self._queue.get()}
+        deadline = loop.time() + CLEANUP_FLUSH_INTERVAL
+
+        while len(batch) < CLEANUP_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.add(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return list(batch)
+
+    async def _delete(self, public_ids):
+        try:
+            result = await cloudinary_call(
+                cloudinary.api.delete_resources,
+                public_ids,
+                resource_type="image",
+                idempotent=True,
+                background=True
+            )
+        except Exception as e:
+            logger.warning("Cloudinary cleanup error: %s", e)
+            self.failed += len(public_ids)
+            return
+
+        # "not_found" também conta: o asset já não existe
+        for public_id in public_ids:
+            if result.get("deleted", {}).get(public_id) in ["deleted", "not_found"]:
+                self.deleted += 1
+            else:
+                self.failed += 1
+
+    async def _drain_forever(self):
+        while True:
+            await self._delete(await self._next_batch())
+
+    # -----------------------------
+    # Varredura
+    # -----------------------------
+    def _list_orphans(self, folder, cutoff, timeout=None):
+        orphans = []
+        next_cursor = None
+
+        while True:
+            options = {
+                "type": "upload",
+                "prefix": f"{folder}/",
+                "direction": "asc",
+                "max_results": 500,
+            }
+            if next_cursor:
+                options["next_cursor"] = next_cursor
+
+            page = cloudinary.api.resources(**options, timeout=timeout)
+
+            for resource in page.get("resources", []):
+                created_at = datetime.fromisoformat(resource["created_at"].replace("Z", "+00:00"))
+                if created_at >= cutoff:
+                    # ordem crescente: o resto é mais novo
+                    return orphans
+                if not upload_cache.in_use(resource["public_id"]):
+                    orphans.append(resource["public_id"])
+
+            next_cursor = page.get("next_cursor")
+            if not next_cursor:
+                return orphans
+
+    async def sweep(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=TEMP_ASSET_MAX_AGE)
+
+        for folder in TEMP_FOLDERS:
+            try:
+                orphans = await cloudinary_call(
+                    self._list_orphans, folder, cutoff, idempotent=True, background=True
+                )
+            except Exception as e:
+                logger.warning("Cloudinary sweep error (%s): %s", folder, e)
+                continue
+
+            self.swept += len(orphans)
+            self.enqueue(orphans)
+
+        try:
+            await prediction_contexts.purge_expired()
+        except Exception as e:
+            logger.warning("Prediction context purge error: %s", e)
+
+        if result_cache.session_factory:
+            try:
+                await result_cache.purge()
+            except Exception as e:
+                logger.warning("Result cache purge error: %s", e)
+
+    async def _sweep_forever(self):
+        while True:
+            await self.sweep()
+            await asyncio.sleep(TEMP_SWEEP_INTERVAL)
+
+    # -----------------------------
+    # Lifespan
+    # -----------------------------
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._drain_forever()))
+        if TEMP_SWEEP_ENABLED:
+            self._tasks.append(asyncio.create_task(self._sweep_forever()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # última leva; o que sobrar a varredura recolhe depois
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for i in range(0, len(pending), CLEANUP_BATCH_SIZE):
+            await self._delete(pending[i:i + CLEANUP_BATCH_SIZE])
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "swept": self.swept,
+            "pending": self._queue.qsize(),
+        }
+
+
+temp_asset_cleaner = TempAssetCleaner()
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import uuid
+from collections import OrderedDict
+from sqlalchemy import select, literal, or_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# =========================================
+# CRÉDITOS (RESERVA ATÔMICA + LEDGER)
+# =========================================
+# Cada movimento é um único UPSERT condicional:
+#   INSERT INTO users ... SELECT :id, :initial + :delta
+#   WHERE :initial + :delta >= 0 OR EXISTS (membro já existe)
+#   ON CONFLICT (memberstack_id)
+#   DO UPDATE SET credits = users.credits + :delta WHERE users.credits + :delta >= 0
+#   RETURNING credits
+# Sem linha retornada = saldo insuficiente. Duas requests concorrentes nunca
+# debitam o mesmo crédito (o lock da linha serializa os UPDATEs).
+#
+# Cada movimento aplicado grava uma linha no credit_ledger (append-only).
+# No Postgres o ledger vai no mesmo statement (CTE); no sqlite (dev), na
+# mesma transação.
+#
+# Saldos lidos pelo /user-credits ficam em cache por CREDITS_CACHE_TTL e são
+# atualizados (write-through) a cada movimento feito por este worker. Os
+# outros workers ficam sabendo assim:
+# - EVENTS_BROKER=postgres: o mesmo statement do movimento faz pg_notify em
+#   BALANCES_CHANNEL (entregue no commit); cada worker escuta pelo broker de
+#   eventos e invalida a entrada
+# - sem isso e com WEB_CONCURRENCY > 1: o TTL cai para
+#   CREDITS_CACHE_TTL_UNSHARED (um grant pode levar esse tempo para aparecer)
+
+NEW_MEMBER_CREDITS = 50
+CREDITS_CACHE_TTL = float(os.getenv("CREDITS_CACHE_TTL", "30"))
+CREDITS_CACHE_TTL_UNSHARED = float(os.getenv("CREDITS_CACHE_TTL_UNSHARED", "2"))
+CREDITS_CACHE_MAX_ENTRIES = int(os.getenv("CREDITS_CACHE_MAX_ENTRIES", "10000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+BALANCES_CHANNEL = "credit_balances"
+
+
+class BalanceCache:
+    def __init__(self, ttl=CREDITS_CACHE_TTL, max_entries=CREDITS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # memberstack_id -> (expires_at, saldo)
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, member_id: str):
+        entry = self._entries.get(member_id)
+        if not entry or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(member_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, member_id: str, balance: int):
+        self._entries.pop(member_id, None)
+        self._entries[member_id] = (time.monotonic() + self.ttl, balance)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, member_id: str):
+        self._entries.pop(member_id, None)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CreditEngine:
+    def __init__(self):
+        self.session_factory = None
+        self.user_model = None
+        self.ledger_model = None
+        self.balances = BalanceCache()
+
+        # invalidação entre workers (Postgres NOTIFY)
+        self.notify = False
+        self.origin = uuid.uuid4().hex
+        self.remote_invalidations = 0
+
+    def configure(self, session_factory, user_model, ledger_model, notify=False):
+        """
+        notify=True: cada movimento avisa os outros workers (pg_notify em
+        BALANCES_CHANNEL); quem escuta chama balance_changed.
+        """
+        self.session_factory = session_factory
+        self.user_model = user_model
+        self.ledger_model = ledger_model
+        self.notify = notify
+
+        if WEB_CONCURRENCY > 1 and not notify:
+            self.balances.ttl = min(self.balances.ttl, CREDITS_CACHE_TTL_UNSHARED)
+
+    def balance_changed(self, payload: str):
+        # NOTIFY de um movimento; o próprio worker já fez o write-through
+        message = json.loads(payload)
+        if message["origin"] != self.origin:
+            self.balances.invalidate(message["member_id"])
+            self.remote_invalidations += 1
+
+    async def reserve(self, member_id: str, cost: int, reason: str):
+        """
+        Debita `cost` se houver saldo. Retorna o saldo novo, ou None se
+        o saldo for insuficiente. Membro novo nasce com NEW_MEMBER_CREDITS.
+        """
+        return await self._apply(member_id, -cost, reason)
+
+    async def release(self, member_id: str, cost: int, reason: str):
+        # devolve uma reserva cujo dispatch falhou
+        return await self._apply(member_id, cost, "release:" + reason)
+
+    async def grant(self, member_id: str, amount: int, reason: str):
+        # membro criado pelo webhook começa do zero (sem créditos de boas-vindas)
+        return await self._apply(member_id, amount, reason, initial=0)
+
+    # -----------------------------
+    # DB
+    # -----------------------------
+    def _upsert(self, dialect, member_id, delta, initial):
+        User = self.user_model
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+
+        # INSERT ... SELECT com WHERE: membro novo também não nasce negativo.
+        # Membro existente sempre gera a linha, para cair no ON CONFLICT
+        # (sem linha inserida nem atualizada = saldo insuficiente)
+        opening = literal(initial + delta)
+        exists = select(User.id).where(User.memberstack_id == member_id).exists()
+        stmt = insert(User).from_select(
+            ["memberstack_id", "credits"],
+            select(literal(member_id), opening).where(or_(opening >= 0, exists)),
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[User.memberstack_id],
+            set_={"credits": User.credits + delta},
+            where=(User.credits + delta >= 0) if delta < 0 else None,
+        ).returning(User.credits)
+
+    def _ledger_insert(self, balance, member_id, delta, reason):
+        Ledger = self.ledger_model
+        return Ledger.__table__.insert().from_select(
+            ["memberstack_id", "delta", "balance", "reason"],
+            select(literal(member_id), literal(delta), balance, literal(reason))
+        )
+
+    async def _apply(self, member_id, delta, reason, initial=NEW_MEMBER_CREDITS):
+        async with self.session_factory() as db:
+            dialect = db.bind.dialect.name
+            upsert = self._upsert(dialect, member_id, delta, initial)
+
+            if dialect == "postgresql" and delta:
+                debit = upsert.cte("debit")
+                entry = self._ledger_insert(debit.c.credits, member_id, delta, reason).cte("entry")
+                columns = [debit.c.credits]
+                if self.notify:
+                    # só roda se o movimento foi aplicado (uma linha em debit)
+                    payload = json.dumps({"member_id": member_id, "origin": self.origin})
+                    columns.append(func.pg_notify(BALANCES_CHANNEL, payload))
+                row = (await db.execute(select(*columns).add_cte(entry))).first()
+                balance = row[0] if row else None
+            else:
+                balance = await db.scalar(upsert)
+                if balance is not None and delta:
+                    await db.execute(self._ledger_insert(literal(balance), member_id, delta, reason))
+
+            await db.commit()
+
+        if balance is None:
+            # saldo insuficiente: o valor em cache pode estar desatualizado
+            self.balances.invalidate(member_id)
+        else:
+            self.balances.set(member_id, balance)
+
+        return balance
+
+    async def balance(self, member_id: str):
+        """
+        Saldo do membro (0 se ainda não existe), servido do cache quando possível.
+        """
+        balance = self.balances.get(member_id)
+        if balance is not None:
+            return balance
+
+        async with self.session_factory() as db:
+            balance = await db.scalar(
+                select(self.user_model.credits)
+                .where(self.user_model.memberstack_id == member_id)
+            ) or 0
+
+        self.balances.set(member_id, balance)
+        return balance
+
+    def stats(self):
+        return {
+            **self.balances.stats(),
+            "notify": self.notify,
+            "remote_invalidations": self.remote_invalidations,
+        }
+
+
+credit_engine = CreditEngine()
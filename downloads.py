@@ -0,0 +1,123 @@
+import os
+import asyncio
+import httpx
+from resilience import output_upstream, OUTPUT_FETCH_TIMEOUT
+
+# =========================================
+# PROXY DE DOWNLOAD DOS OUTPUTS (STREAMING)
+# =========================================
+# GET /download/{prediction_id} repassa o output do Replicate em pedaços de
+# OUTPUT_STREAM_CHUNK bytes: nada é bufferizado inteiro em memória nem
+# gravado em disco, então o uso de memória não depende do tamanho do vídeo.
+#
+# Range / If-Range são repassados ao upstream (o player consegue dar seek):
+# 206 + Content-Range voltam como vieram. Content-Type, Content-Length,
+# ETag etc. também. O corpo vai cru (aiter_raw), então o Content-Length e o
+# Content-Encoding do upstream continuam válidos.
+#
+# Um httpx.AsyncClient por processo, aberto/fechado no lifespan.
+
+OUTPUT_STREAM_CHUNK = int(os.getenv("OUTPUT_STREAM_CHUNK", str(64 * 1024)))
+OUTPUT_MAX_CONNECTIONS = int(os.getenv("OUTPUT_MAX_CONNECTIONS", "50"))
+
+FORWARD_REQUEST_HEADERS = ["range", "if-range", "if-none-match", "if-modified-since"]
+FORWARD_RESPONSE_HEADERS = [
+    "content-type",
+    "content-length",
+    "content-range",
+    "content-encoding",
+    "accept-ranges",
+    "etag",
+    "last-modified",
+]
+
+
+class OutputProxy:
+    def __init__(self, chunk_size=OUTPUT_STREAM_CHUNK, max_connections=OUTPUT_MAX_CONNECTIONS):
+        self.chunk_size = chunk_size
+        self.max_connections = max_connections
+        self._client = None
+
+        self.active = 0
+        self.streams = 0
+        self.ranged = 0
+        self.bytes_sent = 0
+        self.aborted = 0
+
+    def open(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(OUTPUT_FETCH_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_connections),
+                follow_redirects=True,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url: str, request_headers):
+        """
+        Abre o output no upstream (só status + headers). O corpo fica no
+        stream; quem chama precisa consumir com relay() ou fechar.
+        """
+        self.open()
+        headers = {
+            name: request_headers[name]
+            for name in FORWARD_REQUEST_HEADERS
+            if name in request_headers
+        }
+        # o corpo vai cru para o cliente: não pede compressão que ele não pediu
+        headers["accept-encoding"] = request_headers.get("accept-encoding", "identity")
+
+        async def attempt():
+            response = await self._client.send(
+                self._client.build_request("GET", url, headers=headers),
+                stream=True
+            )
+            if response.status_code >= 500:
+                await response.aclose()
+                response.raise_for_status()
+            return response
+
+        response = await output_upstream.call(attempt, idempotent=True)
+        if "range" in headers and response.status_code == 206:
+            self.ranged += 1
+        return response
+
+    def response_headers(self, response):
+        return {
+            name: response.headers[name]
+            for name in FORWARD_RESPONSE_HEADERS
+            if name in response.headers
+        }
+
+    async def relay(self, response):
+        self.active += 1
+        self.streams += 1
+        completed = False
+        try:
+            async for chunk in response.aiter_raw(self.chunk_size):
+                self.bytes_sent += len(chunk)
+                yield chunk
+            completed = True
+        finally:
+            self.active -= 1
+            if not completed:
+                # cliente desconectou (ou seek: o player abre outro Range)
+                self.aborted += 1
+            # shield: no disconnect a task está sendo cancelada
+            await asyncio.shield(response.aclose())
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "streams": self.streams,
+            "ranged": self.ranged,
+            "aborted": self.aborted,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+output_proxy = OutputProxy()
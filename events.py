@@ -0,0 +1,196 @@
+import os
+import logging
+import json
+import asyncio
+import asyncpg
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# PUB/SUB DE EVENTOS DAS PREDICTIONS
+# =========================================
+# Alimentado pelo /replicate-webhook e pelo pool de transferência; consumido
+# pelo SSE (/events/{id}) e pelo WebSocket (/ws/events/{id}).
+#
+# Brokers:
+# - "local":    fan-out em memória (um worker / testes)
+# - "postgres": LISTEN/NOTIFY no banco existente; cada worker escuta o canal
+#               e repassa para os seus assinantes locais
+#
+# A mesma conexão de LISTEN atende outros canais registrados com listen()
+# (ex. credits.BALANCES_CHANNEL). observe() recebe todos os eventos de
+# prediction que chegam ao worker (ex. fair_scheduler.prediction_event).
+
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "local")
+EVENTS_CHANNEL = "prediction_events"
+SUBSCRIBER_QUEUE_SIZE = 32
+LISTENER_HEARTBEAT = 10
+
+
+class LocalBroker:
+    def __init__(self):
+        # prediction_id -> set de filas (uma por assinante)
+        self._subscribers = {}
+        # canal extra -> callback(payload), ex. invalidação do cache de créditos
+        self._channels = {}
+        # callback(prediction_id, event) para todo evento, com ou sem assinante
+        self._observers = []
+        self.published = 0
+        self.delivered = 0
+
+    def listen(self, channel: str, callback):
+        # processo único: quem publica já atualizou o próprio estado
+        self._channels[channel] = callback
+
+    def observe(self, callback):
+        self._observers.append(callback)
+
+    def subscribe(self, prediction_id: str):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(prediction_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, prediction_id: str, queue):
+        subscribers = self._subscribers.get(prediction_id)
+        if not subscribers:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[prediction_id]
+
+    async def publish(self, prediction_id: str, event: dict):
+        self.published += 1
+        self._fan_out(prediction_id, event)
+
+    def _fan_out(self, prediction_id, event):
+        for callback in self._observers:
+            try:
+                callback(prediction_id, event)
+            except Exception as e:
+                logger.warning("Event observer error: %s", e)
+        for queue in list(self._subscribers.get(prediction_id, ())):
+            if queue.full():
+                # assinante lento: descarta o evento mais antigo
+                queue.get_nowait()
+            queue.put_nowait(event)
+            self.delivered += 1
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self):
+        return {
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "predictions": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+class PostgresBroker(LocalBroker):
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        # conexão asyncpg dedicada ao LISTEN, fora do pool do SQLAlchemy
+        self.dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._task = None
+
+    async def publish(self, prediction_id: str, event: dict):
+        self.published += 1
+        payload = json.dumps({"prediction_id": prediction_id, "event": event})
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": EVENTS_CHANNEL, "payload": payload}
+            )
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        self._fan_out(message["prediction_id"], message["event"])
+
+    @staticmethod
+    def _forward(callback):
+        def on_notify(connection, pid, channel, payload):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.warning("Listener error (%s): %s", channel, e)
+        return on_notify
+
+    async def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                await conn.add_listener(EVENTS_CHANNEL, self._on_notify)
+                for channel, callback in self._channels.items():
+                    await conn.add_listener(channel, self._forward(callback))
+                while True:
+                    await asyncio.sleep(LISTENER_HEARTBEAT)
+                    await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Event listener error: %s", e)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+            await asyncio.sleep(LISTENER_HEARTBEAT)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class PredictionEvents:
+    def __init__(self, broker=None):
+        self.broker = broker or LocalBroker()
+
+    def configure(self, broker):
+        self.broker = broker
+
+    async def publish(self, prediction_id: str, status: str, output_url=None):
+        event = {
+            "prediction_id": prediction_id,
+            "status": status,
+            "output_url": output_url,
+        }
+        try:
+            await self.broker.publish(prediction_id, event)
+        except Exception as e:
+            # push é best-effort; o /status continua sendo a fonte da verdade
+            logger.warning("Event publish error: %s", e)
+
+    def subscribe(self, prediction_id: str):
+        return self.broker.subscribe(prediction_id)
+
+    def unsubscribe(self, prediction_id: str, queue):
+        self.broker.unsubscribe(prediction_id, queue)
+
+    def listen(self, channel: str, callback):
+        self.broker.listen(channel, callback)
+
+    def observe(self, callback):
+        self.broker.observe(callback)
+
+    async def start(self):
+        await self.broker.start()
+
+    async def stop(self):
+        await self.broker.stop()
+
+    def stats(self):
+        return self.broker.stats()
+
+
+prediction_events = PredictionEvents()
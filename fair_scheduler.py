@@ -0,0 +1,323 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from sqlalchemy import select, update
+from governor import UpstreamBusy
+from status_cache import TERMINAL_STATUSES
+
+# =========================================
+# SCHEDULER FAIR-SHARE POR MEMBRO
+# =========================================
+# Fica entre os endpoints de geração e o Replicate (create_prediction):
+# - uma fila por membro (member_id; requests sem membro, ou com um member_id
+#   que não existe em users, dividem a fila "anonymous")
+# - weighted fair queueing: cada submissão recebe uma tag de término
+#       start  = max(tempo virtual, término da anterior do mesmo membro)
+#       finish = start + custo / peso
+#   e o próximo slot livre vai para a menor tag entre as cabeças das filas.
+#   Um membro com 50 jobs na fila não atrasa quem chega com 1 job: a tag do
+#   recém-chegado parte do tempo virtual atual.
+# - peso vem do plano Memberstack (users.plan_weight, gravado pelo webhook)
+# - no máximo FAIR_MEMBER_MAX_INFLIGHT creates em voo por membro e
+#   FAIR_MAX_INFLIGHT no total (abaixo da capacidade do replicate_governor,
+#   para a fila se formar aqui e não no FIFO do governor)
+# - no máximo FAIR_MEMBER_MAX_RUNNING predictions rodando por membro: a
+#   prediction criada conta contra o membro até o status terminal chegar
+#   pelo prediction_events (webhook, /status ou pool de transferência) ou
+#   até FAIR_RUNNING_TTL
+# - a fila "anonymous" tem limites próprios (FAIR_ANONYMOUS_MAX_*)
+#
+# Estado em memória, por worker. Com vários workers, o status terminal
+# chega a todos pelo EVENTS_BROKER=postgres; no broker local, um webhook
+# atendido por outro worker só libera a vaga pelo FAIR_RUNNING_TTL.
+
+FAIR_MAX_INFLIGHT = int(os.getenv("FAIR_MAX_INFLIGHT", "10"))
+FAIR_MEMBER_MAX_INFLIGHT = int(os.getenv("FAIR_MEMBER_MAX_INFLIGHT", "3"))
+FAIR_MEMBER_MAX_RUNNING = int(os.getenv("FAIR_MEMBER_MAX_RUNNING", "10"))
+FAIR_ANONYMOUS_MAX_INFLIGHT = int(os.getenv("FAIR_ANONYMOUS_MAX_INFLIGHT", "5"))
+FAIR_ANONYMOUS_MAX_RUNNING = int(os.getenv("FAIR_ANONYMOUS_MAX_RUNNING", "20"))
+FAIR_RUNNING_TTL = float(os.getenv("FAIR_RUNNING_TTL", "1800"))
+FAIR_QUEUE_TIMEOUT = float(os.getenv("FAIR_QUEUE_TIMEOUT", "30"))
+FAIR_WEIGHT_CACHE_TTL = float(os.getenv("FAIR_WEIGHT_CACHE_TTL", "300"))
+FAIR_MAX_WEIGHT = 100
+# terminais que chegaram antes do create voltar (ids lembrados)
+FINISHED_EARLY_MAX = 1000
+
+ANONYMOUS = "anonymous"
+
+
+def parse_weight(value, default=1):
+    try:
+        return min(max(int(value), 1), FAIR_MAX_WEIGHT)
+    except (TypeError, ValueError):
+        return default
+
+
+class _Ticket:
+    __slots__ = ("member", "start", "finish", "future", "queued_at", "prediction_id")
+
+    def __init__(self, member, start, finish):
+        self.member = member
+        self.start = start
+        self.finish = finish
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+        self.prediction_id = None
+
+    def running(self, prediction_id):
+        """Create ok: a prediction segue contando contra o membro até terminar."""
+        self.prediction_id = prediction_id
+
+
+class FairScheduler:
+    def __init__(self, max_inflight=FAIR_MAX_INFLIGHT, member_max_inflight=FAIR_MEMBER_MAX_INFLIGHT,
+                 queue_timeout=FAIR_QUEUE_TIMEOUT, member_max_running=FAIR_MEMBER_MAX_RUNNING,
+                 anonymous_max_inflight=FAIR_ANONYMOUS_MAX_INFLIGHT,
+                 anonymous_max_running=FAIR_ANONYMOUS_MAX_RUNNING, running_ttl=FAIR_RUNNING_TTL):
+        self.max_inflight = max_inflight
+        self.member_max_inflight = member_max_inflight
+        self.member_max_running = member_max_running
+        self.anonymous_max_inflight = anonymous_max_inflight
+        self.anonymous_max_running = anonymous_max_running
+        self.queue_timeout = queue_timeout
+        self.running_ttl = running_ttl
+
+        self.session_factory = None
+        self.user_model = None
+
+        self.virtual_time = 0.0
+        self._queues = {}          # membro -> deque de _Ticket
+        self._last_finish = {}     # membro -> tag de término da última submissão
+        self._member_inflight = {}
+        self.inflight = 0
+
+        # prediction_id -> (membro, expira_em); TTL único: ordem de inserção
+        self._running = OrderedDict()
+        self._member_running = {}
+        self._finished_early = OrderedDict()
+
+        # memberstack_id -> (expires_at, peso)
+        self._weights = {}
+
+        self.dispatched = 0
+        self.rejected_timeout = 0
+        self.running_expired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def configure(self, session_factory, user_model):
+        self.session_factory = session_factory
+        self.user_model = user_model
+
+    # -----------------------------
+    # Pesos (plano Memberstack)
+    # -----------------------------
+    async def weight(self, member_id):
+        """
+        Peso do membro, ou None se ele não existe em users (member_id vem do
+        form: inventar ids não pode abrir filas novas).
+        """
+        if not member_id:
+            return None
+        if self.session_factory is None:
+            return 1
+
+        cached = self._weights.get(member_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        async with self.session_factory() as db:
+            weight = await db.scalar(
+                select(self.user_model.plan_weight)
+                .where(self.user_model.memberstack_id == member_id)
+            )
+        if weight is None:
+            # não cacheia: o membro pode ser criado a qualquer momento
+            return None
+
+        weight = parse_weight(weight)
+        self._weights[member_id] = (time.monotonic() + FAIR_WEIGHT_CACHE_TTL, weight)
+        return weight
+
+    async def set_weight(self, member_id, weight):
+        weight = parse_weight(weight)
+        async with self.session_factory() as db:
+            await db.execute(
+                update(self.user_model)
+                .where(self.user_model.memberstack_id == member_id)
+                .values(plan_weight=weight)
+            )
+            await db.commit()
+        self._weights[member_id] = (time.monotonic() + FAIR_WEIGHT_CACHE_TTL, weight)
+
+    # -----------------------------
+    # Admissão
+    # -----------------------------
+    @asynccontextmanager
+    async def slot(self, member_id, cost=1, background=False):
+        """
+        Espera a vez do membro. cost: peso da submissão (créditos do job).
+        background=True: espera sem timeout (batch já aceito).
+        Produz o ticket: ticket.running(prediction_id) depois do create.
+        """
+        weight = await self.weight(member_id)
+        member = member_id if weight else ANONYMOUS
+        weight = weight or 1
+        self._expire()
+
+        start = max(self.virtual_time, self._last_finish.get(member, 0.0))
+        ticket = _Ticket(member, start, start + max(cost, 1) / weight)
+        self._last_finish[member] = ticket.finish
+        self._queues.setdefault(member, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            if background:
+                await asyncio.shield(ticket.future)
+            else:
+                await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except BaseException as e:
+            if ticket.future.done():
+                # o slot chegou junto com o cancelamento: devolve
+                self._release(member)
+            else:
+                ticket.future.cancel()
+                self._forget(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout += 1
+                raise UpstreamBusy("replicate", math.ceil(self.queue_timeout))
+            raise
+
+        waited = time.monotonic() - ticket.queued_at
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        try:
+            yield ticket
+        finally:
+            self._release(member, ticket.prediction_id)
+
+    def _has_room(self, member):
+        if member == ANONYMOUS:
+            max_inflight, max_running = self.anonymous_max_inflight, self.anonymous_max_running
+        else:
+            max_inflight, max_running = self.member_max_inflight, self.member_max_running
+        inflight = self._member_inflight.get(member, 0)
+        return inflight < max_inflight and inflight + self._member_running.get(member, 0) < max_running
+
+    def _dispatch(self):
+        while self.inflight < self.max_inflight:
+            best = None
+            for member, queue in self._queues.items():
+                if not queue or not self._has_room(member):
+                    continue
+                if best is None or queue[0].finish < best.finish:
+                    best = queue[0]
+
+            if best is None:
+                return
+
+            self._pop(best)
+            self.virtual_time = max(self.virtual_time, best.start)
+            self.inflight += 1
+            self._member_inflight[best.member] = self._member_inflight.get(best.member, 0) + 1
+            self.dispatched += 1
+            best.future.set_result(None)
+
+    def _pop(self, ticket):
+        queue = self._queues[ticket.member]
+        queue.popleft()
+        if not queue:
+            del self._queues[ticket.member]
+
+    def _forget(self, ticket):
+        queue = self._queues.get(ticket.member)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.member]
+        # a submissão desistiu: não conta contra o membro
+        if self._last_finish.get(ticket.member) == ticket.finish:
+            self._last_finish[ticket.member] = ticket.start
+        self._prune(ticket.member)
+
+    def _release(self, member, prediction_id=None):
+        self.inflight -= 1
+        self._member_inflight[member] -= 1
+        if not self._member_inflight[member]:
+            del self._member_inflight[member]
+
+        if prediction_id and self._finished_early.pop(prediction_id, None) is None:
+            self._running[prediction_id] = (member, time.monotonic() + self.running_ttl)
+            self._member_running[member] = self._member_running.get(member, 0) + 1
+
+        self._prune(member)
+        self._dispatch()
+
+    # -----------------------------
+    # Predictions rodando
+    # -----------------------------
+    def prediction_event(self, prediction_id, event):
+        """Observador do prediction_events: status terminal libera a vaga."""
+        if event.get("status") not in TERMINAL_STATUSES:
+            return
+
+        entry = self._running.pop(prediction_id, None)
+        if entry is None:
+            # terminou antes do create devolver o slot (ou é de outro worker)
+            self._finished_early[prediction_id] = True
+            while len(self._finished_early) > FINISHED_EARLY_MAX:
+                self._finished_early.popitem(last=False)
+            return
+
+        self._finish_running(entry[0])
+        self._dispatch()
+
+    def _finish_running(self, member):
+        self._member_running[member] -= 1
+        if not self._member_running[member]:
+            del self._member_running[member]
+        self._prune(member)
+
+    def _expire(self):
+        # webhook perdido: a vaga volta depois de running_ttl
+        now = time.monotonic()
+        while self._running:
+            prediction_id, (member, expires_at) = next(iter(self._running.items()))
+            if expires_at > now:
+                break
+            del self._running[prediction_id]
+            self.running_expired += 1
+            self._finish_running(member)
+
+    def _prune(self, member):
+        # membro ocioso e sem crédito à frente do tempo virtual: esquece a tag
+        if (
+            member not in self._queues
+            and member not in self._member_inflight
+            and member not in self._member_running
+            and self._last_finish.get(member, 0.0) <= self.virtual_time
+        ):
+            self._last_finish.pop(member, None)
+
+    def stats(self):
+        self._expire()
+        return {
+            "inflight": self.inflight,
+            "running": len(self._running),
+            "members_running": len(self._member_running),
+            "running_expired": self.running_expired,
+            "queued": sum(len(q) for q in self._queues.values()),
+            "members_queued": len(self._queues),
+            "members_inflight": len(self._member_inflight),
+            "dispatched": self.dispatched,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_avg_ms": round(self.wait_total / self.dispatched * 1000, 1) if self.dispatched else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+fair_scheduler = FairScheduler()
@@ -0,0 +1,203 @@
+import os
+import logging
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+import cloudinary.exceptions
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# GOVERNADOR DE CHAMADAS UPSTREAM
+# =========================================
+# Admissão única na frente do Replicate e do Cloudinary:
+# - token bucket (opcional) para as chamadas que criam trabalho (create)
+# - semáforo de requests em voo
+# - fila de espera limitada (max_queue) com timeout (queue_timeout)
+#
+# Fila cheia ou espera estourada -> UpstreamBusy (o app responde 503 com
+# Retry-After). Tarefas de background (transferência, cleanup) esperam sem
+# limite e nunca são rejeitadas.
+#
+# 429 do upstream (com Retry-After) -> throttle(): pausa o bucket até o
+# Retry-After e corta a taxa pela metade; cada create bem-sucedido devolve
+# um pouco da taxa (AIMD) até o máximo configurado.
+
+
+class UpstreamBusy(Exception):
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"{upstream} ocupado, tente em {retry_after}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default=1.0):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class UpstreamGovernor:
+    def __init__(self, name, max_inflight, max_queue, queue_timeout,
+                 rate=None, burst=None, min_rate=None, rate_limit_errors=()):
+        self.name = name
+        # exceções do SDK que significam "rate limit" (sem Retry-After)
+        self.rate_limit_errors = tuple(rate_limit_errors)
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        # token bucket (rate=None: sem limite de taxa)
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or (rate / 10 if rate else None)
+        self.burst = burst or (math.ceil(rate) if rate else None)
+        self._tokens = self.burst or 0
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self.waiting = 0
+        self.inflight = 0
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # -----------------------------
+    # Admissão
+    # -----------------------------
+    @asynccontextmanager
+    async def slot(self, token=False, background=False):
+        """
+        token=True: consome um token do bucket (chamadas que criam trabalho).
+        background=True: espera o quanto for preciso, sem rejeição.
+        """
+        if not background and self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise UpstreamBusy(self.name, self.retry_hint())
+
+        if not background and token and self._paused_until - time.monotonic() > self.queue_timeout:
+            # pausado por 429 além do que a request pode esperar: nem entra na fila
+            self.rejected_timeout += 1
+            raise UpstreamBusy(self.name, self.retry_hint())
+
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            if background:
+                await self._admit(token)
+            else:
+                try:
+                    await asyncio.wait_for(self._admit(token), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self.rejected_timeout += 1
+                    raise UpstreamBusy(self.name, self.retry_hint())
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._semaphore.release()
+
+    async def call_in_thread(self, fn, *args, background=False, **kwargs):
+        """Chamada síncrona de SDK (Cloudinary) numa thread, com admissão."""
+        async with self.slot(background=background):
+            try:
+                return await asyncio.to_thread(fn, *args, **kwargs)
+            except self.rate_limit_errors as e:
+                self.throttle()
+                raise UpstreamBusy(self.name, self.retry_hint()) from e
+
+    async def _admit(self, token):
+        await self._semaphore.acquire()
+        try:
+            if token and self.rate:
+                await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    # -----------------------------
+    # Feedback do upstream
+    # -----------------------------
+    def throttle(self, retry_after=None):
+        """429 / rate limit: pausa até o Retry-After e reduz a taxa."""
+        self.throttled += 1
+        pause = parse_retry_after(retry_after)
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self._tokens = 0
+
+        if self.rate:
+            self.rate = max(self.min_rate, self.rate / 2)
+            logger.warning("⚠️ %s: rate limit, pausa %.1fs, taxa -> %.2f/s", self.name, pause, self.rate)
+
+    def succeeded(self):
+        if self.rate and self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def retry_hint(self):
+        pause = max(self._paused_until - time.monotonic(), 0)
+        drain = (self.waiting + 1) / self.rate if self.rate else self.queue_timeout
+        return max(1, math.ceil(pause + drain))
+
+    def stats(self):
+        return {
+            "queue_depth": self.waiting,
+            "inflight": self.inflight,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "throttled": self.throttled,
+            "rate": round(self.rate, 3) if self.rate else None,
+            "wait_avg_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+# Replicate: create de predictions limitado a ~600/min por conta
+replicate_governor = UpstreamGovernor(
+    "replicate",
+    max_inflight=int(os.getenv("REPLICATE_MAX_INFLIGHT", "50")),
+    max_queue=int(os.getenv("REPLICATE_QUEUE_SIZE", "200")),
+    queue_timeout=float(os.getenv("REPLICATE_QUEUE_TIMEOUT", "10")),
+    rate=float(os.getenv("REPLICATE_CREATE_RATE", "10")),
+    burst=int(os.getenv("REPLICATE_CREATE_BURST", "10")),
+)
+
+cloudinary_governor = UpstreamGovernor(
+    "cloudinary",
+    max_inflight=int(os.getenv("CLOUDINARY_MAX_INFLIGHT", "16")),
+    max_queue=int(os.getenv("CLOUDINARY_QUEUE_SIZE", "200")),
+    queue_timeout=float(os.getenv("CLOUDINARY_QUEUE_TIMEOUT", "20")),
+    rate_limit_errors=[cloudinary.exceptions.RateLimited],
+)
@@ -1,5 +1,31 @@
-from database import engine, Base
-import models
+import asyncio
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from database import engine
 
-Base.metadata.create_all(bind=engine)
-print("Tables created!")
+# Aplica as migrações (alembic upgrade head). Rodar antes de subir o app.
+# Bancos criados pelo create_all antigo (sem alembic_version) são marcados
+# como baseline antes do upgrade.
+
+
+def legacy_schema(connection):
+    tables = inspect(connection).get_table_names()
+    return "creations" in tables and "alembic_version" not in tables
+
+
+async def needs_stamp():
+    async with engine.connect() as conn:
+        legacy = await conn.run_sync(legacy_schema)
+    await engine.dispose()
+    return legacy
+
+
+config = Config("alembic.ini")
+
+if asyncio.run(needs_stamp()):
+    command.stamp(config, "0001_baseline")
+    print("Schema legado marcado como 0001_baseline")
+
+command.upgrade(config, "head")
+print("Migrations applied!")
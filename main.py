@@ -1,64 +1,114 @@
 import os
-import replicate
-import requests
+import httpx
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, Form, File, Request, HTTPException, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.datastructures import UploadFile
 from dotenv import load_dotenv
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy import select, update, delete, func, or_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine, SessionLocal, get_db
+from models import User, Creation, CreditLedgerEntry, ResultCacheEntry, UploadCacheEntry, PredictionContext
 import hmac
 import hashlib
+import base64
+import json
+import time
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager, aclosing
+from replicate_client import open_client, close_client, create_prediction, get_prediction, cancel_prediction
+from replicate.exceptions import ReplicateError
+from uploads import upload_images, release_temp_assets, hash_files
+from cleanup import temp_asset_cleaner
+from upload_cache import upload_cache
+from prediction_context import prediction_contexts, SqlBackend, PREDICTION_CONTEXT_BACKEND
+from transfers import result_transfers
+from status_cache import status_cache, TERMINAL_STATUSES
+from events import prediction_events, PostgresBroker, EVENTS_BROKER
+from credits import credit_engine, BALANCES_CHANNEL
+from result_cache import result_cache
+from model_registry import MODEL_REGISTRY, MODEL_SPECS, REPLICATE_WEBHOOK_URL, check_file_sizes
+from governor import UpstreamBusy, replicate_governor, cloudinary_governor
+from fair_scheduler import fair_scheduler, parse_weight
+from resilience import replicate_upstream, cloudinary_upstream, output_upstream
+from downloads import output_proxy
+from output_cache import output_cache, OUTPUT_CACHE_ENABLED
+from observability import (
+    configure_logging, metrics, stage, STAGE_SECONDS, Counter, Gauge,
+    RequestContextMiddleware, loop_lag_monitor
+)
+from profiler import sampling_profiler, ProfilerBusy, PROFILE_MAX_SECONDS, PROFILE_DEFAULT_INTERVAL
 
-WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET")
+configure_logging()
+logger = logging.getLogger(__name__)
 
-def verify_replicate_signature(raw_body: bytes, signature: str):
-    expected = hmac.new(
-        WEBHOOK_SECRET.encode(),
-        raw_body,
-        hashlib.sha256
-    ).hexdigest()
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET")
+REPLICATE_WEBHOOK_TOLERANCE = 300
 
-    return hmac.compare_digest(expected, signature)
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-Base = declarative_base()
+def verify_replicate_signature(raw_body: bytes, headers):
+    # Replicate assina no formato Standard Webhooks:
+    # base64(HMAC-SHA256(whsec, "{webhook-id}.{webhook-timestamp}.{body}"))
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+
+    if not webhook_id or not timestamp or not signatures:
+        return False
 
-def get_db():
-    db = SessionLocal()
     try:
-        yield db
-    finally:
-        db.close()
-# =========================================
-# MODELS
-# =========================================
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True)
-    memberstack_id = Column(String, unique=True)
-    email = Column(String)
-    credits = Column(Integer, default=50)
-
-class Creation(Base):
-    __tablename__ = "creations"
-    id = Column(Integer, primary_key=True)
-    memberstack_id = Column(String)
-    replicate_id = Column(String)
-    prompt = Column(Text)
-    model = Column(String)
-    status = Column(String)
-    result_url = Column(Text)
-    output_urls = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    temp_input_public_ids = Column(JSON, nullable=True)
-
-Base.metadata.create_all(bind=engine)
+        if abs(time.time() - int(timestamp)) > REPLICATE_WEBHOOK_TOLERANCE:
+            return False
+    except ValueError:
+        return False
+
+    key = base64.b64decode(REPLICATE_WEBHOOK_SECRET.removeprefix("whsec_"))
+    signed = f"{webhook_id}.{timestamp}.".encode() + raw_body
+    expected = base64.b64encode(
+        hmac.new(key, signed, hashlib.sha256).digest()
+    ).decode()
+
+    return any(
+        hmac.compare_digest(expected, sig.split(",", 1)[1])
+        for sig in signatures.split()
+        if "," in sig
+    )
+
+if os.getenv("UPLOAD_CACHE_DB", "").lower() in ["true", "1", "yes"]:
+    upload_cache.configure_db_tier(SessionLocal, UploadCacheEntry)
+
+result_transfers.configure(SessionLocal, Creation)
+credit_engine.configure(SessionLocal, User, CreditLedgerEntry, notify=EVENTS_BROKER == "postgres")
+result_cache.configure(SessionLocal, ResultCacheEntry, Creation)
+fair_scheduler.configure(SessionLocal, User)
+
+# Creation apagada: o /status e o /download não podem continuar servindo
+# a prediction do cache (status terminal fica no cache até o LRU)
+CREATION_DELETED_CHANNEL = "creation_deleted"
+
+def forget_prediction(prediction_id: str):
+    status_cache.invalidate(prediction_id)
+    output_cache.invalidate(prediction_id)
+
+if EVENTS_BROKER == "postgres":
+    prediction_events.configure(PostgresBroker(engine))
+    # saldo alterado em outro worker: invalida o cache de créditos deste
+    prediction_events.listen(BALANCES_CHANNEL, credit_engine.balance_changed)
+    # Creation apagada em outro worker: esquece a prediction neste também
+    prediction_events.listen(CREATION_DELETED_CHANNEL, forget_prediction)
+
+# status terminal libera a vaga do membro no fair_scheduler
+prediction_events.observe(fair_scheduler.prediction_event)
+
+# Guarda relação prediction_id -> contexto (modelo, membro, public_ids temporários)
+if PREDICTION_CONTEXT_BACKEND == "db":
+    prediction_contexts.configure(SqlBackend(SessionLocal, PredictionContext))
 
 # =========================================
 # CLOUDINARY
@@ -67,30 +117,50 @@ cloudinary.config(secure=True)
 
 load_dotenv()
 
-# Guarda relação prediction_id -> cloudinary_public_id
-FLUX_TEMP_IMAGES = {}
-SORA2_TEMP_IMAGES = {}
-SORA2_PRO_TEMP_IMAGES = {}
-VEO3_TEMP_IMAGES = {}
-SEEDREAM_TEMP_IMAGES = {}
-NANOBANANA_TEMP_IMAGES = {}
-KLING_TEMP_IMAGES = {}
-GEN4_TEMP_IMAGES = {}
-
 # Auth
 os.environ["REPLICATE_API_TOKEN"] = os.getenv("REPLICATE_API_TOKEN")
 
-app = FastAPI()
-PREDICTION_META = {}
-
-def get_user(db, member_id):
-    user = db.query(User).filter(User.memberstack_id == member_id).first()
-    if not user:
-        user = User(memberstack_id=member_id, credits=50)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
+def check_webhook_config():
+    # toda prediction registra o webhook de conclusão: sem URL pública (ou sem
+    # o segredo para validar a assinatura) as Creations nunca fecham
+    missing = [
+        name for name, value in [
+            ("REPLICATE_WEBHOOK_URL", REPLICATE_WEBHOOK_URL),
+            ("REPLICATE_WEBHOOK_SECRET", REPLICATE_WEBHOOK_SECRET),
+        ] if not value
+    ]
+    if missing:
+        raise RuntimeError(f"Configure {', '.join(missing)} (ex.: https://<app>.onrender.com/replicate-webhook)")
+    if not REPLICATE_WEBHOOK_URL.startswith(("https://", "http://")):
+        raise RuntimeError(f"REPLICATE_WEBHOOK_URL inválida: {REPLICATE_WEBHOOK_URL!r}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema: python init_db.py (alembic upgrade head) antes de subir o app
+    check_webhook_config()
+    open_client()
+    output_proxy.open()
+    loop_lag_monitor.start()
+    if OUTPUT_CACHE_ENABLED:
+        output_cache.open()
+    temp_asset_cleaner.start()
+    result_transfers.start()
+    await prediction_events.start()
+    yield
+    # jobs de batch ainda na fila do membro falham (e devolvem os créditos)
+    # antes de fechar os clients
+    for task in _batch_submissions:
+        task.cancel()
+    await asyncio.gather(*_batch_submissions, return_exceptions=True)
+    await prediction_events.stop()
+    await result_transfers.stop()
+    await temp_asset_cleaner.stop()
+    await loop_lag_monitor.stop()
+    await close_client()
+    await output_proxy.close()
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -106,788 +176,773 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# =====================================================
-#                  SORA 2 - VIDEO
-# =====================================================
-
-@app.post("/generate")
-async def generate_video(
-    prompt: str = Form(...),
-
-    # Dropdowns
-    aspect_ratio: str = Form("landscape"),
-    seconds: str | None = Form(None),
-    quality: str = Form("1080p"),
+# request_id + métricas HTTP (ver observability.py)
+app.add_middleware(RequestContextMiddleware)
 
-    # Imagem opcional
-    reference_file: UploadFile | None = File(None),
-):
-    """
-    Sora-2
-    - Texto puro
-    - Texto + imagem (via Cloudinary URL)
-    """
-
-    model_input = {
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "resolution": quality,
-        
-    }
 
-    if seconds:
-        model_input["seconds"] = int(seconds)
-
-    cloudinary_public_id = None
-
-    # 1️⃣ Upload temporário para Cloudinary (SE houver imagem)
-    if reference_file:
-        print("✅ Imagem recebida:", reference_file.filename)
-        upload_result = cloudinary.uploader.upload(
-            reference_file.file,
-            folder="sora2-temp",
-            resource_type="image"
-        )
-
-        image_url = upload_result["secure_url"]
-        print("✅ CLOUDINARY URL:", image_url)
-        cloudinary_public_id = upload_result["public_id"]
-
-        # 2️⃣ Replicate recebe SOMENTE a URL
-        model_input["input_reference"] = image_url
-    else:
-        print("⚠️ NO IMAGE RECEIVED")
-
-    print("🚀 FINAL MODEL INPUT:", model_input)
-
-    # 3️⃣ Criar prediction no Replicate
-    prediction = replicate.predictions.create(
-        model="openai/sora-2",
-        input=model_input
+# Replicate/Cloudinary saturados (fila do governor cheia ou 429 upstream):
+# 503 rápido com Retry-After em vez de segurar a conexão
+@app.exception_handler(UpstreamBusy)
+async def upstream_busy_handler(request: Request, exc: UpstreamBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"error": f"{exc.upstream} ocupado, tente novamente.", "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
     )
 
-    # 4️⃣ Registrar imagem temporária para cleanup
-    if cloudinary_public_id:
-        SORA2_TEMP_IMAGES[prediction.id] = cloudinary_public_id
-
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
-
-from typing import List
-import tempfile
-
 # =====================================================
-#               SORA 2 PRO - VIDEO
+#          GERAÇÃO (REGISTRO DE MODELOS)
 # =====================================================
+# Cada modelo é uma entrada em model_registry.py. POST /generate/{slug} e as
+# URLs antigas (/generate, /generate-veo, /generate-image, ...) caem todas
+# em dispatch_generation.
 
-from fastapi import Form, UploadFile, File
-from typing import Optional
-
-@app.post("/generate-sora-pro")
-async def generate_sora_pro(
-    prompt: str = Form(...),
-
-    # dropdowns
-    aspect_ratio: str = Form("landscape"),
-    seconds: Optional[str] = Form(None),
-    resolution: str = Form("standard"),
-
-    # imagem opcional
-    reference_file: Optional[UploadFile] = File(None)
-):
-    """
-    Geração de vídeo com Sora-2 Pro
-    - Texto puro
-    - Texto + imagem (via Cloudinary URL)
-    """
-
-    # 🔹 input base
-    model_input = {
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "resolution": resolution,
-    }
-
-    if seconds:
-        model_input["seconds"] = int(seconds)
-
-    cloudinary_public_id = None
-
-    # 🔹 Upload para Cloudinary se houver imagem
-    if reference_file:
-        print("✅ Imagem recebida:", reference_file.filename)
-
-        upload_result = cloudinary.uploader.upload(
-            reference_file.file,
-            folder="sora2-pro-temp",
-            resource_type="image"
+async def cancel_quietly(prediction_id):
+    try:
+        await cancel_prediction(prediction_id)
+    except Exception as e:
+        logger.warning("Falha ao cancelar prediction %s: %s", prediction_id, e)
+
+
+async def register_creation(**fields):
+    # Creation gravada ANTES do create: o webhook (com ?creation_id=) acha a
+    # linha mesmo se chegar antes do replicate_id ser preenchido
+    async with SessionLocal() as db:
+        creation = Creation(status="processing", **fields)
+        db.add(creation)
+        await db.commit()
+        return creation.id
+
+
+async def bind_creation(creation_id, prediction_id):
+    # o webhook pode já ter preenchido: não sobrescreve
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Creation)
+            .where(Creation.id == creation_id, Creation.replicate_id.is_(None))
+            .values(replicate_id=prediction_id)
         )
+        # job de batch saindo da fila
+        await db.execute(
+            update(Creation)
+            .where(Creation.id == creation_id, Creation.status == "queued")
+            .values(status="processing")
+        )
+        await db.commit()
 
-        image_url = upload_result["secure_url"]
-        cloudinary_public_id = upload_result["public_id"]
-
-        print("✅ CLOUDINARY URL:", image_url)
-
-        model_input["input_reference"] = image_url
-    else:
-        print("⚠️ NO IMAGE RECEIVED")
-
-    print("🚀 FINAL MODEL INPUT:", model_input)
-
-    # 🔹 Criar prediction
-    prediction = replicate.predictions.create(
-        model="openai/sora-2-pro",
-        input=model_input
-    )
-
-    # 🔹 Registrar imagem para cleanup
-    if cloudinary_public_id:
-        SORA2_TEMP_IMAGES[prediction.id] = cloudinary_public_id
-
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
-
-
-
-# =====================================================
-#               KLING 2.5 PRO - VIDEO
-# =====================================================
-
-@app.post("/generate-kling-2.5-pro")
-async def generate_kling_video(
-    prompt: str = Form(...),
-    aspect_ratio: str = Form("16:9"),
-    duration: int = Form(5),
 
-    first_frame: Optional[UploadFile] = File(None),
-    last_frame: Optional[UploadFile] = File(None),
-):
+async def close_unsuccessful(creation, status):
     """
-    Kling v2.5 Turbo Pro
-    - Text → Video
+    Fecha uma Creation em failed/canceled, venha do webhook ou do /status:
+    status, temporários, Creations que seguem a prediction (cache de
+    resultados), cache do /status e evento. O UPDATE condicional escolhe
+    quem fecha: só a primeira chamada libera os temporários (pins).
+    Retorna False se a Creation já estava terminal.
     """
-
-    model_input = {
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "duration": duration
-    }
-
-    cloudinary_public_id = None
-
-    # 🔹 Upload para Cloudinary se houver imagem
-    if first_frame:
-        upload = cloudinary.uploader.upload(
-            first_frame.file,
-            folder="kling-temp",
-            resource_type="image"
-        )
-        model_input["first_frame"] = upload["secure_url"]
-    
-    if last_frame:
-        upload = cloudinary.uploader.upload(
-            last_frame.file,
-            folder="kling-temp",
-            resource_type="image"
+    prediction_id = creation.replicate_id
+    async with SessionLocal() as db:
+        closed = await db.execute(
+            update(Creation)
+            .where(Creation.id == creation.id, Creation.status.not_in(TERMINAL_STATUSES))
+            .values(status=status, temp_input_public_ids=None, completed_at=datetime.utcnow())
         )
-        model_input["last_frame"] = upload["secure_url"]
-
-    else:
-        print("⚠️ NO IMAGE RECEIVED")
-
-    print("🚀 FINAL MODEL INPUT:", model_input)
-
-    prediction = replicate.predictions.create(
-        model="kwaivgi/kling-v2.5-turbo-pro",
-        input=model_input
-    )
-
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
-
-# =====================================================
-#               GEN 4 TURBO - VIDEO
-# =====================================================
-
-@app.post("/generate-gen4")
-async def generate_gen4_video(
-    prompt: str = Form(...),
-    duration: int = Form(5),
-    aspect_ratio: str = Form("16:9"),
-    
-    reference_file: Optional[UploadFile] = File(None)
-):
+        await db.commit()
+    if closed.rowcount != 1:
+        return False
+
+    creation.status = status
+    await release_temp_assets(creation.temp_input_public_ids)
+    creation.temp_input_public_ids = None
+    if creation.result_key:
+        await result_cache.settle(prediction_id, status)
+    status_cache.set(prediction_id, {"status": status, "output_url": None})
+    await prediction_events.publish(prediction_id, status)
+    return True
+
+
+async def rollback_submission(member_id, cost, reason, public_ids, prediction=None, creation_id=None,
+                              keep_creation=False):
     """
-    Runway Gen-4 Turbo
-    - Image REQUIRED
-    - Prompt REQUIRED
+    Desfaz uma submissão que não chegou ao fim: devolve créditos e
+    temporários, apaga a Creation (ou, com keep_creation, marca como
+    failed) e cancela a prediction que ficaria órfã.
+    Roda sob um asyncio.shield só (num disconnect cada await seria
+    cancelado de novo).
     """
-    model_input = {
-        "prompt": prompt,
-        "duration": duration,
-        "aspect_ratio": aspect_ratio
-    }
-
-    cloudinary_public_id = None
-
-    # 🔹 Upload para Cloudinary se houver imagem
-    if reference_file:
-        print("✅ Imagem recebida:", reference_file.filename)
+    if cost:
+        await credit_engine.release(member_id, cost, reason)
+    if public_ids:
+        await release_temp_assets(public_ids)
+    if creation_id is not None:
+        async with SessionLocal() as db:
+            if keep_creation:
+                await db.execute(
+                    update(Creation)
+                    .where(Creation.id == creation_id)
+                    .values(status="failed", temp_input_public_ids=None)
+                )
+            else:
+                await db.execute(delete(Creation).where(Creation.id == creation_id))
+            await db.commit()
+    if prediction is not None:
+        await cancel_quietly(prediction.id)
+
+
+async def dispatch_generation(spec, request):
+    # 1️⃣ Validação (sem I/O): input inválido não custa upload nem GPU
+    with stage("multipart_parse", spec.slug):
+        params, files = spec.parse(await request.form())
+    upload_files = spec.upload_files(files)
+
+    # Cache de resultados (modelos com opt-in): mesmo input = mesmo
+    # resultado, sem upload, sem créditos, sem GPU
+    result_key = None
+    digests = None
+    if spec.cacheable(params):
+        digests = await hash_files(upload_files)
+        result_key = spec.result_key(params, files, digests)
+
+        cached = await result_cache.lookup(result_key)
+        if cached:
+            # Creation própria do membro, ligada à prediction original (modelos
+            # com cache não cobram: ver ModelSpec)
+            creation_id = await result_cache.follow(
+                cached, memberstack_id=params.member_id, prompt=params.prompt,
+                model=spec.model, result_key=result_key
+            )
+            return {**cached, "creation_id": creation_id, "cached": True}
 
-        upload_result = cloudinary.uploader.upload(
-            reference_file.file,
-            folder="gen4-temp",
-            resource_type="image"
-        )
+    tracked = spec.tracked
 
-        image_url = upload_result["secure_url"]
-        cloudinary_public_id = upload_result["public_id"]
+    member_id = params.member_id
+    cost = spec.cost_for(params)
 
-        print("✅ CLOUDINARY URL:", image_url)
+    # 2️⃣ Reserva de créditos
+    if cost:
+        with stage("credit_check", spec.slug):
+            balance = await credit_engine.reserve(member_id, cost, spec.model)
+        if balance is None:
+            return JSONResponse(status_code=403, content={"error": "Créditos insuficientes."})
 
-        model_input["image"] = image_url
-    else:
-        print("⚠️ NO IMAGE RECEIVED")
+    uploads = []
+    prediction = None
+    creation_id = None
+    try:
+        # 3️⃣ Upload temporário para Cloudinary (se houver imagens)
+        if upload_files:
+            with stage("cloudinary_upload", spec.slug):
+                uploads = await upload_images(upload_files, folder=spec.temp_folder, digests=digests)
+
+        # 4️⃣ Replicate recebe SOMENTE as URLs
+        model_input = spec.build_input(params, files, uploads)
+        logger.debug("🚀 FINAL MODEL INPUT: %s", model_input)
+
+        public_ids = [u["public_id"] for u in uploads]
+
+        # 5️⃣ Registro: Creation (modelos com webhook) antes do create
+        if tracked:
+            with stage("db_commit", spec.slug):
+                creation_id = await register_creation(
+                    memberstack_id=member_id,
+                    prompt=params.prompt,
+                    model=spec.model,
+                    temp_input_public_ids=public_ids,
+                    result_key=result_key
+                )
+
+        # fila fair-share por membro até o Replicate
+        queued = time.perf_counter()
+        async with fair_scheduler.slot(member_id, cost) as slot:
+            STAGE_SECONDS.observe(time.perf_counter() - queued, stage="queue_wait", model=spec.slug)
+            with stage("replicate_create", spec.slug):
+                prediction = await create_prediction(
+                    model=spec.model,
+                    model_input=model_input,
+                    # toda prediction recebe o webhook de conclusão: fecha a
+                    # Creation ou o contexto e alimenta o /events
+                    **spec.prediction_params(webhook=True, creation_id=creation_id)
+                )
+            # conta contra o membro até o status terminal
+            slot.running(prediction.id)
+
+        logger.info(
+            "🚀 %s: prediction %s criada", spec.slug, prediction.id,
+            extra={"fields": {"model": spec.slug, "prediction_id": prediction.id, "images": len(uploads)}}
+        )
 
-    print("🚀 FINAL MODEL INPUT:", model_input)
-    prediction = replicate.predictions.create(
-        model="runwayml/gen4-turbo",
-        input=model_input
-    )
+        # 6️⃣ Liga a Creation à prediction, ou registra o contexto para cleanup
+        if tracked:
+            with stage("db_commit", spec.slug):
+                await bind_creation(creation_id, prediction.id)
+
+        elif public_ids or member_id:
+            context = {"model": spec.model, "temp_public_ids": public_ids}
+            if member_id:
+                context.update(member_id=member_id, prompt=params.prompt)
+            with stage("db_commit", spec.slug):
+                await prediction_contexts.put(prediction.id, **context)
+    except BaseException:
+        # upload, Replicate ou registro falhou (ou request cancelada)
+        await asyncio.shield(rollback_submission(
+            member_id, cost, spec.model, [u["public_id"] for u in uploads], prediction, creation_id
+        ))
+        raise
+
+    if tracked:
+        return {
+            "prediction_id": prediction.id,
+            "status": "processing"
+        }
 
     return {
         "prediction_id": prediction.id,
         "status": prediction.status
     }
 
-# =====================================================
-#                GOOGLE VEO 3.1 - VIDEO
-# =====================================================
 
-@app.post("/generate-veo")
-async def generate_veo_video(
-    prompt: str = Form(...),
-    duration: int = Form(8),
-    resolution: str = Form("1080p"),
-    aspect_ratio: str = Form("16:9"),
-    generate_audio: str = Form("true"),
-    reference_images: Optional[List[UploadFile]] = File(None)
-):
-    """
-    Geração de vídeo com Google Veo 3.1
-    - Texto puro
-    - Texto + múltiplas imagens
-    """
+@app.post("/generate/{slug}")
+async def generate(slug: str, request: Request):
+    spec = MODEL_REGISTRY.get(slug)
+    if not spec:
+        raise HTTPException(status_code=404, detail="Unknown model")
+
+    return await dispatch_generation(spec, request)
 
-    # -----------------------------
-    # Parse generate_audio
-    # -----------------------------
-    generate_audio_bool = str(generate_audio).lower() in ["true", "1", "yes"]
-
-    # -----------------------------
-    # Upload reference images
-    # -----------------------------
-    reference_urls = []
-
-    if reference_images:
-        for img in reference_images:
-            upload = cloudinary.uploader.upload(
-                img.file,
-                folder="veo3-temp",
-                resource_type="image"
-            )
-            reference_urls.append(upload["secure_url"])
-
-    # -----------------------------
-    # Replicate input
-    # -----------------------------
-    model_input = {
-        "prompt": prompt,
-        "duration": int(duration),
-        "resolution": resolution,
-        "aspect_ratio": aspect_ratio,
-        "generate_audio": generate_audio_bool,
-    }
 
-    if reference_urls:
-        model_input["reference_images"] = reference_urls
+def legacy_generate_endpoint(spec):
+    async def endpoint(request: Request):
+        return await dispatch_generation(spec, request)
+    return endpoint
 
-    print("🚀 VEO 3.1 INPUT:", model_input)
 
-    prediction = replicate.predictions.create(
-        model="google/veo-3.1",
-        input=model_input
+# URLs antigas como aliases finos do /generate/{slug}
+for spec in MODEL_SPECS:
+    app.add_api_route(
+        spec.legacy_path,
+        legacy_generate_endpoint(spec),
+        methods=["POST"],
+        name=f"generate_{spec.slug}",
+        openapi_extra={
+            "requestBody": {
+                "content": {"multipart/form-data": {"schema": spec.schema.model_json_schema()}}
+            }
+        },
     )
 
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
 
+@app.get("/models")
+def list_models():
+    return [
+        {
+            "slug": spec.slug,
+            "model": spec.model,
+            "legacy_path": spec.legacy_path,
+            "images": [field.name for field in spec.images],
+            "charges_credits": bool(spec.cost),
+        }
+        for spec in MODEL_SPECS
+    ]
 
 # =====================================================
-#               GOOGLE VEO 3 FAST
+#                 BATCH DE GERAÇÕES
 # =====================================================
-
-@app.post("/generate-veo-fast")
-async def generate_veo_fast(
-    prompt: str = Form(...),
-    image: UploadFile = File(...),
-
-    duration: int = Form(8),
-    resolution: str = Form("720p"),
-    aspect_ratio: str = Form("16:9"),
-    generate_audio: bool = Form(True),
-):
+# Form multipart:
+#   member_id  (obrigatório se algum job cobra créditos)
+#   jobs       JSON: [{"model": "<slug>", "prompt": "...", ...,
+#                      "images": {"<campo de imagem>": [índices em images]}}]
+#   images     arquivos compartilhados entre os jobs (sobem uma vez só)
+#
+# Créditos do batch inteiro numa reserva só; jobs que falham no Replicate
+# devolvem a sua parte. As Creations de todos os jobs são gravadas juntas
+# ("queued") e a resposta sai logo: os creates seguem em background, na fila
+# do membro no fair_scheduler (que também limita as predictions rodando).
+# Job que falha devolve créditos e temporários, cancela a prediction e fica
+# "failed" no /batches/{id}.
+
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "50"))
+BATCH_SUBMIT_CONCURRENCY = int(os.getenv("BATCH_SUBMIT_CONCURRENCY", "8"))
+BATCH_TEMP_FOLDER = "batch-temp"
+# SSE do batch: releitura dos jobs ainda na fila
+BATCH_EVENTS_REFRESH = 2
+
+# submissões em andamento: referência forte (o shield sozinho não segura a
+# task se o cliente cair) e drenadas no shutdown
+_batch_submissions = set()
+
+
+def parse_batch(form):
     """
-    Google Veo 3 Fast
-    - Image REQUIRED
-    - Prompt REQUIRED
+    Valida o batch inteiro sem I/O. Retorna (member_id, jobs, images), onde
+    cada job é (spec, params, {campo: [índices]}).
     """
+    member_id = form.get("member_id") or None
+    images = [
+        f for f in form.getlist("images")
+        if isinstance(f, UploadFile) and (f.filename or f.size)
+    ]
+    check_file_sizes(images)
 
-    print("✅ Imagem recebida:", image.filename)
-
-    upload_result = cloudinary.uploader.upload(
-        image.file,
-        folder="veo3-fast-temp",
-        resource_type="image"
-    )
-
-    image_url = upload_result["secure_url"]
-    public_id = upload_result["public_id"]
-
-    print("✅ CLOUDINARY URL:", image_url)
+    try:
+        raw_jobs = json.loads(form.get("jobs") or "")
+    except (TypeError, ValueError):
+        raw_jobs = None
+
+    if not isinstance(raw_jobs, list) or not 1 <= len(raw_jobs) <= BATCH_MAX_JOBS:
+        raise RequestValidationError([{
+            "type": "value_error",
+            "loc": ("body", "jobs"),
+            "msg": f"jobs must be a JSON list with 1 to {BATCH_MAX_JOBS} items",
+            "input": None,
+        }])
+
+    jobs = []
+    errors = []
+
+    for i, raw in enumerate(raw_jobs):
+        loc = ("body", "jobs", i)
+        spec = MODEL_REGISTRY.get(raw.get("model")) if isinstance(raw, dict) else None
+        if not spec:
+            errors.append({"type": "value_error", "loc": (*loc, "model"), "msg": "Unknown model", "input": None})
+            continue
+
+        data = {k: v for k, v in raw.items() if k not in ("model", "images")}
+        if spec.charges_member:
+            data["member_id"] = member_id
+
+        params, job_errors = spec.validate_params(data, loc)
+        errors.extend(job_errors)
+
+        refs = raw.get("images") or {}
+        job_images = {}
+        for field in spec.images:
+            indexes = refs.get(field.name, []) if isinstance(refs, dict) else []
+            if not isinstance(indexes, list) or not all(
+                isinstance(n, int) and 0 <= n < len(images) for n in indexes
+            ):
+                errors.append({
+                    "type": "value_error",
+                    "loc": (*loc, "images", field.name),
+                    "msg": f"Expected a list of indexes into images ({len(images)} uploaded)",
+                    "input": indexes,
+                })
+                continue
+            errors.extend(spec.validate_image_count(field, len(indexes), (*loc, "images", field.name)))
+            job_images[field.name] = indexes
+
+        jobs.append((spec, params, job_images))
+
+    if errors:
+        raise RequestValidationError(errors)
+
+    return member_id, jobs, images
+
+
+@app.post("/batch-generate")
+async def batch_generate(request: Request):
+    with stage("multipart_parse", "batch"):
+        member_id, jobs, images = parse_batch(await request.form())
+
+    batch_id = uuid.uuid4().hex
+    costs = [spec.cost_for(params) for spec, params, _ in jobs]
+    total_cost = sum(costs)
+
+    # 1️⃣ Uma reserva para o batch inteiro
+    if total_cost:
+        with stage("credit_check", "batch"):
+            balance = await credit_engine.reserve(member_id, total_cost, f"batch:{batch_id}")
+        if balance is None:
+            return JSONResponse(status_code=403, content={"error": "Créditos insuficientes."})
+
+    # 2️⃣ Cada imagem referenciada sobe uma vez só
+    used = sorted({n for _, _, refs in jobs for indexes in refs.values() for n in indexes})
+    try:
+        with stage("cloudinary_upload", "batch"):
+            uploaded = await upload_images([images[n] for n in used], folder=BATCH_TEMP_FOLDER)
+    except BaseException:
+        if total_cost:
+            await asyncio.shield(credit_engine.release(member_id, total_cost, f"batch:{batch_id}"))
+        raise
+
+    shared = dict(zip(used, uploaded))
+
+    # um pin por job que usa o asset (o upload já conta um)
+    extra_pins = []
+    for n in used:
+        uses = sum(n in indexes for _, _, refs in jobs for indexes in refs.values())
+        extra_pins += [shared[n]["public_id"]] * (uses - 1)
+    upload_cache.pin(extra_pins)
+
+    # 3️⃣ Creations de todos os jobs num insert só, antes de qualquer create
+    job_uploads = [
+        [shared[n] for field in spec.images for n in refs[field.name]]
+        for spec, _, refs in jobs
+    ]
+    try:
+        with stage("db_commit", "batch"):
+            creation_ids = await register_batch(batch_id, member_id, jobs, job_uploads)
+    except BaseException:
+        await asyncio.shield(rollback_submission(
+            member_id, total_cost, f"batch:{batch_id}",
+            [u["public_id"] for uploads in job_uploads for u in uploads]
+        ))
+        raise
+
+    # 4️⃣ Creates em background: referência forte em _batch_submissions (o
+    # cliente não espera a fila do membro)
+    task = asyncio.ensure_future(submit_batch(batch_id, member_id, jobs, costs, job_uploads, creation_ids))
+    _batch_submissions.add(task)
+    task.add_done_callback(_batch_submissions.discard)
 
-    model_input = {
-        "image": image_url,
-        "prompt": prompt,
-        "duration": duration,
-        "resolution": resolution,
-        "aspect_ratio": aspect_ratio,
-        "generate_audio": generate_audio
+    return {
+        "batch_id": batch_id,
+        "credits_charged": total_cost,
+        "jobs": [
+            {"index": i, "model": spec.slug, "creation_id": creation_id, "status": "queued"}
+            for i, ((spec, _, _), creation_id) in enumerate(zip(jobs, creation_ids))
+        ],
     }
 
-    print("🚀 FINAL MODEL INPUT:", model_input)
-
-    prediction = replicate.predictions.create(
-        model="google/veo-3-fast",
-        input=model_input
-    )
-
-    VEO3_TEMP_IMAGES[prediction.id] = public_id
 
+async def register_batch(batch_id, member_id, jobs, job_uploads):
+    async with SessionLocal() as db:
+        creations = [
+            Creation(
+                status="queued",
+                memberstack_id=member_id,
+                prompt=params.prompt,
+                model=spec.model,
+                temp_input_public_ids=[u["public_id"] for u in uploads],
+                batch_id=batch_id
+            )
+            for (spec, params, _), uploads in zip(jobs, job_uploads)
+        ]
+        db.add_all(creations)
+        await db.commit()
+        return [creation.id for creation in creations]
+
+
+async def submit_batch(batch_id, member_id, jobs, costs, job_uploads, creation_ids):
+    semaphore = asyncio.Semaphore(BATCH_SUBMIT_CONCURRENCY)
+
+    async def submit(spec, params, refs, cost, uploads, creation_id):
+        prediction = None
+
+        async with semaphore:
+            try:
+                # batch já aceito: espera a vez do membro sem timeout
+                queued = time.perf_counter()
+                async with fair_scheduler.slot(member_id, cost, background=True) as slot:
+                    STAGE_SECONDS.observe(time.perf_counter() - queued, stage="queue_wait", model=spec.slug)
+                    with stage("replicate_create", spec.slug):
+                        prediction = await create_prediction(
+                            model=spec.model,
+                            model_input=spec.build_input(params, refs, uploads),
+                            **spec.prediction_params(webhook=True, creation_id=creation_id)
+                        )
+                    slot.running(prediction.id)
+
+                with stage("db_commit", spec.slug):
+                    await bind_creation(creation_id, prediction.id)
+            except BaseException as e:
+                # job falhou (ou shutdown): devolve a parte dele, Creation fica failed
+                await asyncio.shield(rollback_submission(
+                    member_id, cost, f"batch:{batch_id}", [u["public_id"] for u in uploads],
+                    prediction, creation_id, keep_creation=True
+                ))
+                if not isinstance(e, Exception):
+                    raise
+                logger.warning("Batch %s (%s) error: %s", batch_id, spec.slug, e)
+
+    await asyncio.gather(*[
+        submit(*job, cost, uploads, creation_id)
+        for job, cost, uploads, creation_id in zip(jobs, costs, job_uploads, creation_ids)
+    ])
+
+
+async def load_batch(batch_id: str):
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(Creation.id, Creation.replicate_id, Creation.model, Creation.status, Creation.result_url)
+            .where(Creation.batch_id == batch_id)
+            .order_by(Creation.id)
+        )).all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return rows
+
+
+def batch_summary(batch_id, items):
+    counts = {}
+    for item in items.values():
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+
+    done = all(item["status"] in TERMINAL_STATUSES for item in items.values())
+    queued = all(item["status"] == "queued" for item in items.values())
     return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
+        "batch_id": batch_id,
+        "status": "completed" if done else "queued" if queued else "processing",
+        "counts": counts,
+        "items": list(items.values()),
     }
 
-# =====================================================#
-#                NANO-BANANA 2 - IMAGEM#
-# =====================================================#
-
-@app.post("/generate-nanobanana-2")
-async def generate_nanobanana_2(
-    prompt: str = Form(...),
-    member_id: str = Form(...),
-    aspect_ratio: str = Form("1:1"),
-    resolution: str = Form("1K"),
-    image_search: bool = Form(False),
-    google_search: bool = Form(False),
-    output_format: str = Form("jpg"),
-    image_input: List[UploadFile] = File(None)
-):
-    db = SessionLocal()
-    user = get_user(db, member_id)
-
-    if not user:
-        db.close()
-        return JSONResponse(status_code=404, content={"error": "User not found."})
-
-    if user.credits <= 0:
-        db.close()
-        return JSONResponse(status_code=403, content={"error": "Créditos insuficientes."})
-
-    # ==========================
-    # Upload opcional para Cloudinary
-    # ==========================
-    image_urls = []
-    public_ids = []
-
-    if image_input:
-        print("📥 QTD IMAGENS:", len(image_input))
-
-        for image in image_input:
-            upload = cloudinary.uploader.upload(
-                await image.read(),
-                folder="nanobanana-temp",
-                resource_type="image"
-            )
-            image_urls.append(upload["secure_url"])
-            public_ids.append(upload["public_id"])
-
-    print("✅ URLs enviadas ao Nano Banana 2:", image_urls)
-
-    # ==========================
-    # Modelo Nano Banana 2
-    # ==========================
-    model_input = {
-        "prompt": prompt,
-        "resolution": resolution,
-        "image_input": image_urls,
-        "aspect_ratio": aspect_ratio,
-        "image_search": image_search,
-        "google_search": google_search,
-        "output_format": output_format
-    }
 
-    prediction = replicate.predictions.create(
-        model="google/nano-banana-2",
-        input=model_input
+@app.get("/batches/{batch_id}")
+async def batch_status(batch_id: str):
+    rows = await load_batch(batch_id)
+    semaphore = asyncio.Semaphore(BATCH_SUBMIT_CONCURRENCY)
+
+    async def item(row):
+        if row.status in TERMINAL_STATUSES or row.replicate_id is None:
+            # terminal, ou ainda na fila do membro
+            current = {"status": row.status, "output_url": row.result_url}
+        else:
+            # mesmo caminho (e cache) do /status
+            async with semaphore:
+                current = await prediction_status(row.replicate_id)
+        return {"creation_id": row.id, "prediction_id": row.replicate_id, "model": row.model, **current}
+
+    items = await asyncio.gather(*[item(row) for row in rows])
+    return batch_summary(batch_id, {i["creation_id"]: i for i in items})
+
+
+@app.get("/batches/{batch_id}/events")
+async def batch_events_sse(batch_id: str):
+    rows = await load_batch(batch_id)
+
+    async def stream():
+        merged = asyncio.Queue()
+        items = {}
+        # prediction_id -> creation_id (jobs que já saíram da fila)
+        by_prediction = {}
+        tasks = []
+
+        async def forward(prediction_id):
+            async with aclosing(prediction_event_stream(prediction_id)) as events:
+                async for event in events:
+                    if event is not None:
+                        await merged.put(event)
+
+        def track(rows):
+            # jobs que saíram da fila (ou falharam nela) desde a última leitura
+            changed = []
+            for row in rows:
+                item = items.setdefault(row.id, {
+                    "creation_id": row.id, "prediction_id": None, "model": row.model, "status": row.status
+                })
+                if row.replicate_id and row.replicate_id not in by_prediction:
+                    by_prediction[row.replicate_id] = row.id
+                    item["prediction_id"] = row.replicate_id
+                    tasks.append(asyncio.create_task(forward(row.replicate_id)))
+                elif item["prediction_id"] is None and row.status != item["status"]:
+                    item["status"] = row.status
+                    changed.append(item)
+            return changed
+
+        track(rows)
+        try:
+            while not all(i["status"] in TERMINAL_STATUSES for i in items.values()):
+                queued = any(i["prediction_id"] is None for i in items.values())
+                try:
+                    event = await asyncio.wait_for(
+                        merged.get(), BATCH_EVENTS_REFRESH if queued else EVENTS_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    if queued:
+                        for item in track(await load_batch(batch_id)):
+                            yield f"event: status\ndata: {json.dumps(item)}\n\n"
+                    yield ": keepalive\n\n"
+                    continue
+
+                item = items[by_prediction[event["prediction_id"]]]
+                item.update(status=event.get("status"), output_url=event.get("output_url"))
+                yield f"event: status\ndata: {json.dumps({'creation_id': item['creation_id'], **event})}\n\n"
+
+            yield f"event: batch\ndata: {json.dumps(batch_summary(batch_id, items))}\n\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    # ==========================
-    # Desconta créditos (ajuste como quiser)
-    # ==========================
-    if resolution == "1K":
-        cost = 1
-    elif resolution == "2K":
-        cost = 2
-    elif resolution == "4K":
-        cost = 3
-    else:
-        cost = 1
-
-    user.credits -= cost
-    db.commit()
-    db.close()
-
-    PREDICTION_META[prediction.id] = {
-        "member_id": member_id,
-        "prompt": prompt,
-        "model": "google/nano-banana-2"
-    }
 
-    NANOBANANA_TEMP_IMAGES[prediction.id] = public_ids
+@app.get("/cleanup/stats")
+def cleanup_stats():
+    return temp_asset_cleaner.stats()
 
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
-
-# =====================================================
-#                NANO-BANANA - IMAGEM
-# =====================================================
+@app.get("/transfers/stats")
+def transfer_stats():
+    return result_transfers.stats()
 
-@app.post("/generate-image")
-async def generate_image(
-    prompt: str = Form(...),
-    member_id: str = Form(...),
-    aspect_ratio: str = Form("16:9"),
-    input_images: List[UploadFile] = File(None)
-):
-    db = SessionLocal()
-    user = get_user(db, member_id)
-
-    if user.credits <= 0:
-        db.close()
-        return JSONResponse(status_code=403, content={"error": "Créditos insuficientes."})
-    
-    public_ids = []
-
-    # 🔹 Upload opcional de imagens
-    image_urls = []
-    if input_images:
-        print("📥 QTD IMAGENS:", len(input_images))
-        print("📥 NOMES:", [img.filename for img in input_images])
-
-        for image in input_images:
-            
-            #upload = cloudinary.uploader.upload(
-                #image.file,
-                #folder="nanobanana-temp",
-                #resource_type="image"
-            #)
-            upload = cloudinary.uploader.upload(await image.read(), folder="nanobanana-temp", resource_type="image")
-
-            image_urls.append(upload["secure_url"])
-            public_ids.append(upload["public_id"])
-
-    print("✅ URLs enviadas ao modelo:", image_urls)
-
-    model_input = {
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "image_input": image_urls  # se houver imagens
-    }
+@app.get("/status-cache/stats")
+def status_cache_stats():
+    return status_cache.stats()
 
-    prediction = replicate.predictions.create(
-        model="google/nano-banana",
-        input=model_input,
-        webhook="https://SEU-DOMINIO.onrender.com/replicate-webhook",
-        webhook_events_filter=["completed"]
-    )
+@app.get("/credits-cache/stats")
+def credits_cache_stats():
+    return credit_engine.stats()
 
-    creation = Creation(
-        memberstack_id=member_id,
-        replicate_id=prediction.id,
-        prompt=prompt,
-        model="google/nano-banana",
-        status="processing",
-        temp_input_public_ids=public_ids
-    )
+@app.get("/result-cache/stats")
+def result_cache_stats():
+    return result_cache.stats()
 
-    db.add(creation)
-    user.credits -= 1
-    db.commit()
-    db.close()
+@app.get("/events/stats")
+def events_stats():
+    return prediction_events.stats()
 
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return fair_scheduler.stats()
 
+@app.get("/governor/stats")
+def governor_stats():
     return {
-        "prediction_id": prediction.id,
-        "status": "processing"
+        "replicate": replicate_governor.stats(),
+        "cloudinary": cloudinary_governor.stats(),
     }
 
-@app.post("/generate-nano-pro")
-async def generate_nano_banana_pro(
-    prompt: str = Form(...),
-    aspect_ratio: str = Form("1:1"),
-    output_format: str = Form("png"),
-    input_images: List[UploadFile] = File(None)
-):
-    image_urls = []
-    public_ids = []
-
-        # 🔹 Upload opcional de imagens para Cloudinary
-    print("📥 INPUT IMAGES:", input_images)
-    if input_images:
-        print("📥 QTD IMAGENS:", len(input_images))
-        print("📥 NOMES:", [img.filename for img in input_images])
-        for image in input_images[:12]:
-            upload = cloudinary.uploader.upload(
-                image.file,
-                folder="seedream-temp",
-                resource_type="image"
-            )
-            image_urls.append(upload["secure_url"])
-            public_ids.append(upload["public_id"])
+@app.get("/downloads/stats")
+def download_stats():
+    return output_proxy.stats()
 
-    len(image_urls) if image_urls else 0,
+@app.get("/output-cache/stats")
+def output_cache_stats():
+    return output_cache.stats()
 
-    """
-    Nano Banana Pro
-    """
-
-    model_input = {
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "output_format": output_format,
-        "image_input": image_urls,  # ✅ CAMPO CORRETO
-    }
-
-    prediction = replicate.predictions.create(
-        model="google/nano-banana-pro",
-        input=model_input
-    )
-    
-    NANOBANANA_TEMP_IMAGES[prediction.id] = public_ids
+@app.get("/loop/stats")
+def loop_stats():
     return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
+        **loop_lag_monitor.stats(),
+        "profiler": sampling_profiler.stats(),
     }
 
-# =====================================================
-#           SEEDREAM 4.5 - IMAGE
-# =====================================================
-@app.post("/generate-seedream-4.5")
-async def generate_seedream(
-    prompt: str = Form(...),
-    size: str = Form("2K"),
-    aspect_ratio: str = Form("16:9"),
-    sequential_image_generation: str = Form("disabled"),
-    input_images: List[UploadFile] = File(None)
-):
-    image_urls = []
-    public_ids = []
-
-    # 🔹 Upload opcional de imagens para Cloudinary
-    print("📥 INPUT IMAGES:", input_images)
-    if input_images:
-        print("📥 QTD IMAGENS:", len(input_images))
-        print("📥 NOMES:", [img.filename for img in input_images])
-        for image in input_images[:12]:
-            upload = cloudinary.uploader.upload(
-                image.file,
-                folder="seedream-temp",
-                resource_type="image"
-            )
-            image_urls.append(upload["secure_url"])
-            public_ids.append(upload["public_id"])
-
-    len(image_urls) if image_urls else 0,
-
-    max_images = 1
-    prediction = replicate.predictions.create(
-        model="bytedance/seedream-4.5",
-        input={
-            "prompt": prompt,
-            "size": size,
-            "aspect_ratio": aspect_ratio,
-            "image_input": image_urls if image_urls else None,  # ✅ CAMPO CORRETO
-            "max_images": max_images,
-            "sequential_image_generation": sequential_image_generation
-        }
-    )
-
-    SEEDREAM_TEMP_IMAGES[prediction.id] = public_ids
-
+@app.get("/upstreams/stats")
+def upstreams_stats():
     return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
+        "replicate": replicate_upstream.stats(),
+        "cloudinary": cloudinary_upstream.stats(),
+        "replicate_output": output_upstream.stats(),
     }
-# =====================================================
-#        FLUX KONTEXT MAX - IMAGE + TEXT
-# =====================================================
 
-@app.post("/generate-flux-kontext")
-async def generate_flux_kontext(
-    prompt: str = Form(...),
-    output_format: str = Form("jpg"),
-    input_image: UploadFile = File(...)
-):
-    """
-    Flux Kontext Max
-    Texto + imagem obrigatória
-    """
+def component_metrics():
+    """Contadores dos componentes, lidos dos stats() na hora do scrape."""
+    calls = Counter("upstream_calls_total", "Chamadas ao upstream", ["upstream"])
+    failures = Counter("upstream_failures_total", "Falhas de infraestrutura do upstream", ["upstream"])
+    retries = Counter("upstream_retries_total", "Retries do upstream", ["upstream"])
+    hedges = Counter("upstream_hedges_total", "Requests de reserva (hedge)", ["upstream"])
+    short_circuited = Counter("upstream_short_circuited_total", "Chamadas recusadas com circuito aberto", ["upstream"])
+    circuit_open = Gauge("upstream_circuit_open", "1 se o circuito não está fechado", ["upstream"])
+    for name, upstream in [
+        ("replicate", replicate_upstream),
+        ("cloudinary", cloudinary_upstream),
+        ("replicate_output", output_upstream),
+    ]:
+        stats = upstream.stats()
+        calls.inc(stats["calls"], upstream=name)
+        failures.inc(stats["failures"], upstream=name)
+        retries.inc(stats["retries"], upstream=name)
+        hedges.inc(stats["hedges"], upstream=name)
+        short_circuited.inc(stats["short_circuited"], upstream=name)
+        circuit_open.set(int(stats["circuit"] != "closed"), upstream=name)
+
+    inflight = Gauge("upstream_inflight", "Chamadas em voo no governor", ["upstream"])
+    queued = Gauge("upstream_queue_depth", "Chamadas esperando no governor", ["upstream"])
+    rejected = Counter("upstream_rejected_total", "Chamadas recusadas pelo governor", ["upstream", "reason"])
+    throttled = Counter("upstream_throttled_total", "Rate limits recebidos do upstream", ["upstream"])
+    for governor in [replicate_governor, cloudinary_governor]:
+        stats = governor.stats()
+        inflight.set(stats["inflight"], upstream=governor.name)
+        queued.set(stats["queue_depth"], upstream=governor.name)
+        rejected.inc(stats["rejected_queue_full"], upstream=governor.name, reason="queue_full")
+        rejected.inc(stats["rejected_timeout"], upstream=governor.name, reason="timeout")
+        throttled.inc(stats["throttled"], upstream=governor.name)
+
+    scheduler = fair_scheduler.stats()
+    scheduler_inflight = Gauge("scheduler_inflight", "Submissões em voo no scheduler fair-share")
+    scheduler_inflight.set(scheduler["inflight"])
+    scheduler_queued = Gauge("scheduler_queued", "Submissões na fila do scheduler fair-share")
+    scheduler_queued.set(scheduler["queued"])
+
+    # demais componentes: um gauge por valor numérico do stats()
+    component = Gauge("component_stat", "Valores dos endpoints /*/stats", ["component", "stat"])
+    for name, stats in [
+        ("cleanup", temp_asset_cleaner.stats()),
+        ("transfers", result_transfers.stats()),
+        ("status_cache", status_cache.stats()),
+        ("credits_cache", credit_engine.stats()),
+        ("result_cache", result_cache.stats()),
+        ("output_cache", output_cache.stats()),
+        ("downloads", output_proxy.stats()),
+        ("events", prediction_events.stats()),
+    ]:
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                component.set(value, component=name, stat=stat)
 
-    # 1️⃣ Upload temporário para Cloudinary
-    upload_result = cloudinary.uploader.upload(
-        input_image.file,
-        folder="flux-kontext-temp",
-        resource_type="image"
-    )
+    return [
+        calls, failures, retries, hedges, short_circuited, circuit_open,
+        inflight, queued, rejected, throttled, scheduler_inflight, scheduler_queued, component,
+    ]
 
-    image_url = upload_result["secure_url"]
-    public_id = upload_result["public_id"]
 
-    # 2️⃣ Criar prediction no Replicate (SOMENTE URL)
-    prediction = replicate.predictions.create(
-        model="black-forest-labs/flux-kontext-max",
-        input={
-            "prompt": prompt,
-            "input_image": image_url,
-            "output_format": output_format
-        }
-    )
+metrics.register_collector(component_metrics)
 
-    # 3️⃣ Registrar imagem temporária para cleanup depois
-    FLUX_TEMP_IMAGES[prediction.id] = public_id
 
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-# =====================================================
-#               FLUX 2 PRO - IMAGE
-# =====================================================
+# =========================================
+# ADMIN: PROFILE SOB DEMANDA
+# =========================================
+# Só com ADMIN_TOKEN configurado; o token vai no header X-Admin-Token.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 
-@app.post("/generate-flux-2-pro")
-async def generate_flux_2_pro(
-    prompt: str = Form(...),
+def require_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-    resolution: str = Form("1 MP"),
-    aspect_ratio: str = Form("1:1"),
-    output_format: str = Form("webp"),
-    output_quality: int = Form(80),
-    safety_tolerance: int = Form(2),
 
-    input_images: Optional[List[UploadFile]] = File(None)
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval: float = Query(PROFILE_DEFAULT_INTERVAL, ge=0.001, le=1),
+    mode: str = Query("cpu", pattern="^(cpu|wall)$")
 ):
     """
-    Flux 2 Pro
-    - Texto puro
-    - Texto + imagens de referência
+    Profile por amostragem do worker que atendeu a request, no formato
+    folded (flamegraph.pl / speedscope). mode=wall inclui threads ociosas.
     """
+    try:
+        samples, folded = await sampling_profiler.profile(seconds, interval, mode)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profile já em andamento")
 
-    reference_urls = []
-    public_ids = []
-
-    # 🔹 Upload opcional das imagens
-    if input_images:
-        for img in input_images:
-            upload = cloudinary.uploader.upload(
-                img.file,
-                folder="flux-2-pro-temp",
-                resource_type="image"
-            )
-            reference_urls.append(upload["secure_url"])
-            public_ids.append(upload["public_id"])
-
-    # 🔹 Input FINAL do modelo
-    model_input = {
-        "prompt": prompt,
-        "resolution": resolution,
-        "aspect_ratio": aspect_ratio,
-        "output_format": output_format,
-        "output_quality": output_quality,
-        "safety_tolerance": safety_tolerance,
-        "input_images": reference_urls
-    }
-
-    print("🚀 FLUX 2 PRO INPUT:", model_input)
-
-    prediction = replicate.predictions.create(
-        model="black-forest-labs/flux-2-pro",
-        input=model_input
-    )
-
-    # opcional: guardar IDs pra cleanup
-    FLUX_TEMP_IMAGES[prediction.id] = public_ids
-
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
-
-
-# =====================================================
-#              FLUX 1.1 PRO - IMAGE
-# =====================================================
-
-@app.post("/generate-flux")
-async def generate_flux(
-    prompt: str = Form(...),
-    prompt_upsampling: bool = Form(False)
-):
-    prediction = replicate.predictions.create(
-        model="black-forest-labs/flux-1.1-pro",
-        input={
-            "prompt": prompt,
-            "prompt_upsampling": prompt_upsampling
-        }
-    )
+    return Response(folded, media_type="text/plain; charset=utf-8", headers={"X-Profile-Samples": str(samples)})
 
-    return {
-        "prediction_id": prediction.id,
-        "status": prediction.status
-    }
 
 @app.get("/user-credits/{member_id}")
-def get_user_credits(member_id: str):
-    db = SessionLocal()
-    user = db.query(User).filter(User.memberstack_id == member_id).first()
+async def get_user_credits(member_id: str, request: Request):
+    credits = await credit_engine.balance(member_id)
+
+    # ETag do saldo: polling sem mudança volta 304 sem corpo
+    etag = f'"credits-{credits}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
 
-    if not user:
-        return {"credits": 0}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
 
-    return {"credits": user.credits}
+    return JSONResponse({"credits": credits}, headers=headers)
 
 # =====================================================
 #                     STATUS / POLLING
@@ -895,25 +950,32 @@ def get_user_credits(member_id: str):
 
 @app.get("/status/{prediction_id}")
 async def prediction_status(prediction_id: str):
-    db = SessionLocal()
+    # cache curto + polls simultâneos do mesmo id viram uma consulta só
+    return await status_cache.get_or_load(
+        prediction_id,
+        lambda: load_prediction_status(prediction_id)
+    )
+
 
-    creation = db.query(Creation)\
-        .filter(Creation.replicate_id == prediction_id)\
-        .first()
+async def load_prediction_status(prediction_id: str):
+    # Sessão própria (e não a do request): o resultado é compartilhado entre
+    # polls coalescidos, e a conexão volta ao pool antes da chamada ao Replicate
+    async with SessionLocal() as db:
+        creation = await db.scalar(
+            select(Creation).where(Creation.replicate_id == prediction_id)
+        )
 
     if not creation:
-        db.close()
         return {"error": "Prediction not found"}
 
     # Se já foi concluído, não processa de novo
-    if creation.status == "succeeded":
-        db.close()
+    if creation.status in TERMINAL_STATUSES:
         return {
-            "status": "succeeded",
+            "status": creation.status,
             "output_url": creation.result_url
         }
 
-    prediction = replicate.predictions.get(prediction_id)
+    prediction = await get_prediction(prediction_id)
 
     output_url = None
 
@@ -923,29 +985,16 @@ async def prediction_status(prediction_id: str):
         elif isinstance(prediction.output, str):
             output_url = prediction.output
 
-    # 🔥 Se concluiu agora
+    # 🔥 Se concluiu agora: cópia para a gallery roda em background
     if prediction.status == "succeeded" and output_url:
+        result_transfers.submit(prediction_id, output_url)
 
-        final_upload = cloudinary.uploader.upload(
-            output_url,
-            folder="gallery",
-            resource_type="auto"
-        )
-
-        creation.status = "succeeded"
-        creation.result_url = final_upload["secure_url"]
-        creation.completed_at = datetime.utcnow()
-
-        db.commit()
-
-    elif prediction.status == "failed":
-        creation.status = "failed"
-        db.commit()
+    elif prediction.status in ["failed", "canceled"]:
+        # mesmo fechamento do webhook (que pode não chegar)
+        await close_unsuccessful(creation, prediction.status)
 
     final_status = creation.status
     final_output = creation.result_url
-    
-    db.close()
 
     return {
         "status": final_status,
@@ -954,97 +1003,252 @@ async def prediction_status(prediction_id: str):
 
 
 @app.post("/replicate-webhook")
-async def replicate_webhook(request: Request):
+async def replicate_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+
+    raw_body = await request.body()
+
+    if REPLICATE_WEBHOOK_SECRET and not verify_replicate_signature(raw_body, request.headers):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
 
-    payload = await request.json()
+    payload = json.loads(raw_body)
 
     prediction_id = payload.get("id")
     status = payload.get("status")
     output = payload.get("output")
 
-    db = SessionLocal()
+    # 🔥 Predictions registradas só no contexto (sem Creation)
+    if status in ["succeeded", "failed", "canceled"]:
+        context = await prediction_contexts.pop(prediction_id)
+        if context:
+            await release_temp_assets(context.get("temp_public_ids"))
 
-    creation = db.query(Creation)\
-        .filter(Creation.replicate_id == prediction_id)\
-        .first()
+    creation = await db.scalar(
+        select(Creation).where(Creation.replicate_id == prediction_id)
+    )
+
+    creation_id = request.query_params.get("creation_id", "")
+    if not creation and creation_id.isdigit():
+        # webhook chegou junto com o fim do create: liga aqui (ou o
+        # bind_creation acabou de ligar entre as duas consultas)
+        creation = await db.scalar(
+            select(Creation).where(
+                Creation.id == int(creation_id),
+                or_(Creation.replicate_id.is_(None), Creation.replicate_id == prediction_id)
+            )
+        )
+        if creation and creation.replicate_id is None:
+            creation.replicate_id = prediction_id
+            if creation.status == "queued":
+                creation.status = "processing"
+            await db.commit()
 
     if not creation:
-        db.close()
+        # sem cópia para a gallery: o output do Replicate já é o final
+        output_url = output[0] if isinstance(output, list) and output else output
+        await prediction_events.publish(
+            prediction_id, status,
+            output_url if isinstance(output_url, str) else None
+        )
         return {"status": "not found"}
 
     # 🔒 Proteção contra duplicação
     if creation.status == "succeeded":
-        db.close()
         return {"status": "already processed"}
 
-    if status == "failed":
-        creation.status = "failed"
-        db.commit()
-        db.close()
-        return {"status": "updated failed"}
+    if status in ["failed", "canceled"]:
+        if not await close_unsuccessful(creation, status):
+            return {"status": "already processed"}
+        return {"status": f"updated {status}"}
 
     if status == "succeeded":
-    
-        if creation.status == "succeeded":
-            db.close()
-            return {"status": "already processed"}
-    
+
         output_url = None
-    
+
         if isinstance(output, list):
             output_url = output[0]
         elif isinstance(output, str):
             output_url = output
-    
+
         if output_url:
-    
-            final_upload = cloudinary.uploader.upload(
-                output_url,
-                folder="gallery",
-                resource_type="auto"
-            )
-    
-            creation.status = "succeeded"
-            creation.result_url = final_upload["secure_url"]
-            creation.completed_at = datetime.utcnow()
-    
-            # 🔥 CLEANUP TEMP IMAGES
-            if creation.temp_input_public_ids:
-                for public_id in creation.temp_input_public_ids:
-                    try:
-                        cloudinary.uploader.destroy(public_id)
-                    except Exception as e:
-                        print("Cloudinary cleanup error:", e)
-    
-            creation.temp_input_public_ids = None  # limpa campo
-    
-            db.commit()
-
-    db.close()
+            # registra o output do Replicate; a cópia para a gallery
+            # (e o cleanup dos temporários) roda no pool de transferência
+            creation.output_urls = json.dumps(output if isinstance(output, list) else [output])
+            await db.commit()
+
+            if not result_transfers.submit(prediction_id, output_url):
+                # fila cheia: o Replicate reenvia o webhook depois
+                return JSONResponse(status_code=503, content={"status": "busy"})
+
+            return {"status": "accepted"}
+
+    # transições intermediárias (starting/processing)
+    if status != "succeeded":
+        await prediction_events.publish(prediction_id, status)
 
     return {"status": "processed"}
+
+
+# =========================================
+# PUSH DE PROGRESSO (SSE / WEBSOCKET)
+# =========================================
+# Predictions com Creation publicam cada transição; as demais (sem cópia
+# para a gallery) registram só o webhook "completed": o stream mostra o
+# estado atual, lido do Replicate, e depois o status terminal.
+EVENTS_KEEPALIVE = 15
+
+async def untracked_prediction_status(prediction_id: str):
+    try:
+        prediction = await get_prediction(prediction_id)
+    except ReplicateError as e:
+        if e.status == 404:
+            return {"error": "Prediction not found"}
+        raise
+
+    output = prediction.output
+    output_url = output[0] if isinstance(output, list) and output else output
+    return {
+        "status": prediction.status,
+        "output_url": output_url if isinstance(output_url, str) else None
+    }
+
+
+async def prediction_event_stream(prediction_id: str):
+    """
+    Estado atual primeiro, depois cada transição até um status terminal.
+    Gera None nos intervalos de keepalive.
+    """
+    queue = prediction_events.subscribe(prediction_id)
+    try:
+        current = await prediction_status(prediction_id)
+        if "error" in current:
+            current = await untracked_prediction_status(prediction_id)
+
+        yield {"prediction_id": prediction_id, **current}
+        if "error" in current or current["status"] in TERMINAL_STATUSES:
+            return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+
+            yield event
+            if event["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        prediction_events.unsubscribe(prediction_id, queue)
+
+
+@app.get("/events/{prediction_id}")
+async def prediction_events_sse(prediction_id: str):
+
+    async def stream():
+        async with aclosing(prediction_event_stream(prediction_id)) as events:
+            async for event in events:
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: status\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/events/{prediction_id}")
+async def prediction_events_ws(websocket: WebSocket, prediction_id: str):
+    await websocket.accept()
+
+    try:
+        async with aclosing(prediction_event_stream(prediction_id)) as events:
+            async for event in events:
+                if event is not None:
+                    await websocket.send_json(event)
+    except WebSocketDisconnect:
+        return
+
+    await websocket.close()
 # =========================================
 # USER GALLERY
 # =========================================
+GALLERY_PAGE_SIZE = 24
+GALLERY_MAX_PAGE_SIZE = 100
+
+
+def encode_gallery_cursor(created_at, creation_id):
+    raw = json.dumps([created_at.isoformat(), creation_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_gallery_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, creation_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(creation_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/my-creations/{member_id}")
-def my_creations(member_id: str):
-    db = SessionLocal()
-    creations = db.query(Creation)\
-        .filter(Creation.memberstack_id == member_id)\
-        .order_by(Creation.created_at.desc())\
-        .all()
-    db.close()
+async def my_creations(
+    member_id: str,
+    limit: int = Query(GALLERY_PAGE_SIZE, ge=1, le=GALLERY_MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    status: str | None = None,
+    include_prompt: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Galeria paginada por keyset em (created_at, id), do mais novo ao mais antigo.
+    - cursor: next_cursor da página anterior
+    - status: filtra por status (ex.: "succeeded" ou "succeeded,processing")
+    - include_prompt: inclui o prompt (fora do card por padrão)
+    """
+    columns = [Creation.id, Creation.status, Creation.result_url, Creation.created_at]
+    if include_prompt:
+        columns.append(Creation.prompt)
+
+    query = (
+        select(*columns)
+        .where(Creation.memberstack_id == member_id)
+        .order_by(Creation.created_at.desc(), Creation.id.desc())
+        .limit(limit + 1)
+    )
 
-    return [
-        {
-            "id": c.id,
-            "prompt": c.prompt,
-            "status": c.status,
-            "image": c.result_url,
-            "created_at": c.created_at
+    if status:
+        query = query.where(Creation.status.in_(status.split(",")))
+
+    if cursor:
+        created_at, creation_id = decode_gallery_cursor(cursor)
+        query = query.where(
+            tuple_(Creation.created_at, Creation.id) < tuple_(created_at, creation_id)
+        )
+
+    rows = (await db.execute(query)).all()
+    page = rows[:limit]
+
+    items = []
+    for row in page:
+        item = {
+            "id": row.id,
+            "status": row.status,
+            "image": row.result_url,
+            "created_at": row.created_at
         }
-        for c in creations
-    ]
+        if include_prompt:
+            item["prompt"] = row.prompt
+        items.append(item)
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_gallery_cursor(last.created_at, last.id)
+
+    return {"items": items, "next_cursor": next_cursor}
 
 # =========================================
 # MEMBERSTACK WEBHOOK (ADD CREDITS)
@@ -1079,25 +1283,19 @@ async def memberstack_webhook(request: Request):
 
     member_id = member.get("id")
     credits = plan.get("metadata", {}).get("credits", 0)
+    weight = plan.get("metadata", {}).get("weight")
 
     if not member_id:
         return {"status": "no member id"}
 
-    db = SessionLocal()
+    if event not in ["subscription.created", "subscription.renewed"]:
+        credits = 0
 
-    user = db.query(User).filter(User.memberstack_id == member_id).first()
-
-    if not user:
-        user = User(memberstack_id=member_id, credits=0)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+    await credit_engine.grant(member_id, credits, f"memberstack:{event}")
 
+    # peso do plano no scheduler fair-share
     if event in ["subscription.created", "subscription.renewed"]:
-        user.credits += credits
-        db.commit()
-
-    db.close()
+        await fair_scheduler.set_weight(member_id, parse_weight(weight))
 
     return {"status": "secure webhook processed"}
 
@@ -1111,40 +1309,84 @@ def root():
 
 
 @app.delete("/delete-creation/{creation_id}/{member_id}")
-async def delete_creation(creation_id: int, member_id: str):
-
-    db = SessionLocal()
+async def delete_creation(creation_id: int, member_id: str, db: AsyncSession = Depends(get_db)):
 
-    creation = db.query(Creation).filter(
-        Creation.id == creation_id,
-        Creation.member_id == member_id
-    ).first()
+    creation = await db.scalar(
+        select(Creation).where(
+            Creation.id == creation_id,
+            Creation.memberstack_id == member_id
+        )
+    )
 
     if not creation:
-        db.close()
         return {"error": "Not found"}
 
-    db.delete(creation)
-    db.commit()
-    db.close()
+    await db.delete(creation)
+    if creation.replicate_id and EVENTS_BROKER == "postgres":
+        # entregue no commit, a todos os workers
+        await db.execute(select(func.pg_notify(CREATION_DELETED_CHANNEL, creation.replicate_id)))
+    await db.commit()
+
+    if creation.replicate_id:
+        forget_prediction(creation.replicate_id)
 
     return {"success": True}
 # =====================================================
 #                   DOWNLOAD OPCIONAL
 # =====================================================
 
-@app.get("/download/{prediction_id}")
-async def download_prediction(prediction_id: str):
-    prediction = replicate.predictions.get(prediction_id)
+@app.api_route("/download/{prediction_id}", methods=["GET", "HEAD"])
+async def download_prediction(prediction_id: str, request: Request):
+    range_header = request.headers.get("range")
+
+    # 1️⃣ Cache local em disco
+    cached = output_cache.lookup(prediction_id, range_header) if OUTPUT_CACHE_ENABLED else None
+    if cached:
+        return output_cache.response(prediction_id, cached)
+
+    # 2️⃣ Origem: cópia da gallery (não expira) ou output do Replicate
+    async with SessionLocal() as db:
+        output_url = await db.scalar(
+            select(Creation.result_url).where(
+                Creation.replicate_id == prediction_id,
+                Creation.status == "succeeded"
+            )
+        )
 
-    if not prediction.output:
-        return {"error": "Output ainda não está pronto."}
+    if not output_url:
+        prediction = await get_prediction(prediction_id)
 
-    output_url = prediction.output[0]
-    file_bytes = requests.get(output_url).content
+        if not prediction.output:
+            return {"error": "Output ainda não está pronto."}
 
-    file_path = f"output_{prediction_id}.mp4"
-    with open(file_path, "wb") as f:
-        f.write(file_bytes)
+        # vídeo: output é uma URL; imagens: lista de URLs
+        output = prediction.output
+        output_url = output if isinstance(output, str) else output[0]
 
-    return {"file_path": file_path, "downloaded": True}
+    try:
+        upstream = await output_proxy.fetch(output_url, request.headers)
+    except httpx.HTTPError as e:
+        logger.warning("Download error (%s): %s", prediction_id, e)
+        raise HTTPException(status_code=502, detail="Falha ao baixar o output.")
+
+    filename = output_url.rsplit("/", 1)[-1].split("?", 1)[0]
+    headers = output_proxy.response_headers(upstream)
+    headers["Content-Disposition"] = f'inline; filename="{prediction_id}{os.path.splitext(filename)[1]}"'
+
+    if request.method == "HEAD" or upstream.status_code in [304, 416]:
+        await upstream.aclose()
+        return Response(status_code=upstream.status_code, headers=headers)
+
+    body = output_proxy.relay(upstream)
+
+    # 3️⃣ Download completo: grava uma cópia no cache enquanto repassa
+    if (
+        OUTPUT_CACHE_ENABLED
+        and upstream.status_code == 200
+        and not range_header
+        and "content-encoding" not in upstream.headers
+    ):
+        length = upstream.headers.get("content-length")
+        body = output_cache.tee(prediction_id, body, filename, int(length) if length else None)
+
+    return StreamingResponse(body, status_code=upstream.status_code, headers=headers)
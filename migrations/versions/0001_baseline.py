@@ -0,0 +1,42 @@
+"""baseline: schema criado pelo create_all antigo
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("memberstack_id", sa.String(), unique=True),
+        sa.Column("email", sa.String()),
+        sa.Column("credits", sa.Integer()),
+    )
+    op.create_table(
+        "creations",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("memberstack_id", sa.String()),
+        sa.Column("replicate_id", sa.String()),
+        sa.Column("prompt", sa.Text()),
+        sa.Column("model", sa.String()),
+        sa.Column("status", sa.String()),
+        sa.Column("result_url", sa.Text()),
+        sa.Column("output_urls", sa.Text()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("temp_input_public_ids", sa.JSON(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("creations")
+    op.drop_table("users")
@@ -0,0 +1,98 @@
+"""creations: completed_at + índices de replicate_id e (memberstack_id, created_at DESC)
+
+Revision ID: 0002_creations_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002_creations_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger(f"alembic.{__name__}")
+
+INDEXES = ["ix_creations_replicate_id", "ix_creations_memberstack_created"]
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    # replicate_id repetido em membros diferentes: não dá para escolher a
+    # linha certa aqui; aborta antes de mexer no schema
+    conflicts = bind.execute(sa.text(
+        "SELECT replicate_id FROM creations WHERE replicate_id IS NOT NULL "
+        "GROUP BY replicate_id HAVING COUNT(DISTINCT memberstack_id) > 1 LIMIT 10"
+    )).scalars().all()
+    if conflicts:
+        raise RuntimeError(
+            "creations.replicate_id repetido entre membros diferentes "
+            f"(ex.: {', '.join(conflicts)}); resolva à mão e rode o upgrade de novo"
+        )
+
+    # idempotente: o autocommit_block abaixo já commitou a coluna se uma
+    # tentativa anterior falhou no build do índice
+    if "completed_at" not in {c["name"] for c in sa.inspect(bind).get_columns("creations")}:
+        with op.batch_alter_table("creations") as batch:
+            batch.add_column(sa.Column("completed_at", sa.DateTime(), nullable=True))
+
+    # Duplicatas do mesmo membro (o código antigo podia gravar a mesma
+    # prediction duas vezes): fica a linha mais completa (succeeded, com
+    # resultado, a mais antiga)
+    removed = bind.execute(sa.text(
+        "DELETE FROM creations WHERE id IN ("
+        "  SELECT id FROM ("
+        "    SELECT id, ROW_NUMBER() OVER ("
+        "      PARTITION BY replicate_id ORDER BY"
+        "        CASE WHEN status = 'succeeded' THEN 0 ELSE 1 END,"
+        "        CASE WHEN result_url IS NULL THEN 1 ELSE 0 END,"
+        "        id"
+        "    ) AS rn"
+        "    FROM creations WHERE replicate_id IS NOT NULL"
+        "  ) ranked WHERE rn > 1"
+        ")"
+    )).rowcount
+    if removed:
+        logger.warning("creations: %s linhas com replicate_id duplicado removidas", removed)
+
+    # CONCURRENTLY no Postgres: não trava escrita na tabela durante o build.
+    # Precisa rodar fora de transação. Um build que falhou (ex.: duplicata
+    # gravada pelo app durante o build) deixa o índice INVALID: é removido
+    # aqui para o upgrade poder ser repetido.
+    with op.get_context().autocommit_block():
+        if bind.dialect.name == "postgresql":
+            for name in INDEXES:
+                invalid = bind.execute(sa.text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ), {"name": name}).first()
+                if invalid:
+                    op.drop_index(name, table_name="creations", postgresql_concurrently=True)
+        op.create_index(
+            "ix_creations_replicate_id",
+            "creations",
+            ["replicate_id"],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_creations_memberstack_created",
+            "creations",
+            ["memberstack_id", sa.text("created_at DESC")],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_creations_memberstack_created", table_name="creations", postgresql_concurrently=True)
+        op.drop_index("ix_creations_replicate_id", table_name="creations", postgresql_concurrently=True)
+
+    with op.batch_alter_table("creations") as batch:
+        batch.drop_column("completed_at")
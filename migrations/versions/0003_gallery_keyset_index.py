@@ -0,0 +1,36 @@
+"""creations: índice da galeria cobre o keyset (memberstack_id, created_at DESC, id DESC)
+
+Revision ID: 0003_gallery_keyset_index
+Revises: 0002_creations_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003_gallery_keyset_index"
+down_revision = "0002_creations_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_creations_memberstack_created_id",
+            "creations",
+            ["memberstack_id", sa.text("created_at DESC"), sa.text("id DESC")],
+            postgresql_concurrently=True,
+        )
+        op.drop_index("ix_creations_memberstack_created", table_name="creations", postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_creations_memberstack_created",
+            "creations",
+            ["memberstack_id", sa.text("created_at DESC")],
+            postgresql_concurrently=True,
+        )
+        op.drop_index("ix_creations_memberstack_created_id", table_name="creations", postgresql_concurrently=True)
@@ -0,0 +1,32 @@
+"""credit_ledger: histórico append-only dos movimentos de créditos
+
+Revision ID: 0004_credit_ledger
+Revises: 0003_gallery_keyset_index
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004_credit_ledger"
+down_revision = "0003_gallery_keyset_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "credit_ledger",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("memberstack_id", sa.String()),
+        sa.Column("delta", sa.Integer()),
+        sa.Column("balance", sa.Integer()),
+        sa.Column("reason", sa.String()),
+        sa.Column("created_at", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index("ix_credit_ledger_memberstack_id", "credit_ledger", ["memberstack_id"])
+
+
+def downgrade():
+    op.drop_index("ix_credit_ledger_memberstack_id", table_name="credit_ledger")
+    op.drop_table("credit_ledger")
@@ -0,0 +1,35 @@
+"""creations: batch_id (POST /batch-generate)
+
+Revision ID: 0005_creations_batch_id
+Revises: 0004_credit_ledger
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_creations_batch_id"
+down_revision = "0004_credit_ledger"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("creations") as batch:
+        batch.add_column(sa.Column("batch_id", sa.String(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_creations_batch_id",
+            "creations",
+            ["batch_id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_creations_batch_id", table_name="creations", postgresql_concurrently=True)
+
+    with op.batch_alter_table("creations") as batch:
+        batch.drop_column("batch_id")
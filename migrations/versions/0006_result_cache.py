@@ -0,0 +1,49 @@
+"""result_cache + creations.result_key
+
+Revision ID: 0006_result_cache
+Revises: 0005_creations_batch_id
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_result_cache"
+down_revision = "0005_creations_batch_id"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "result_cache",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("model", sa.String()),
+        sa.Column("prediction_id", sa.String()),
+        sa.Column("output_url", sa.Text()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("expires_at", sa.DateTime()),
+    )
+    op.create_index("ix_result_cache_expires_at", "result_cache", ["expires_at"])
+
+    with op.batch_alter_table("creations") as batch:
+        batch.add_column(sa.Column("result_key", sa.String(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_creations_result_key",
+            "creations",
+            ["result_key"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_creations_result_key", table_name="creations", postgresql_concurrently=True)
+
+    with op.batch_alter_table("creations") as batch:
+        batch.drop_column("result_key")
+
+    op.drop_index("ix_result_cache_expires_at", table_name="result_cache")
+    op.drop_table("result_cache")
@@ -0,0 +1,24 @@
+"""users: plan_weight (fair-share do scheduler)
+
+Revision ID: 0007_users_plan_weight
+Revises: 0006_result_cache
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_users_plan_weight"
+down_revision = "0006_result_cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("plan_weight", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("plan_weight")
@@ -0,0 +1,49 @@
+"""upload_cache + prediction_contexts
+
+Revision ID: 0008_cache_and_contexts
+Revises: 0007_users_plan_weight
+Create Date: 2026-10-18
+
+Tabelas novas desta série (o create_all antigo nunca criou). Estavam no
+0001_baseline, mas bancos legados são só marcados como 0001 (stamp) e
+ficavam sem elas. Bancos criados do zero antes desta revisão já têm as
+duas: só cria o que falta.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_cache_and_contexts"
+down_revision = "0007_users_plan_weight"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "upload_cache" not in tables:
+        op.create_table(
+            "upload_cache",
+            sa.Column("sha256", sa.String(), primary_key=True),
+            sa.Column("secure_url", sa.Text()),
+            sa.Column("public_id", sa.String()),
+            sa.Column("expires_at", sa.DateTime()),
+        )
+        op.create_index("ix_upload_cache_public_id", "upload_cache", ["public_id"])
+
+    if "prediction_contexts" not in tables:
+        op.create_table(
+            "prediction_contexts",
+            sa.Column("prediction_id", sa.String(), primary_key=True),
+            sa.Column("data", sa.JSON()),
+            sa.Column("expires_at", sa.DateTime()),
+        )
+        op.create_index("ix_prediction_contexts_expires_at", "prediction_contexts", ["expires_at"])
+
+
+def downgrade():
+    op.drop_index("ix_prediction_contexts_expires_at", table_name="prediction_contexts")
+    op.drop_table("prediction_contexts")
+    op.drop_index("ix_upload_cache_public_id", table_name="upload_cache")
+    op.drop_table("upload_cache")
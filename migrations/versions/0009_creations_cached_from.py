@@ -0,0 +1,35 @@
+"""creations: cached_from (Creation de quem recebeu um hit do result_cache)
+
+Revision ID: 0009_creations_cached_from
+Revises: 0008_cache_and_contexts
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_creations_cached_from"
+down_revision = "0008_cache_and_contexts"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("creations") as batch:
+        batch.add_column(sa.Column("cached_from", sa.String(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_creations_cached_from",
+            "creations",
+            ["cached_from"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_creations_cached_from", table_name="creations", postgresql_concurrently=True)
+
+    with op.batch_alter_table("creations") as batch:
+        batch.drop_column("cached_from")
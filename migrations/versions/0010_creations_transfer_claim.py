@@ -0,0 +1,24 @@
+"""creations: transfer_claimed_at (claim atômico da cópia para a gallery)
+
+Revision ID: 0010_creations_transfer_claim
+Revises: 0009_creations_cached_from
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_creations_transfer_claim"
+down_revision = "0009_creations_cached_from"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("creations") as batch:
+        batch.add_column(sa.Column("transfer_claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("creations") as batch:
+        batch.drop_column("transfer_claimed_at")
@@ -0,0 +1,435 @@
+import os
+import json
+import hashlib
+from typing import Annotated, Literal
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ConfigDict, Field, AfterValidator, ValidationError, WithJsonSchema
+from pydantic_core import PydanticCustomError
+from starlette.datastructures import UploadFile
+from uploads import UPLOAD_MAX_BYTES
+
+# =========================================
+# REGISTRO DE MODELOS
+# =========================================
+# Uma entrada por modelo: slug, schema pydantic do input, campos de imagem,
+# custo em créditos e pasta temporária. Tudo é montado uma vez no import;
+# o /generate/{slug} (e as URLs antigas /generate-*, como aliases) passam
+# por um único caminho de dispatch no main.py.
+#
+# A validação roda antes de qualquer upload ou chamada ao Replicate: input
+# inválido volta 422 sem custar Cloudinary nem GPU.
+#
+# result_cache (opt-in por modelo, ver result_cache.py):
+# - "seeded": reaproveita o resultado só quando o request traz seed
+# - "always": modelo determinístico para o mesmo input
+
+PROMPT_MAX_LENGTH = 10000
+# obrigatória: sem ela nenhum webhook chega (Creation presa em "processing");
+# o lifespan do main.py recusa subir sem ela
+REPLICATE_WEBHOOK_URL = os.getenv("REPLICATE_WEBHOOK_URL")
+
+
+def int_choice(*values):
+    # Literal[int] não aceita "8" vindo de form; converte e confere aqui
+    expected = ", ".join(str(v) for v in values)
+
+    def check(value):
+        if value not in values:
+            raise PydanticCustomError("literal_error", "Input should be {expected}", {"expected": expected})
+        return value
+
+    return Annotated[int, AfterValidator(check), WithJsonSchema({"type": "integer", "enum": list(values)})]
+
+
+AspectRatio = Annotated[str, Field(pattern=r"^(\d+:\d+|match_input_image)$")]
+
+
+class GenerationInput(BaseModel):
+    # campos desconhecidos do form são ignorados (como nas rotas antigas)
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    prompt: str = Field(min_length=1, max_length=PROMPT_MAX_LENGTH)
+    # chave da fila fair-share (não vai para o Replicate); sem membro, a
+    # request cai na fila "anonymous"
+    member_id: str | None = Field(default=None, min_length=1)
+
+
+class MemberGenerationInput(GenerationInput):
+    # modelos que cobram créditos: membro obrigatório
+    member_id: str = Field(min_length=1)
+
+
+# -----------------------------
+# Schemas
+# -----------------------------
+class Sora2Input(GenerationInput):
+    aspect_ratio: Literal["landscape", "portrait"] = "landscape"
+    seconds: int_choice(4, 8, 12) | None = None
+    quality: str = "1080p"
+
+
+class Sora2ProInput(GenerationInput):
+    aspect_ratio: Literal["landscape", "portrait"] = "landscape"
+    seconds: int_choice(4, 8, 12) | None = None
+    resolution: Literal["standard", "high"] = "standard"
+
+
+Seed = Annotated[int | None, Field(ge=0)]
+
+
+class KlingInput(GenerationInput):
+    aspect_ratio: Literal["16:9", "9:16", "1:1"] = "16:9"
+    duration: int_choice(5, 10) = 5
+
+
+class Gen4Input(GenerationInput):
+    duration: int_choice(5, 10) = 5
+    aspect_ratio: Literal["16:9", "9:16", "4:3", "3:4", "1:1", "21:9"] = "16:9"
+
+
+class VeoInput(GenerationInput):
+    duration: int_choice(4, 6, 8) = 8
+    resolution: Literal["720p", "1080p"] = "1080p"
+    aspect_ratio: Literal["16:9", "9:16"] = "16:9"
+    generate_audio: bool = True
+    seed: Seed = None
+
+
+class VeoFastInput(VeoInput):
+    resolution: Literal["720p", "1080p"] = "720p"
+
+
+class NanoBanana2Input(MemberGenerationInput):
+    aspect_ratio: AspectRatio = "1:1"
+    resolution: Literal["1K", "2K", "4K"] = "1K"
+    image_search: bool = False
+    google_search: bool = False
+    output_format: Literal["jpg", "png"] = "jpg"
+
+
+class NanoBananaInput(MemberGenerationInput):
+    aspect_ratio: AspectRatio = "16:9"
+
+
+class NanoBananaProInput(GenerationInput):
+    aspect_ratio: AspectRatio = "1:1"
+    output_format: Literal["jpg", "png"] = "png"
+
+
+class SeedreamInput(GenerationInput):
+    size: Literal["1K", "2K", "4K", "custom"] = "2K"
+    aspect_ratio: AspectRatio = "16:9"
+    sequential_image_generation: Literal["disabled", "auto"] = "disabled"
+
+
+class FluxKontextInput(GenerationInput):
+    output_format: Literal["jpg", "png"] = "jpg"
+    seed: Seed = None
+
+
+class Flux2ProInput(GenerationInput):
+    resolution: Literal["match_input_image", "0.5 MP", "1 MP", "2 MP", "4 MP"] = "1 MP"
+    aspect_ratio: Annotated[str, Field(pattern=r"^(\d+:\d+|match_input_image|custom)$")] = "1:1"
+    output_format: Literal["webp", "jpg", "png"] = "webp"
+    output_quality: int = Field(80, ge=0, le=100)
+    safety_tolerance: int = Field(2, ge=1, le=5)
+    seed: Seed = None
+
+
+class FluxInput(GenerationInput):
+    prompt_upsampling: bool = False
+    seed: Seed = None
+
+
+def check_file_sizes(uploads):
+    for upload in uploads:
+        if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Arquivo maior que {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"
+            )
+
+
+# -----------------------------
+# Specs
+# -----------------------------
+class ImageField:
+    def __init__(self, name, input_key=None, multiple=False, required=False, max_files=1):
+        self.name = name
+        self.input_key = input_key or name
+        self.multiple = multiple
+        self.required = required
+        self.max_files = max_files if multiple else 1
+
+
+class ModelSpec:
+    def __init__(
+        self,
+        slug,
+        model,
+        schema,
+        legacy_path,
+        images=(),
+        temp_folder=None,
+        cost=0,
+        rename=None,
+        fixed_input=None,
+        webhook=False,
+        result_cache=None,
+    ):
+        self.slug = slug
+        self.model = model
+        self.schema = schema
+        self.legacy_path = legacy_path
+        self.images = tuple(images)
+        self.temp_folder = temp_folder
+        # int fixo ou função(params) -> int; 0 = não cobra
+        self.cost = cost
+        # campo do form -> chave do input do Replicate
+        self.rename = rename or {}
+        self.fixed_input = fixed_input or {}
+        # webhook=True: resultado chega pelo /replicate-webhook e vira Creation
+        self.webhook = webhook
+        # hit do cache não roda GPU nem cobra: só modelos gratuitos
+        if result_cache and cost:
+            raise ValueError(f"{slug}: result_cache só em modelos sem custo")
+        self.result_cache = result_cache
+        # Creation (e cópia para a gallery) em toda request do modelo; os
+        # com cache precisam dela para gravar o resultado, com ou sem seed
+        self.tracked = webhook or result_cache is not None
+
+        # pré-computado: campos de texto do schema e de arquivo
+        self.text_fields = tuple(schema.model_fields)
+        self.charges_member = issubclass(schema, MemberGenerationInput)
+
+    def parse(self, form):
+        """
+        Valida o form inteiro (texto + arquivos) sem I/O.
+        Retorna (params, {campo: [UploadFile]}) ou levanta 422/413.
+        """
+        data = {}
+        for name in self.text_fields:
+            value = form.get(name)
+            # "" no form = campo não enviado (usa o default)
+            if isinstance(value, str) and value != "":
+                data[name] = value
+
+        params, errors = self.validate_params(data, ("body",))
+
+        files = {}
+        for field in self.images:
+            # input de arquivo vazio do browser chega como UploadFile sem nome
+            uploads = [
+                f for f in form.getlist(field.name)
+                if isinstance(f, UploadFile) and (f.filename or f.size)
+            ]
+            check_file_sizes(uploads)
+            errors.extend(self.validate_image_count(field, len(uploads), ("body", field.name)))
+            files[field.name] = uploads
+
+        if errors:
+            raise RequestValidationError(errors)
+
+        return params, files
+
+    def validate_params(self, data, loc):
+        """Retorna (params | None, erros) com `loc` prefixado."""
+        try:
+            return self.schema.model_validate(data), []
+        except ValidationError as e:
+            return None, [{**err, "loc": (*loc, *err["loc"])} for err in e.errors(include_url=False)]
+
+    def validate_image_count(self, field, count, loc):
+        if field.required and not count:
+            return [{"type": "missing", "loc": loc, "msg": "Field required", "input": None}]
+        if count > field.max_files:
+            return [{
+                "type": "too_long",
+                "loc": loc,
+                "msg": f"At most {field.max_files} file(s)",
+                "input": count,
+            }]
+        return []
+
+    def cost_for(self, params):
+        return self.cost(params) if callable(self.cost) else self.cost
+
+    def build_input(self, params, files, uploads):
+        """
+        Monta o model_input do Replicate. `uploads` vem na mesma ordem de
+        upload_files(files); só a quantidade por campo de `files` é usada.
+        """
+        model_input = params.model_dump(exclude={"member_id"}, exclude_none=True)
+
+        for source, target in self.rename.items():
+            if source in model_input:
+                model_input[target] = model_input.pop(source)
+
+        model_input.update(self.fixed_input)
+
+        position = 0
+        for field in self.images:
+            count = len(files[field.name])
+            urls = [u["secure_url"] for u in uploads[position:position + count]]
+            position += count
+
+            if urls:
+                model_input[field.input_key] = urls if field.multiple else urls[0]
+
+        return model_input
+
+    def cacheable(self, params):
+        if self.result_cache == "always":
+            return True
+        return self.result_cache == "seeded" and getattr(params, "seed", None) is not None
+
+    def result_key(self, params, files, digests):
+        """
+        Hash de (slug, model_input canônico). Imagens entram pelo sha256 do
+        conteúdo (`digests`, na ordem de upload_files), não pela URL.
+        """
+        canonical = self.build_input(params, files, [{"secure_url": "sha256:" + d} for d in digests])
+        payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(f"{self.slug}\n{payload}".encode()).hexdigest()
+
+    def upload_files(self, files):
+        return [f for field in self.images for f in files[field.name]]
+
+    def prediction_params(self, webhook=None, creation_id=None):
+        """
+        creation_id: Creation já inserida para esta prediction; vai na URL do
+        webhook para ele achar a linha mesmo antes do replicate_id ser gravado.
+        """
+        if not (self.webhook if webhook is None else webhook):
+            return {}
+
+        url = REPLICATE_WEBHOOK_URL
+        if creation_id is not None:
+            url += ("&" if "?" in url else "?") + f"creation_id={creation_id}"
+        return {
+            "webhook": url,
+            "webhook_events_filter": ["completed"],
+        }
+
+
+NANOBANANA_2_COSTS = {"1K": 1, "2K": 2, "4K": 3}
+
+MODEL_SPECS = [
+    ModelSpec(
+        slug="sora-2",
+        model="openai/sora-2",
+        schema=Sora2Input,
+        legacy_path="/generate",
+        images=[ImageField("reference_file", "input_reference")],
+        temp_folder="sora2-temp",
+        rename={"quality": "resolution"},
+    ),
+    ModelSpec(
+        slug="sora-2-pro",
+        model="openai/sora-2-pro",
+        schema=Sora2ProInput,
+        legacy_path="/generate-sora-pro",
+        images=[ImageField("reference_file", "input_reference")],
+        temp_folder="sora2-pro-temp",
+    ),
+    ModelSpec(
+        slug="kling-2.5-pro",
+        model="kwaivgi/kling-v2.5-turbo-pro",
+        schema=KlingInput,
+        legacy_path="/generate-kling-2.5-pro",
+        images=[ImageField("first_frame"), ImageField("last_frame")],
+        temp_folder="kling-temp",
+    ),
+    ModelSpec(
+        slug="gen4",
+        model="runwayml/gen4-turbo",
+        schema=Gen4Input,
+        legacy_path="/generate-gen4",
+        images=[ImageField("reference_file", "image", required=True)],
+        temp_folder="gen4-temp",
+    ),
+    ModelSpec(
+        slug="veo",
+        model="google/veo-3.1",
+        schema=VeoInput,
+        legacy_path="/generate-veo",
+        images=[ImageField("reference_images", multiple=True, max_files=3)],
+        temp_folder="veo3-temp",
+        result_cache="seeded",
+    ),
+    ModelSpec(
+        slug="veo-fast",
+        model="google/veo-3-fast",
+        schema=VeoFastInput,
+        legacy_path="/generate-veo-fast",
+        images=[ImageField("image", required=True)],
+        temp_folder="veo3-fast-temp",
+        result_cache="seeded",
+    ),
+    ModelSpec(
+        slug="nanobanana-2",
+        model="google/nano-banana-2",
+        schema=NanoBanana2Input,
+        legacy_path="/generate-nanobanana-2",
+        images=[ImageField("image_input", multiple=True, max_files=14)],
+        temp_folder="nanobanana-temp",
+        cost=lambda params: NANOBANANA_2_COSTS[params.resolution],
+    ),
+    ModelSpec(
+        slug="nano-banana",
+        model="google/nano-banana",
+        schema=NanoBananaInput,
+        legacy_path="/generate-image",
+        images=[ImageField("input_images", "image_input", multiple=True, max_files=14)],
+        temp_folder="nanobanana-temp",
+        cost=1,
+        webhook=True,
+    ),
+    ModelSpec(
+        slug="nano-pro",
+        model="google/nano-banana-pro",
+        schema=NanoBananaProInput,
+        legacy_path="/generate-nano-pro",
+        images=[ImageField("input_images", "image_input", multiple=True, max_files=12)],
+        temp_folder="seedream-temp",
+    ),
+    ModelSpec(
+        slug="seedream-4.5",
+        model="bytedance/seedream-4.5",
+        schema=SeedreamInput,
+        legacy_path="/generate-seedream-4.5",
+        images=[ImageField("input_images", "image_input", multiple=True, max_files=12)],
+        temp_folder="seedream-temp",
+        fixed_input={"max_images": 1},
+    ),
+    ModelSpec(
+        slug="flux-kontext",
+        model="black-forest-labs/flux-kontext-max",
+        schema=FluxKontextInput,
+        legacy_path="/generate-flux-kontext",
+        images=[ImageField("input_image", required=True)],
+        temp_folder="flux-kontext-temp",
+        result_cache="seeded",
+    ),
+    ModelSpec(
+        slug="flux-2-pro",
+        model="black-forest-labs/flux-2-pro",
+        schema=Flux2ProInput,
+        legacy_path="/generate-flux-2-pro",
+        images=[ImageField("input_images", multiple=True, max_files=8)],
+        temp_folder="flux-2-pro-temp",
+        result_cache="seeded",
+    ),
+    ModelSpec(
+        slug="flux",
+        model="black-forest-labs/flux-1.1-pro",
+        schema=FluxInput,
+        legacy_path="/generate-flux",
+        result_cache="seeded",
+    ),
+]
+
+MODEL_REGISTRY = {spec.slug: spec for spec in MODEL_SPECS}
+# modelo do Replicate -> slug (Creation.model guarda o modelo)
+MODEL_SLUGS = {spec.model: spec.slug for spec in MODEL_SPECS}
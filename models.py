@@ -1,21 +1,85 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Index, func
 from datetime import datetime
 from database import Base
 
+# =========================================
+# MODELS
+# =========================================
+# Definição única do schema. Alterações passam por uma migração em
+# migrations/versions (alembic revision --autogenerate -m "...").
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
     memberstack_id = Column(String, unique=True)
     email = Column(String)
-    credits = Column(Integer, default=100)
+    credits = Column(Integer, default=50)
+    # peso no scheduler fair-share (plan.metadata.weight do Memberstack)
+    plan_weight = Column(Integer, nullable=False, default=1, server_default="1")
 
 class Creation(Base):
     __tablename__ = "creations"
 
     id = Column(Integer, primary_key=True)
     memberstack_id = Column(String)
+    replicate_id = Column(String)
     prompt = Column(Text)
-    image_url = Column(Text)
     model = Column(String)
+    status = Column(String)
+    result_url = Column(Text)
+    output_urls = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+    temp_input_public_ids = Column(JSON, nullable=True)
+    batch_id = Column(String, nullable=True, index=True)
+    # hash (modelo, input canônico) para o cache de resultados
+    result_key = Column(String, nullable=True, index=True)
+    # hit do cache: prediction (de outro request) que gerou este resultado;
+    # replicate_id fica vazio (é da Creation original)
+    cached_from = Column(String, nullable=True, index=True)
+    # worker copiando o output para a gallery (ver transfers.py)
+    transfer_claimed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # /status, /replicate-webhook e pool de transferência
+        Index("ix_creations_replicate_id", "replicate_id", unique=True),
+        # /my-creations: WHERE memberstack_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_creations_memberstack_created_id", "memberstack_id", created_at.desc(), id.desc()),
+    )
+
+class CreditLedgerEntry(Base):
+    __tablename__ = "credit_ledger"
+
+    # append-only: uma linha por movimento aplicado em users.credits
+    id = Column(Integer, primary_key=True)
+    memberstack_id = Column(String, index=True)
+    delta = Column(Integer)
+    balance = Column(Integer)
+    reason = Column(String)
+    created_at = Column(DateTime, server_default=func.now())
+
+class ResultCacheEntry(Base):
+    __tablename__ = "result_cache"
+
+    key = Column(String, primary_key=True)
+    model = Column(String)
+    prediction_id = Column(String)
+    output_url = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class UploadCacheEntry(Base):
+    __tablename__ = "upload_cache"
+
+    sha256 = Column(String, primary_key=True)
+    secure_url = Column(Text)
+    public_id = Column(String, index=True)
+    expires_at = Column(DateTime)
+
+class PredictionContext(Base):
+    __tablename__ = "prediction_contexts"
+
+    prediction_id = Column(String, primary_key=True)
+    data = Column(JSON)
+    expires_at = Column(DateTime, index=True)
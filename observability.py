@@ -0,0 +1,392 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# =========================================
+# LOGS ESTRUTURADOS + MÉTRICAS (PROMETHEUS)
+# =========================================
+# - logging com nível (LOG_LEVEL) e formato json ou texto (LOG_FORMAT); toda
+#   linha logada dentro de uma request leva o request_id (X-Request-ID do
+#   cliente ou gerado aqui, devolvido no header da resposta)
+# - histogramas por etapa da geração (stage_seconds{stage, model}), duração
+#   das requests HTTP, requests em voo e atraso do event loop
+# - GET /metrics expõe tudo no formato texto do Prometheus, junto com os
+#   contadores dos componentes (governor, breakers, caches, ...) coletados
+#   na hora do scrape
+# - watchdog do event loop: uma thread cutuca o loop e, se ele não responder
+#   em LOOP_BLOCK_THRESHOLD, loga a stack do que está rodando nele (a
+#   chamada síncrona dentro do async def)
+#
+# Sem dependência externa: o registry abaixo implementa só o necessário do
+# formato de exposição.
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# 0 desliga o watchdog
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.2"))
+LOOP_BLOCK_STACK_DEPTH = int(os.getenv("LOOP_BLOCK_STACK_DEPTH", "25"))
+
+request_id_var = ContextVar("request_id", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+# -----------------------------
+# Logging
+# -----------------------------
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.addFilter(_RequestIdFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+# -----------------------------
+# Métricas
+# -----------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[tuple(labels.get(n, "") for n in self.labelnames)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [contagem por bucket..., soma, total]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, key + (_number(bound),)), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), counts[-2]
+            yield f"{self.name}_count", _labels(self.labelnames, key), counts[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """collect() -> lista de métricas (Counter/Gauge) montadas na hora do scrape."""
+        self._collectors.append(collect)
+
+    def render(self):
+        # coletores primeiro: alguns atualizam gauges registrados
+        collected = []
+        for collect in self._collectors:
+            try:
+                collected.extend(collect())
+            except Exception:
+                logger.exception("Metrics collector error")
+        metrics = self._metrics + collected
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+
+STAGE_SECONDS = metrics.histogram(
+    "stage_seconds", "Duração de cada etapa da geração", ["stage", "model"]
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Duração das requests HTTP", ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "Requests HTTP em andamento")
+LOOP_LAG_SECONDS = metrics.histogram(
+    "event_loop_lag_seconds", "Atraso do event loop em relação ao agendado",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+LOOP_LAG_MAX = metrics.gauge("event_loop_lag_max_seconds", "Maior atraso do event loop desde o último scrape")
+LOOP_BLOCKED_SECONDS = metrics.histogram(
+    "event_loop_blocked_seconds", "Bloqueios do event loop acima do LOOP_BLOCK_THRESHOLD",
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+
+@contextmanager
+def stage(name, model):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name, model=model)
+
+
+# -----------------------------
+# Middleware (request_id + métricas HTTP)
+# -----------------------------
+class RequestContextMiddleware:
+    # ASGI puro: não bufferiza respostas em streaming (SSE, /download)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # template da rota (não a URL): cardinalidade limitada
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"], route=route, status=status
+            )
+            request_id_var.reset(token)
+
+
+# -----------------------------
+# Atraso do event loop + watchdog de bloqueio
+# -----------------------------
+class LoopLagMonitor:
+    def __init__(self, interval=LOOP_LAG_INTERVAL, block_threshold=LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._task = None
+        self.max_lag = 0.0
+
+        self._loop = None
+        self._loop_thread = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+        self.blocks = 0
+        self.blocked_max = 0.0
+        self.recent_blocks = deque(maxlen=20)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if self.block_threshold > 0 and self._watchdog is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self):
+        if self._watchdog:
+            self._stop.set()
+            self._watchdog = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        # thread própria: agenda um callback no loop e espera ele rodar. Se
+        # não rodou em block_threshold, o loop está preso em algo síncrono e
+        # a stack da thread do loop mostra onde.
+        pause = max(0.01, self.block_threshold / 2)
+        while not self._stop.wait(pause):
+            answered = threading.Event()
+            posted = time.monotonic()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return  # loop fechado
+
+            if answered.wait(self.block_threshold):
+                continue
+
+            stack = self._loop_stack()
+            logger.warning(
+                "🐢 event loop bloqueado há %.0f ms em:\n%s",
+                (time.monotonic() - posted) * 1000, "".join(stack).rstrip(),
+                extra={"fields": {"blocked_ms": round((time.monotonic() - posted) * 1000, 1)}}
+            )
+
+            # uma stack por bloqueio; a duração total sai quando o loop voltar
+            while not answered.wait(0.1):
+                if self._stop.is_set():
+                    return
+            self._record_block(time.monotonic() - posted, stack)
+
+    def _loop_stack(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return []
+        return traceback.format_stack(frame, limit=LOOP_BLOCK_STACK_DEPTH)
+
+    def _record_block(self, blocked, stack):
+        LOOP_BLOCKED_SECONDS.observe(blocked)
+        self.blocks += 1
+        self.blocked_max = max(self.blocked_max, blocked)
+        self.recent_blocks.append({
+            "at": round(time.time(), 3),
+            "blocked_ms": round(blocked * 1000, 1),
+            "where": stack[-1].strip().splitlines()[0] if stack else None,
+        })
+        logger.warning(
+            "🐢 event loop ficou bloqueado por %.0f ms", blocked * 1000,
+            extra={"fields": {"blocked_ms": round(blocked * 1000, 1)}}
+        )
+
+    def collect(self):
+        # máximo desde o último scrape
+        LOOP_LAG_MAX.set(self.max_lag)
+        self.max_lag = 0.0
+        return []
+
+    def stats(self):
+        return {
+            "interval_ms": round(self.interval * 1000, 1),
+            "block_threshold_ms": round(self.block_threshold * 1000, 1),
+            "watchdog": self._watchdog is not None,
+            "blocks": self.blocks,
+            "blocked_max_ms": round(self.blocked_max * 1000, 1),
+            "recent_blocks": list(self.recent_blocks),
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
+metrics.register_collector(loop_lag_monitor.collect)
@@ -0,0 +1,275 @@
+import os
+import logging
+import re
+import uuid
+import asyncio
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from fastapi.responses import FileResponse
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# CACHE LOCAL DE OUTPUTS (DISCO)
+# =========================================
+# Outputs baixados pelo /download ficam em OUTPUT_CACHE_DIR (dentro de temp/)
+# como {prediction_id}-{sha256}{ext}. Replays do mesmo output são servidos
+# do disco com FileResponse (Range incluso), sem ir ao upstream e sem
+# carregar o arquivo inteiro em memória.
+#
+# - escrita atômica: o download é gravado em .part enquanto é repassado ao
+#   cliente e só vira arquivo final (os.replace) se chegou inteiro
+# - LRU por bytes totais (OUTPUT_CACHE_MAX_BYTES); arquivos sendo servidos
+#   ficam pinados e não são removidos
+# - o índice é em memória por worker, reconstruído do diretório no startup
+#   (arquivo removido por outro worker vira miss)
+
+OUTPUT_CACHE_ENABLED = os.getenv("OUTPUT_CACHE_ENABLED", "true").lower() in ["true", "1", "yes"]
+OUTPUT_CACHE_DIR = os.getenv("OUTPUT_CACHE_DIR", os.path.join("temp", "output-cache"))
+OUTPUT_CACHE_MAX_BYTES = int(os.getenv("OUTPUT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# arquivos maiores que isso só passam pelo proxy
+OUTPUT_CACHE_MAX_FILE = int(os.getenv("OUTPUT_CACHE_MAX_FILE", str(512 * 1024 ** 2)))
+
+_FILENAME = re.compile(r"^(?P<prediction_id>[\w.]+)-(?P<sha256>[0-9a-f]{64})(?P<ext>\.\w+)?$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class OutputCache:
+    def __init__(self, directory=OUTPUT_CACHE_DIR, max_bytes=OUTPUT_CACHE_MAX_BYTES,
+                 max_file=OUTPUT_CACHE_MAX_FILE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+
+        # prediction_id -> {"path", "size", "sha256", "media_type"}
+        self._entries = OrderedDict()
+        self._pins = {}
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.writes = 0
+        self.writes_aborted = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+
+    # -----------------------------
+    # Startup
+    # -----------------------------
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        found = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".part"):
+                # download interrompido por restart
+                os.remove(item.path)
+                continue
+            match = _FILENAME.match(item.name)
+            if match and item.is_file():
+                stat = item.stat()
+                found.append((stat.st_mtime, match, item.path, stat.st_size))
+
+        for _, match, path, size in sorted(found, key=lambda f: f[0]):
+            self._add(match["prediction_id"], path, size, match["sha256"])
+
+        self._evict()
+        logger.info("🗄️ Output cache: %d arquivos, %.0f MB", len(self._entries), self.total_bytes / 2**20)
+
+    # -----------------------------
+    # Leitura
+    # -----------------------------
+    def lookup(self, prediction_id: str, range_header=None):
+        """
+        Entrada do cache (já pinada) ou None. Quem recebe uma entrada precisa
+        chamar release(prediction_id) quando terminar de servir.
+        """
+        entry = self._entries.get(prediction_id)
+        if entry and not os.path.exists(entry["path"]):
+            self._drop(prediction_id)
+            entry = None
+
+        if not entry:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(prediction_id)
+        self._pins[prediction_id] = self._pins.get(prediction_id, 0) + 1
+        self.hits += 1
+        self.bytes_served += _range_length(range_header, entry["size"])
+        return entry
+
+    def response(self, prediction_id: str, entry):
+        """FileResponse da entrada pinada; solta o pin ao terminar (ou cair)."""
+        return _CachedFileResponse(self, prediction_id, entry)
+
+    def release(self, prediction_id: str):
+        remaining = self._pins.get(prediction_id, 0) - 1
+        if remaining > 0:
+            self._pins[prediction_id] = remaining
+        else:
+            self._pins.pop(prediction_id, None)
+
+    def invalidate(self, prediction_id: str):
+        if prediction_id in self._entries and prediction_id not in self._pins:
+            self._remove(prediction_id)
+
+    # -----------------------------
+    # Escrita (tee do proxy)
+    # -----------------------------
+    async def tee(self, prediction_id, chunks, filename, expected_size=None):
+        """
+        Repassa `chunks` e grava uma cópia. O arquivo só entra no cache se o
+        stream terminar inteiro (e com o tamanho esperado, se conhecido).
+        """
+        if expected_size and expected_size > self.max_file:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        ext = os.path.splitext(filename)[1][:8]
+        part = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        completed = False
+
+        f = await asyncio.to_thread(open, part, "wb")
+        try:
+            async for chunk in chunks:
+                yield chunk
+                if f is None:
+                    continue
+                size += len(chunk)
+                if size > self.max_file:
+                    # sem Content-Length e grande demais: desiste da cópia
+                    await asyncio.to_thread(_discard, f, part)
+                    f = None
+                    continue
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            completed = f is not None and (expected_size is None or size == expected_size)
+        finally:
+            # cliente desconectou: a task está sendo cancelada, então a
+            # limpeza é síncrona ou protegida com shield
+            if f is not None and not completed:
+                _discard(f, part)
+                self.writes_aborted += 1
+            if completed:
+                await asyncio.shield(self._store(prediction_id, f, part, ext, size, digest.hexdigest()))
+            await asyncio.shield(chunks.aclose())
+
+    async def _store(self, prediction_id, f, part, ext, size, sha256):
+        final = os.path.join(self.directory, f"{prediction_id}-{sha256}{ext}")
+        await asyncio.to_thread(_commit, f, part, final)
+        self._add(prediction_id, final, size, sha256)
+        self.writes += 1
+        self._evict()
+
+    # -----------------------------
+    # Índice / LRU
+    # -----------------------------
+    def _add(self, prediction_id, path, size, sha256):
+        if prediction_id in self._entries:
+            old = self._entries[prediction_id]
+            if old["path"] != path:
+                self._remove(prediction_id)
+            else:
+                self.total_bytes -= old["size"]
+
+        self._entries[prediction_id] = {
+            "path": path,
+            "size": size,
+            "sha256": sha256,
+            "media_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        }
+        self._entries.move_to_end(prediction_id)
+        self.total_bytes += size
+
+    def _evict(self):
+        for prediction_id in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if prediction_id in self._pins:
+                continue
+            self.evicted += 1
+            self.evicted_bytes += self._entries[prediction_id]["size"]
+            self._remove(prediction_id)
+
+    def _remove(self, prediction_id):
+        entry = self._drop(prediction_id)
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+
+    def _drop(self, prediction_id):
+        entry = self._entries.pop(prediction_id)
+        self.total_bytes -= entry["size"]
+        return entry
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "bytes_served": self.bytes_served,
+            "writes": self.writes,
+            "writes_aborted": self.writes_aborted,
+            "evicted": self.evicted,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+class _CachedFileResponse(FileResponse):
+    def __init__(self, cache, prediction_id, entry):
+        super().__init__(
+            entry["path"],
+            media_type=entry["media_type"],
+            filename=prediction_id + os.path.splitext(entry["path"])[1],
+            content_disposition_type="inline",
+            headers={"ETag": f'"{entry["sha256"]}"'},
+        )
+        self._cache = cache
+        self._prediction_id = prediction_id
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._cache.release(self._prediction_id)
+
+
+def _commit(f, part, final):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(part, final)
+
+
+def _discard(f, part):
+    f.close()
+    try:
+        os.remove(part)
+    except FileNotFoundError:
+        pass
+
+
+def _range_length(range_header, size):
+    # bytes servidos num hit (aproximado para multi-range)
+    match = _RANGE.match((range_header or "").strip())
+    if not match:
+        return size
+    start, end = match.groups()
+    if not start:
+        return min(int(end or 0), size)
+    end = min(int(end), size - 1) if end else size - 1
+    return max(end - int(start) + 1, 0)
+
+
+output_cache = OutputCache()
@@ -0,0 +1,151 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import delete
+
+# =========================================
+# REGISTRO prediction_id -> CONTEXTO
+# =========================================
+# Substitui os dicts *_TEMP_IMAGES / PREDICTION_META. Cada prediction tem um
+# contexto único, por exemplo:
+#   {"model": "google/nano-banana-2", "member_id": "...", "prompt": "...",
+#    "temp_public_ids": ["nanobanana-temp/abc"]}
+#
+# Backends:
+# - "memory": dev / um worker só (tamanho máximo + TTL)
+# - "db":     tabela prediction_contexts, compartilhada entre workers
+
+PREDICTION_CONTEXT_BACKEND = os.getenv("PREDICTION_CONTEXT_BACKEND", "memory")
+PREDICTION_CONTEXT_TTL = int(os.getenv("PREDICTION_CONTEXT_TTL", str(24 * 3600)))
+PREDICTION_CONTEXT_MAX_ENTRIES = int(os.getenv("PREDICTION_CONTEXT_MAX_ENTRIES", "10000"))
+
+# O backend DB limpa linhas expiradas a cada N escritas
+DB_PURGE_EVERY = 100
+
+
+class MemoryBackend:
+    is_async = False
+
+    def __init__(self, max_entries=PREDICTION_CONTEXT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # prediction_id -> (expires_at, data); ordem = ordem de inserção
+        self._entries = OrderedDict()
+
+    def put(self, prediction_id, data, expires_at):
+        self._entries.pop(prediction_id, None)
+        self._entries[prediction_id] = (expires_at, data)
+        self.purge(time.time())
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, prediction_id):
+        item = self._entries.get(prediction_id)
+        if not item:
+            return None
+
+        expires_at, data = item
+        if expires_at <= time.time():
+            del self._entries[prediction_id]
+            return None
+
+        return data
+
+    def pop(self, prediction_id):
+        data = self.get(prediction_id)
+        self._entries.pop(prediction_id, None)
+        return data
+
+    def purge(self, now):
+        # TTL é o mesmo para todos: os mais antigos estão no começo
+        while self._entries:
+            prediction_id, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[prediction_id]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqlBackend:
+    is_async = True
+
+    def __init__(self, session_factory, model):
+        self.session_factory = session_factory
+        self.model = model
+        self._writes = 0
+
+    async def put(self, prediction_id, data, expires_at):
+        async with self.session_factory() as db:
+            await db.merge(self.model(
+                prediction_id=prediction_id,
+                data=data,
+                expires_at=datetime.fromtimestamp(expires_at),
+            ))
+            await db.commit()
+
+        self._writes += 1
+        if self._writes % DB_PURGE_EVERY == 0:
+            await self.purge(time.time())
+
+    async def get(self, prediction_id):
+        async with self.session_factory() as db:
+            row = await db.get(self.model, prediction_id)
+        if not row or row.expires_at.timestamp() <= time.time():
+            return None
+        return row.data
+
+    async def pop(self, prediction_id):
+        # DELETE ... RETURNING: com dois workers recebendo o mesmo webhook,
+        # só um recebe o contexto (e solta os temporários)
+        async with self.session_factory() as db:
+            row = (await db.execute(
+                delete(self.model)
+                .where(self.model.prediction_id == prediction_id)
+                .returning(self.model.data, self.model.expires_at)
+            )).first()
+            await db.commit()
+
+        if not row or row.expires_at.timestamp() <= time.time():
+            return None
+        return row.data
+
+    async def purge(self, now):
+        async with self.session_factory() as db:
+            await db.execute(
+                delete(self.model)
+                .where(self.model.expires_at <= datetime.fromtimestamp(now))
+            )
+            await db.commit()
+
+
+class PredictionContextRegistry:
+    def __init__(self, backend=None, ttl=PREDICTION_CONTEXT_TTL):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+
+    def configure(self, backend):
+        self.backend = backend
+
+    async def _call(self, method, *args):
+        fn = getattr(self.backend, method)
+        if self.backend.is_async:
+            return await fn(*args)
+        return fn(*args)
+
+    async def put(self, prediction_id: str, **data):
+        await self._call("put", prediction_id, data, time.time() + self.ttl)
+
+    async def get(self, prediction_id: str):
+        return await self._call("get", prediction_id)
+
+    async def pop(self, prediction_id: str):
+        return await self._call("pop", prediction_id)
+
+    async def purge_expired(self):
+        await self._call("purge", time.time())
+
+
+prediction_contexts = PredictionContextRegistry()
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# PROFILER POR AMOSTRAGEM (SOB DEMANDA)
+# =========================================
+# GET /admin/profile roda por alguns segundos uma thread que, a cada
+# `interval`, lê a stack de todas as threads do processo
+# (sys._current_frames) e conta stacks iguais. A saída é o formato
+# "folded" (uma linha por stack: "thread;mod:func;mod:func N"), que o
+# flamegraph.pl, o speedscope e o inferno abrem direto.
+#
+# mode=cpu descarta amostras de threads paradas esperando I/O ou trabalho
+# (loop no select, pool de threads sem tarefa); mode=wall mantém tudo.
+#
+# Sem dependência nativa: custo de uma leitura de frames por amostra, só
+# enquanto o profile roda. Um profile por vez, por worker.
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_DEFAULT_INTERVAL = float(os.getenv("PROFILE_DEFAULT_INTERVAL", "0.01"))
+PROFILE_MAX_DEPTH = 128
+
+# (módulo, função) do frame mais interno de uma thread ociosa
+IDLE_FRAMES = {
+    ("selectors", "select"),
+    ("threading", "wait"),
+    ("threading", "_wait_for_tstate_lock"),
+    ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"),
+    # thread do aiosqlite esperando a próxima query (SimpleQueue.get em C)
+    ("aiosqlite.core", "run"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _stack(frame):
+    labels = []
+    while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+        labels.append(_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _idle(frame):
+    return (frame.f_globals.get("__name__"), frame.f_code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    def __init__(self, max_seconds=PROFILE_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._running = False
+
+        self.runs = 0
+        self.last_samples = 0
+
+    async def profile(self, seconds, interval=PROFILE_DEFAULT_INTERVAL, mode="cpu"):
+        """Amostra o processo por `seconds` e devolve as stacks no formato folded."""
+        if self._running:
+            raise ProfilerBusy()
+        self._running = True
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        stop = threading.Event()
+        seconds = min(seconds, self.max_seconds)
+
+        def deliver(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def target():
+            # thread própria e não o to_thread: o pool padrão pode estar
+            # ocupado justamente com as chamadas que queremos ver
+            result, error = None, None
+            try:
+                result = self._sample(seconds, interval, mode == "cpu", stop)
+            except Exception as e:
+                error = e
+            finally:
+                self._running = False
+            loop.call_soon_threadsafe(deliver, result, error)
+
+        threading.Thread(target=target, name="sampling-profiler", daemon=True).start()
+        self.runs += 1
+        logger.info("🔬 Profile de %.0fs iniciado (intervalo %.0f ms, %s)", seconds, interval * 1000, mode)
+
+        try:
+            samples, stacks = await future
+        except asyncio.CancelledError:
+            # cliente desistiu: encerra a amostragem
+            stop.set()
+            raise
+
+        self.last_samples = samples
+        return samples, "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def _sample(self, seconds, interval, cpu_only, stop):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        stacks = Counter()
+        samples = 0
+
+        while not stop.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (cpu_only and _idle(frame)):
+                    continue
+                stacks[";".join([names.get(ident, str(ident))] + _stack(frame))] += 1
+            frame = None
+            samples += 1
+            stop.wait(interval)
+
+        return samples, stacks
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "runs": self.runs,
+            "last_samples": self.last_samples,
+            "max_seconds": self.max_seconds,
+        }
+
+
+sampling_profiler = SamplingProfiler()
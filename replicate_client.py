@@ -0,0 +1,120 @@
+import os
+import httpx
+import replicate
+from replicate.exceptions import ReplicateError
+from governor import replicate_governor, UpstreamBusy
+from resilience import replicate_upstream, request_not_sent, REPLICATE_TIMEOUT, REPLICATE_CONNECT_TIMEOUT
+
+# =========================================
+# REPLICATE - CLIENT COMPARTILHADO
+# =========================================
+# Um único replicate.Client por processo, com um pool httpx.AsyncClient
+# reaproveitado por todos os endpoints. Aberto/fechado no lifespan do app.
+#
+# Toda chamada passa pelo replicate_governor (ver governor.py). Um 429 em
+# qualquer chamada (create, get, cancel) vira UpstreamBusy e pausa o governor
+# uma única vez, com o Retry-After guardado pelo transport.
+# Timeouts, retries, circuit breaker e hedging: resilience.replicate_upstream
+# (o retry embutido no SDK fica desligado, ver open_client).
+
+REPLICATE_MAX_CONNECTIONS = int(os.getenv("REPLICATE_MAX_CONNECTIONS", "100"))
+REPLICATE_MAX_KEEPALIVE = int(os.getenv("REPLICATE_MAX_KEEPALIVE", "20"))
+# segunda chamada de reserva no GET de predictions lentas (/status, /download)
+REPLICATE_HEDGE_READS = os.getenv("REPLICATE_HEDGE_READS", "true").lower() in ["true", "1", "yes"]
+
+_client = None
+_transport = None
+
+
+class GovernedTransport(httpx.AsyncHTTPTransport):
+    # guarda o Retry-After do último 429; o throttle do governor é feito uma
+    # vez por chamada lógica, em _call
+    retry_after = None
+
+    async def handle_async_request(self, request):
+        response = await super().handle_async_request(request)
+        if response.status_code == 429:
+            self.retry_after = response.headers.get("Retry-After")
+        return response
+
+
+def open_client():
+    global _client, _transport
+
+    if _client is not None:
+        return _client
+
+    _transport = GovernedTransport(
+        limits=httpx.Limits(
+            max_connections=REPLICATE_MAX_CONNECTIONS,
+            max_keepalive_connections=REPLICATE_MAX_KEEPALIVE,
+        )
+    )
+    # O SDK embrulha `transport=` num RetryTransport próprio (GET retentado
+    # até 10x em 429/503/504, ~51s), que somado ao replicate_upstream
+    # multiplicava as chamadas. Montado em "all://", o nosso transport tem
+    # precedência sobre o dele: o único retry é o do resilience.py.
+    _client = replicate.Client(
+        api_token=os.getenv("REPLICATE_API_TOKEN"),
+        mounts={"all://": _transport},
+        timeout=httpx.Timeout(REPLICATE_TIMEOUT, connect=REPLICATE_CONNECT_TIMEOUT),
+    )
+    return _client
+
+
+async def close_client():
+    global _client, _transport
+
+    if _transport is not None:
+        await _transport.aclose()
+
+    _client = None
+    _transport = None
+
+
+def get_client():
+    # Fallback para uso fora do lifespan (scripts, shell)
+    return _client or open_client()
+
+
+async def _call(attempt, **kwargs):
+    try:
+        return await replicate_upstream.call(attempt, **kwargs)
+    except ReplicateError as e:
+        if e.status == 429:
+            # rate limit: pausa o bucket uma vez (não por tentativa/hedge) e
+            # o cliente tenta de novo depois (503 + Retry-After)
+            replicate_governor.throttle(_transport.retry_after if _transport else None)
+            raise UpstreamBusy("replicate", replicate_governor.retry_hint()) from e
+        raise
+
+
+async def create_prediction(model: str, model_input: dict, **params):
+    async def attempt():
+        async with replicate_governor.slot(token=True):
+            return await get_client().predictions.async_create(
+                model=model,
+                input=model_input,
+                **params
+            )
+
+    # create não é idempotente: só retenta se o request nem saiu
+    prediction = await _call(attempt, retry_if=request_not_sent)
+    replicate_governor.succeeded()
+    return prediction
+
+
+async def get_prediction(prediction_id: str):
+    async def attempt():
+        async with replicate_governor.slot():
+            return await get_client().predictions.async_get(prediction_id)
+
+    return await _call(attempt, idempotent=True, hedge=REPLICATE_HEDGE_READS)
+
+
+async def cancel_prediction(prediction_id: str):
+    async def attempt():
+        async with replicate_governor.slot():
+            return await get_client().predictions.async_cancel(prediction_id)
+
+    return await _call(attempt, idempotent=True)
@@ -0,0 +1,256 @@
+import os
+import logging
+import math
+import time
+import random
+import asyncio
+from collections import deque
+import httpx
+import cloudinary.exceptions
+from replicate.exceptions import ReplicateError
+from governor import UpstreamBusy, cloudinary_governor
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# RESILIÊNCIA DAS DEPENDÊNCIAS (Replicate, Cloudinary, outputs)
+# =========================================
+# Cada dependência é um Upstream com:
+# - timeout por request (configurado no próprio cliente: httpx.Timeout do
+#   Replicate, timeout= do SDK do Cloudinary, httpx.Timeout do proxy de download)
+# - retries com backoff exponencial + jitter, só para operações idempotentes
+#   (ou quando o erro garante que o request nem saiu, ex. ConnectError)
+# - circuit breaker: UPSTREAM_CB_FAILURES falhas seguidas abrem o circuito
+#   por UPSTREAM_CB_RESET segundos; nesse tempo tudo falha na hora com
+#   CircuitOpen (503 + Retry-After). Depois, uma chamada de teste (half-open)
+#   decide se fecha ou reabre.
+# - hedging opcional para leituras idempotentes: se a resposta não chegou no
+#   p95 recente, dispara uma segunda chamada e fica com a primeira que voltar
+#   (limitado a UPSTREAM_HEDGE_RATIO das chamadas).
+#
+# Só erros "de infraestrutura" (timeout, conexão, 5xx) contam para o breaker;
+# 4xx e UpstreamBusy (admissão/429) não.
+
+UPSTREAM_RETRY_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3"))
+UPSTREAM_RETRY_BASE = float(os.getenv("UPSTREAM_RETRY_BASE", "0.2"))
+UPSTREAM_RETRY_MAX = float(os.getenv("UPSTREAM_RETRY_MAX", "2"))
+UPSTREAM_CB_FAILURES = int(os.getenv("UPSTREAM_CB_FAILURES", "5"))
+UPSTREAM_CB_RESET = float(os.getenv("UPSTREAM_CB_RESET", "30"))
+UPSTREAM_HEDGE_RATIO = float(os.getenv("UPSTREAM_HEDGE_RATIO", "0.1"))
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.05"))
+
+REPLICATE_TIMEOUT = float(os.getenv("REPLICATE_TIMEOUT", "30"))
+REPLICATE_CONNECT_TIMEOUT = float(os.getenv("REPLICATE_CONNECT_TIMEOUT", "5"))
+CLOUDINARY_TIMEOUT = float(os.getenv("CLOUDINARY_TIMEOUT", "60"))
+OUTPUT_FETCH_TIMEOUT = float(os.getenv("OUTPUT_FETCH_TIMEOUT", "60"))
+
+
+class CircuitOpen(UpstreamBusy):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name, failures=UPSTREAM_CB_FAILURES, reset_timeout=UPSTREAM_CB_RESET):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.opened = 0
+        self.short_circuited = 0
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+
+        if self.state == "half_open" and not self._probing:
+            # uma chamada de teste por vez
+            self._probing = True
+            return
+
+        self.short_circuited += 1
+        raise CircuitOpen(self.name, max(1, math.ceil(remaining)))
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probing = False
+        if self.state != "closed":
+            logger.info("✅ %s: circuito fechado", self.name)
+        self.state = "closed"
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        probe_failed = self.state == "half_open"
+        self._probing = False
+
+        if probe_failed or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self.opened += 1
+            logger.error("🔌 %s: circuito aberto por %.0fs (%d falhas seguidas)",
+                         self.name, self.reset_timeout, self.consecutive_failures)
+
+    def release_probe(self):
+        # a chamada de teste terminou sem veredito (4xx, cancelada, ...)
+        self._probing = False
+
+
+class Upstream:
+    def __init__(self, name, is_failure, attempts=UPSTREAM_RETRY_ATTEMPTS,
+                 retry_base=UPSTREAM_RETRY_BASE, retry_max=UPSTREAM_RETRY_MAX,
+                 hedge_ratio=UPSTREAM_HEDGE_RATIO):
+        self.name = name
+        self.is_failure = is_failure
+        self.attempts = attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.hedge_ratio = hedge_ratio
+        self.breaker = CircuitBreaker(name)
+
+        # latências recentes (sucessos) para o atraso do hedge
+        self._latencies = deque(maxlen=200)
+
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def call(self, attempt, idempotent=False, retry_if=None, hedge=False):
+        """
+        attempt: função async sem argumentos (uma tentativa).
+        idempotent=True: qualquer falha de infraestrutura é retentada.
+        retry_if: para operações não idempotentes, erros seguros de retentar.
+        hedge=True: leitura idempotente com request de reserva.
+        """
+        self.calls += 1
+
+        for n in range(1, self.attempts + 1):
+            try:
+                if hedge:
+                    return await self._hedged(attempt)
+                return await self._once(attempt)
+            except CircuitOpen:
+                raise
+            except Exception as e:
+                retryable = self.is_failure(e) and (idempotent or (retry_if and retry_if(e)))
+                if not retryable or n == self.attempts:
+                    raise
+                self.retries += 1
+                delay = min(self.retry_max, self.retry_base * 2 ** (n - 1))
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def _once(self, attempt):
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = await attempt()
+        except BaseException as e:
+            if isinstance(e, Exception) and self.is_failure(e):
+                self.failures += 1
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_probe()
+            raise
+
+        self.breaker.record_success()
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    def hedge_delay(self):
+        if len(self._latencies) < 20:
+            return None
+        recent = sorted(self._latencies)
+        return max(UPSTREAM_HEDGE_MIN_DELAY, recent[int(len(recent) * 0.95) - 1])
+
+    async def _hedged(self, attempt):
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._once(attempt))
+
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or self.breaker.state != "closed" or self.hedges >= self.calls * self.hedge_ratio:
+            return await primary
+
+        self.hedges += 1
+        backup = asyncio.ensure_future(self._once(attempt))
+
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                # as duas falharam: propaga o erro da última
+                if not pending:
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        delay = self.hedge_delay()
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "circuit_opened": self.breaker.opened,
+            "short_circuited": self.breaker.short_circuited,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay else None,
+        }
+
+
+# -----------------------------
+# Classificação de erros
+# -----------------------------
+def replicate_failure(e):
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, ReplicateError) and (e.status or 0) >= 500
+
+
+def request_not_sent(e):
+    # o request nem chegou ao Replicate: seguro retentar até um create
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def cloudinary_failure(e):
+    # timeout/conexão viram Error "puro"; 5xx viram GeneralError
+    return type(e) is cloudinary.exceptions.Error or isinstance(e, cloudinary.exceptions.GeneralError)
+
+
+def output_failure(e):
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+async def cloudinary_call(fn, *args, idempotent=False, background=False, **kwargs):
+    """SDK do Cloudinary numa thread: governor + timeout + retries + breaker."""
+    kwargs.setdefault("timeout", CLOUDINARY_TIMEOUT)
+    return await cloudinary_upstream.call(
+        lambda: cloudinary_governor.call_in_thread(fn, *args, background=background, **kwargs),
+        idempotent=idempotent
+    )
+
+
+replicate_upstream = Upstream("replicate", replicate_failure)
+cloudinary_upstream = Upstream("cloudinary", cloudinary_failure)
+output_upstream = Upstream("replicate-output", output_failure)
@@ -0,0 +1,188 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+
+# =========================================
+# CACHE DE RESULTADOS (model, input) -> gallery URL
+# =========================================
+# Request repetido (mesmo modelo, mesmo input canônico, mesmas imagens por
+# sha256) de um modelo com opt-in (ver model_registry.result_cache) não roda
+# outra vez no Replicate:
+# - hit:       já existe resultado na gallery -> volta na hora
+# - in-flight: a mesma geração ainda está rodando -> volta o prediction_id dela
+# - miss:      a prediction vira Creation com result_key; quando o pool de
+#              transferência copia o output para a gallery, grava aqui
+#
+# Hit e in-flight também gravam uma Creation para quem pediu (follow), com
+# cached_from = prediction original: o resultado aparece na gallery do
+# membro e, se ainda estava rodando, acompanha o status final da original
+# (settle). Não há cobrança: só modelos sem custo têm cache (ModelSpec).
+#
+# Tabela result_cache ao lado de creations; expira por RESULT_CACHE_TTL e é
+# aparada para RESULT_CACHE_MAX_ENTRIES na varredura do cleanup.
+
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "100000"))
+# janela para reaproveitar uma geração igual ainda em andamento
+RESULT_CACHE_INFLIGHT_WINDOW = int(os.getenv("RESULT_CACHE_INFLIGHT_WINDOW", "900"))
+
+
+class ResultCache:
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.session_factory = None
+        self.model = None
+        self.creation_model = None
+
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def configure(self, session_factory, model, creation_model):
+        self.session_factory = session_factory
+        self.model = model
+        self.creation_model = creation_model
+
+    async def lookup(self, key: str):
+        """
+        {"prediction_id", "status": "succeeded", "output_url"} num hit,
+        {"prediction_id", "status": "processing"} se a mesma geração está
+        rodando, ou None.
+        """
+        Entry = self.model
+        Creation = self.creation_model
+        now = datetime.utcnow()
+
+        async with self.session_factory() as db:
+            entry = await db.scalar(
+                select(Entry).where(Entry.key == key, Entry.expires_at > now)
+            )
+            if entry:
+                self.hits += 1
+                return {
+                    "prediction_id": entry.prediction_id,
+                    "status": "succeeded",
+                    "output_url": entry.output_url,
+                }
+
+            running = await db.scalar(
+                select(Creation.replicate_id)
+                .where(
+                    Creation.result_key == key,
+                    Creation.status == "processing",
+                    Creation.replicate_id.is_not(None),
+                    Creation.created_at > now - timedelta(seconds=RESULT_CACHE_INFLIGHT_WINDOW)
+                )
+                .order_by(Creation.id.desc())
+                .limit(1)
+            )
+
+        if running:
+            self.joined += 1
+            return {"prediction_id": running, "status": "processing", "output_url": None}
+
+        self.misses += 1
+        return None
+
+    async def follow(self, cached, **fields):
+        """
+        Creation do solicitante para um resultado de lookup(). Retorna o id.
+        """
+        Creation = self.creation_model
+        prediction_id = cached["prediction_id"]
+        done = cached["status"] == "succeeded"
+
+        async with self.session_factory() as db:
+            creation = Creation(
+                status=cached["status"],
+                result_url=cached["output_url"],
+                completed_at=datetime.utcnow() if done else None,
+                cached_from=prediction_id,
+                **fields
+            )
+            db.add(creation)
+            await db.commit()
+            creation_id = creation.id
+
+            if not done:
+                # a original pode ter terminado (ou sido apagada) entre o
+                # lookup e o insert, com o settle rodando sem ver esta linha
+                original = (await db.execute(
+                    select(Creation.status, Creation.result_url)
+                    .where(Creation.replicate_id == prediction_id)
+                )).first()
+                if original is None:
+                    await self._settle(db, Creation.id == creation_id, "failed", None)
+                elif original.status != "processing":
+                    await self._settle(db, Creation.id == creation_id, original.status, original.result_url)
+
+        return creation_id
+
+    async def settle(self, prediction_id: str, status: str, output_url=None):
+        """A prediction original terminou: as Creations que a seguem também."""
+        Creation = self.creation_model
+        async with self.session_factory() as db:
+            await self._settle(db, Creation.cached_from == prediction_id, status, output_url)
+
+    async def _settle(self, db, condition, status, output_url):
+        Creation = self.creation_model
+        await db.execute(
+            update(Creation)
+            .where(condition, Creation.status == "processing")
+            .values(
+                status=status,
+                result_url=output_url if status == "succeeded" else None,
+                completed_at=datetime.utcnow()
+            )
+        )
+        await db.commit()
+
+    async def store(self, key: str, model: str, prediction_id: str, output_url: str):
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            await db.merge(self.model(
+                key=key,
+                model=model,
+                prediction_id=prediction_id,
+                output_url=output_url,
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl),
+            ))
+            await db.commit()
+        self.stored += 1
+
+    async def purge(self):
+        """Remove expirados e, acima de max_entries, os mais antigos."""
+        Entry = self.model
+        async with self.session_factory() as db:
+            result = await db.execute(delete(Entry).where(Entry.expires_at <= datetime.utcnow()))
+            removed = result.rowcount or 0
+
+            excess = (await db.scalar(select(func.count()).select_from(Entry))) - self.max_entries
+            if excess > 0:
+                oldest = select(Entry.key).order_by(Entry.created_at).limit(excess)
+                result = await db.execute(delete(Entry).where(Entry.key.in_(oldest)))
+                removed += result.rowcount or 0
+
+            await db.commit()
+
+        self.evicted += removed
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.joined + self.misses
+        return {
+            "hits": self.hits,
+            "joined": self.joined,
+            "misses": self.misses,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "hit_rate": round((self.hits + self.joined) / lookups, 3) if lookups else None,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+# =========================================
+# CACHE DO /status/{prediction_id}
+# =========================================
+# - status não-terminal: cache curto (STATUS_CACHE_TTL segundos)
+# - status terminal (succeeded/failed/canceled): fica até ser expulso (LRU)
+# - polls simultâneos do mesmo id viram uma consulta só (singleflight)
+
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "2"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "10000"))
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+
+class StatusCache:
+    def __init__(self, ttl=STATUS_CACHE_TTL, max_entries=STATUS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # prediction_id -> (expires_at | None, resposta)
+        self._entries = OrderedDict()
+        # prediction_id -> Task da consulta em andamento
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def set(self, prediction_id: str, value: dict):
+        terminal = value.get("status") in TERMINAL_STATUSES
+        expires_at = None if terminal else time.monotonic() + self.ttl
+
+        self._entries.pop(prediction_id, None)
+        self._entries[prediction_id] = (expires_at, value)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, prediction_id: str):
+        self._entries.pop(prediction_id, None)
+
+    async def get_or_load(self, prediction_id: str, loader):
+        entry = self._entries.get(prediction_id)
+        if entry:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(prediction_id)
+                self.hits += 1
+                return value
+
+        task = self._inflight.get(prediction_id)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[prediction_id] = task
+            task.add_done_callback(lambda t: self._loaded(prediction_id, t))
+
+        # shield: um poll cancelado não derruba a consulta dos outros
+        return await asyncio.shield(task)
+
+    def _loaded(self, prediction_id, task):
+        self._inflight.pop(prediction_id, None)
+
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        # não rebaixa um terminal gravado (write-through) durante a consulta
+        current = self._entries.get(prediction_id)
+        if current and current[0] is None:
+            return
+
+        self.set(prediction_id, task.result())
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+status_cache = StatusCache()
@@ -0,0 +1,150 @@
+import os
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from credits import CreditEngine
+from database import Base, async_database_url
+from models import CreditLedgerEntry, User
+
+# =========================================
+# CRÉDITOS: RESERVA ATÔMICA SOB CONCORRÊNCIA
+# =========================================
+# Roda em sqlite (arquivo temporário). Com TEST_DATABASE_URL apontando para
+# um Postgres descartável, roda lá também (as tabelas são recriadas).
+
+pytestmark = pytest.mark.anyio
+
+DATABASES = ["sqlite"] + (["postgres"] if os.getenv("TEST_DATABASE_URL") else [])
+
+
+@pytest.fixture(params=DATABASES)
+async def engine(request, tmp_path):
+    if request.param == "sqlite":
+        url = f"sqlite+aiosqlite:///{tmp_path / 'credits.db'}"
+    else:
+        url = async_database_url(os.environ["TEST_DATABASE_URL"])
+
+    db_engine = create_async_engine(url)
+    tables = [User.__table__, CreditLedgerEntry.__table__]
+    async with db_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all, tables=tables)
+        await conn.run_sync(Base.metadata.create_all, tables=tables)
+
+    yield db_engine
+    await db_engine.dispose()
+
+
+@pytest.fixture
+def credits(engine):
+    credit_engine = CreditEngine()
+    credit_engine.configure(async_sessionmaker(bind=engine, expire_on_commit=False), User, CreditLedgerEntry)
+    return credit_engine
+
+
+async def stored_balance(credits, member_id):
+    async with credits.session_factory() as db:
+        return await db.scalar(select(User.credits).where(User.memberstack_id == member_id))
+
+
+async def ledger_sum(credits, member_id):
+    async with credits.session_factory() as db:
+        return await db.scalar(
+            select(func.coalesce(func.sum(CreditLedgerEntry.delta), 0))
+            .where(CreditLedgerEntry.memberstack_id == member_id)
+        )
+
+
+async def test_new_member_cannot_start_negative(credits):
+    assert await credits.reserve("m1", 150, "generate") is None
+    assert await stored_balance(credits, "m1") is None
+    assert await ledger_sum(credits, "m1") == 0
+
+    # o pedido que cabe nos créditos de boas-vindas cria o membro
+    assert await credits.reserve("m1", 20, "generate") == 30
+    assert await credits.reserve("m1", 31, "generate") is None
+    assert await stored_balance(credits, "m1") == 30
+
+
+async def test_grant_to_new_member_starts_from_zero(credits):
+    assert await credits.grant("m2", 100, "memberstack") == 100
+    assert await credits.reserve("m2", 100, "generate") == 0
+    assert await credits.reserve("m2", 1, "generate") is None
+
+
+async def test_concurrent_debits_never_overdraw(credits):
+    await credits.grant("hot", 300, "memberstack")
+
+    results = await asyncio.gather(*(credits.reserve("hot", 1, "generate") for _ in range(500)))
+    accepted = [balance for balance in results if balance is not None]
+
+    assert len(accepted) == 300
+    # cada débito aceito viu um saldo diferente: nenhum lost update
+    assert sorted(accepted) == list(range(300))
+
+    await asyncio.gather(*(credits.release("hot", 1, "generate") for _ in range(150)))
+
+    assert await stored_balance(credits, "hot") == 150
+    assert await ledger_sum(credits, "hot") == 150
+
+
+async def test_concurrent_new_member_reserves(credits):
+    # várias primeiras requests do mesmo membro disputam o INSERT
+    results = await asyncio.gather(*(credits.reserve("fresh", 10, "generate") for _ in range(20)))
+
+    assert sorted(balance for balance in results if balance is not None) == [0, 10, 20, 30, 40]
+    assert await stored_balance(credits, "fresh") == 0
+    assert await ledger_sum(credits, "fresh") == -50
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="precisa de Postgres (TEST_DATABASE_URL)")
+async def test_movement_on_one_worker_invalidates_the_others(credits, engine):
+    from credits import BALANCES_CHANNEL
+    from events import PostgresBroker
+
+    if engine.dialect.name != "postgresql":
+        pytest.skip("NOTIFY só no Postgres")
+
+    # dois "workers": engines de crédito e brokers separados, mesmo banco
+    session_factory = credits.session_factory
+    worker_a, worker_b = CreditEngine(), CreditEngine()
+    worker_a.configure(session_factory, User, CreditLedgerEntry, notify=True)
+    worker_b.configure(session_factory, User, CreditLedgerEntry, notify=True)
+
+    broker_b = PostgresBroker(engine)
+    broker_b.listen(BALANCES_CHANNEL, worker_b.balance_changed)
+    await broker_b.start()
+    try:
+        await worker_a.grant("shared", 10, "memberstack")
+        assert await worker_b.balance("shared") == 10
+
+        # o listener do B precisa estar conectado antes do próximo movimento
+        await asyncio.sleep(0.5)
+        await worker_a.grant("shared", 5, "memberstack")
+
+        for _ in range(50):
+            if worker_b.remote_invalidations:
+                break
+            await asyncio.sleep(0.05)
+
+        assert await worker_b.balance("shared") == 15
+        # o próprio worker não se invalida: o write-through já está certo
+        assert worker_a.remote_invalidations == 0
+    finally:
+        await broker_b.stop()
+
+
+def test_multiple_workers_without_notify_shorten_the_ttl(monkeypatch):
+    import credits as credits_module
+
+    monkeypatch.setattr(credits_module, "WEB_CONCURRENCY", 4)
+
+    unshared = CreditEngine()
+    unshared.configure(None, User, CreditLedgerEntry)
+    assert unshared.balances.ttl == credits_module.CREDITS_CACHE_TTL_UNSHARED
+
+    shared = CreditEngine()
+    shared.configure(None, User, CreditLedgerEntry, notify=True)
+    assert shared.balances.ttl == credits_module.CREDITS_CACHE_TTL
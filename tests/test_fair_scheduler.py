@@ -0,0 +1,179 @@
+import time
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import Base
+from fair_scheduler import ANONYMOUS, FairScheduler
+from model_registry import MODEL_REGISTRY
+from models import User
+
+# =========================================
+# FAIR-SHARE: SIMULAÇÃO COM UPSTREAM FALSO
+# =========================================
+# Cada submissão segura o slot pelo tempo de um create no Replicate
+# (UPSTREAM_LATENCY). Um membro pesado despeja um lote; um membro leve chega
+# logo depois com poucos jobs e não deve esperar o lote inteiro.
+
+pytestmark = pytest.mark.anyio
+
+UPSTREAM_LATENCY = 0.02
+
+
+async def submit(scheduler, member_id, finished):
+    async with scheduler.slot(member_id):
+        await asyncio.sleep(UPSTREAM_LATENCY)
+    finished.append((member_id, time.monotonic()))
+
+
+async def simulate(heavy_params, light_params, heavy_jobs=30, light_jobs=3):
+    scheduler = FairScheduler(max_inflight=4, member_max_inflight=2, queue_timeout=30)
+    finished = []
+
+    heavy = [asyncio.create_task(submit(scheduler, heavy_params.member_id, finished)) for _ in range(heavy_jobs)]
+    await asyncio.sleep(0)
+    light = [asyncio.create_task(submit(scheduler, light_params.member_id, finished)) for _ in range(light_jobs)]
+    await asyncio.gather(*heavy, *light)
+
+    order = [member for member, _ in finished]
+    return order, scheduler
+
+
+def params(slug, member_id):
+    # mesmo caminho dos endpoints: o schema do modelo valida o form
+    validated, errors = MODEL_REGISTRY[slug].validate_params({"prompt": "a cat", "member_id": member_id}, ("body",))
+    assert not errors
+    return validated
+
+
+@pytest.mark.parametrize("slug", ["sora-2", "flux", "veo", "nanobanana-2"])
+def test_every_model_carries_member_id_but_not_to_replicate(slug):
+    spec = MODEL_REGISTRY[slug]
+    validated = params(slug, "m1")
+
+    assert validated.member_id == "m1"
+    assert "member_id" not in spec.build_input(validated, {f.name: [] for f in spec.images}, [])
+
+
+@pytest.mark.parametrize("slug", ["sora-2", "flux", "nanobanana-2"])
+async def test_light_member_is_not_stuck_behind_heavy_member(slug):
+    order, scheduler = await simulate(params(slug, "heavy"), params(slug, "light"))
+
+    # os 3 jobs do membro leve terminam entre os primeiros, não depois dos 30
+    last_light = max(i for i, member in enumerate(order) if member == "light")
+    assert last_light < 10
+    assert scheduler.stats()["dispatched"] == 33
+
+
+async def test_member_cap_applies_to_free_models():
+    scheduler = FairScheduler(max_inflight=10, member_max_inflight=2, queue_timeout=30)
+    member_id = params("sora-2", "heavy").member_id
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with scheduler.slot(member_id):
+            peak = max(peak, scheduler.inflight)
+            await asyncio.sleep(UPSTREAM_LATENCY)
+
+    await asyncio.gather(*(job() for _ in range(8)))
+
+    # antes: sora-2 não tinha member_id, caía em "anonymous" e ignorava o limite
+    assert peak == 2
+
+
+async def create(scheduler, member_id, prediction_id, started):
+    # slot só pelo create; a prediction segue "rodando" até o evento terminal
+    async with scheduler.slot(member_id) as slot:
+        await asyncio.sleep(UPSTREAM_LATENCY)
+        slot.running(prediction_id)
+    started.append(prediction_id)
+
+
+async def test_running_predictions_count_until_terminal_event():
+    scheduler = FairScheduler(max_inflight=10, member_max_inflight=2, member_max_running=2, queue_timeout=30)
+    started = []
+
+    jobs = [asyncio.create_task(create(scheduler, "m1", f"pred_{i}", started)) for i in range(4)]
+    await asyncio.sleep(UPSTREAM_LATENCY * 5)
+
+    # os creates voltaram, mas as duas primeiras ainda rodam no Replicate
+    assert started == ["pred_0", "pred_1"]
+    assert scheduler.stats()["running"] == 2
+
+    scheduler.prediction_event("pred_0", {"status": "processing"})
+    await asyncio.sleep(UPSTREAM_LATENCY * 3)
+    assert len(started) == 2
+
+    scheduler.prediction_event("pred_0", {"status": "succeeded"})
+    await asyncio.sleep(UPSTREAM_LATENCY * 3)
+    assert started == ["pred_0", "pred_1", "pred_2"]
+
+    for prediction_id in ("pred_1", "pred_2"):
+        scheduler.prediction_event(prediction_id, {"status": "failed"})
+    await asyncio.gather(*jobs)
+    assert started[-1] == "pred_3"
+
+
+async def test_terminal_event_before_create_returns_frees_the_slot():
+    scheduler = FairScheduler(max_inflight=10, member_max_inflight=2, member_max_running=1, queue_timeout=30)
+
+    async with scheduler.slot("m1") as slot:
+        # webhook do fim chegou antes do create devolver o slot
+        scheduler.prediction_event("pred_a", {"status": "succeeded"})
+        slot.running("pred_a")
+
+    assert scheduler.stats()["running"] == 0
+
+
+async def test_running_slot_expires_without_webhook():
+    scheduler = FairScheduler(max_inflight=10, member_max_inflight=2, member_max_running=1,
+                              queue_timeout=30, running_ttl=UPSTREAM_LATENCY)
+    started = []
+
+    await create(scheduler, "m1", "pred_a", started)
+    await asyncio.sleep(UPSTREAM_LATENCY * 2)
+    await asyncio.wait_for(create(scheduler, "m1", "pred_b", started), 1)
+
+    assert scheduler.stats()["running_expired"] == 1
+
+
+async def test_anonymous_queue_is_capped():
+    scheduler = FairScheduler(max_inflight=10, anonymous_max_inflight=2, anonymous_max_running=3, queue_timeout=30)
+    started = []
+
+    jobs = [asyncio.create_task(create(scheduler, None, f"pred_{i}", started)) for i in range(5)]
+    await asyncio.sleep(UPSTREAM_LATENCY * 5)
+    assert len(started) == 3
+
+    for prediction_id in list(started):
+        scheduler.prediction_event(prediction_id, {"status": "canceled"})
+    await asyncio.gather(*jobs)
+    assert len(started) == 5
+
+
+async def test_unknown_member_ids_share_the_anonymous_queue(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'users.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[User.__table__])
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(User(memberstack_id="mem_real"))
+        await db.commit()
+
+    scheduler = FairScheduler(max_inflight=10, anonymous_max_inflight=1, queue_timeout=30)
+    scheduler.configure(session_factory, User)
+    members = []
+
+    async def job(member_id):
+        async with scheduler.slot(member_id):
+            members.append(dict(scheduler._member_inflight))
+            await asyncio.sleep(UPSTREAM_LATENCY)
+
+    # ids inventados no form não abrem filas próprias
+    await asyncio.gather(job("mem_real"), *(job(f"fake_{i}") for i in range(3)))
+    await engine.dispose()
+
+    assert {member for seen in members for member in seen} == {"mem_real", ANONYMOUS}
+    assert max(seen.get(ANONYMOUS, 0) for seen in members) == 1
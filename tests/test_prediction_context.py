@@ -0,0 +1,53 @@
+import os
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import Base, async_database_url
+from models import PredictionContext
+from prediction_context import SqlBackend
+
+# =========================================
+# CONTEXTO DE PREDICTION: pop ATÔMICO NO BANCO
+# =========================================
+# Vários workers recebendo o mesmo webhook: só um pode levar o contexto.
+# Roda em sqlite e, com TEST_DATABASE_URL, também no Postgres.
+
+pytestmark = pytest.mark.anyio
+
+DATABASES = ["sqlite"] + (["postgres"] if os.getenv("TEST_DATABASE_URL") else [])
+
+
+@pytest.fixture(params=DATABASES)
+async def backend(request, tmp_path):
+    if request.param == "sqlite":
+        url = f"sqlite+aiosqlite:///{tmp_path / 'contexts.db'}"
+    else:
+        url = async_database_url(os.environ["TEST_DATABASE_URL"])
+
+    engine = create_async_engine(url)
+    tables = [PredictionContext.__table__]
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all, tables=tables)
+        await conn.run_sync(Base.metadata.create_all, tables=tables)
+
+    yield SqlBackend(async_sessionmaker(bind=engine, expire_on_commit=False), PredictionContext)
+    await engine.dispose()
+
+
+async def test_concurrent_pops_hand_out_the_context_once(backend):
+    await backend.put("pred_a", {"temp_public_ids": ["tmp/1"]}, time.time() + 60)
+
+    popped = await asyncio.gather(*[backend.pop("pred_a") for _ in range(10)])
+
+    assert [data for data in popped if data] == [{"temp_public_ids": ["tmp/1"]}]
+    assert await backend.get("pred_a") is None
+
+
+async def test_expired_context_is_removed_but_not_returned(backend):
+    await backend.put("pred_a", {"temp_public_ids": ["tmp/1"]}, time.time() - 1)
+
+    assert await backend.pop("pred_a") is None
+    assert await backend.pop("pred_a") is None
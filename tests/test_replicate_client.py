@@ -0,0 +1,105 @@
+import time
+
+import httpx
+import pytest
+from replicate.exceptions import ReplicateError
+
+import replicate_client
+from governor import UpstreamBusy, UpstreamGovernor
+from resilience import Upstream, replicate_failure
+
+# =========================================
+# REPLICATE: UMA ÚNICA CAMADA DE RETRY
+# =========================================
+# O upstream falso responde no lugar da rede (AsyncHTTPTransport), por baixo
+# do GovernedTransport: a chamada passa pelo SDK, pelo governor e pelo
+# replicate_upstream exatamente como em produção.
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeReplicate:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.calls = []
+
+    async def handle_async_request(self, transport, request):
+        self.calls.append((request.method, request.url.path))
+        return httpx.Response(self.status, headers=self.headers,
+                              json={"detail": "fake upstream", "status": self.status})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def install(status, headers=None):
+        fake = FakeReplicate(status, headers)
+        monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request",
+                            lambda transport, request: fake.handle_async_request(transport, request))
+        return fake
+    return install
+
+
+@pytest.fixture
+def resilience(monkeypatch):
+    replicate_upstream = Upstream("replicate", replicate_failure, retry_base=0.01, retry_max=0.02)
+    replicate_governor = UpstreamGovernor("replicate", max_inflight=10, max_queue=10, queue_timeout=5, rate=10)
+    monkeypatch.setattr(replicate_client, "replicate_upstream", replicate_upstream)
+    monkeypatch.setattr(replicate_client, "replicate_governor", replicate_governor)
+    return replicate_upstream, replicate_governor
+
+
+@pytest.fixture
+async def client():
+    replicate_client.open_client()
+    yield
+    await replicate_client.close_client()
+
+
+async def test_get_against_503_is_retried_only_by_resilience(upstream, resilience, client):
+    fake = upstream(503)
+    replicate_upstream, _ = resilience
+
+    started = time.monotonic()
+    with pytest.raises(ReplicateError):
+        await replicate_client.get_prediction("p1")
+
+    # sem o RetryTransport do SDK: uma chamada HTTP por tentativa
+    assert len(fake.calls) == replicate_upstream.attempts
+    assert all(call == ("GET", "/v1/predictions/p1") for call in fake.calls)
+    assert time.monotonic() - started < 2
+    assert replicate_upstream.failures == replicate_upstream.attempts
+    assert replicate_upstream.breaker.consecutive_failures == replicate_upstream.attempts
+
+
+async def test_create_against_503_is_not_retried(upstream, resilience, client):
+    fake = upstream(503)
+    replicate_upstream, _ = resilience
+
+    with pytest.raises(ReplicateError):
+        await replicate_client.create_prediction("owner/model", {"prompt": "x"})
+
+    assert fake.calls == [("POST", "/v1/models/owner/model/predictions")]
+    assert replicate_upstream.failures == 1
+
+
+@pytest.mark.parametrize("call", [
+    lambda: replicate_client.get_prediction("p1"),
+    lambda: replicate_client.cancel_prediction("p1"),
+    lambda: replicate_client.create_prediction("owner/model", {"prompt": "x"}),
+])
+async def test_429_is_busy_and_throttles_once(call, upstream, resilience, client):
+    fake = upstream(429, {"Retry-After": "3"})
+    replicate_upstream, replicate_governor = resilience
+
+    with pytest.raises(UpstreamBusy) as busy:
+        await call()
+
+    assert len(fake.calls) == 1
+    assert busy.value.retry_after >= 3
+    # uma pausa e um corte de taxa por chamada lógica
+    assert replicate_governor.throttled == 1
+    assert replicate_governor.rate == 5
+    assert replicate_governor.inflight == 0
+    # rate limit não conta como falha para o breaker
+    assert replicate_upstream.failures == 0
@@ -0,0 +1,173 @@
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpen, Upstream, output_failure
+
+# =========================================
+# RESILIÊNCIA: BREAKER E HEDGE CONTRA UM UPSTREAM FALSO
+# =========================================
+# O upstream é um httpx.MockTransport com falhas e atrasos programáveis;
+# a chamada sobe pelo Upstream como no proxy de outputs (output_upstream).
+
+pytestmark = pytest.mark.anyio
+
+RESET = 0.1
+
+
+class FaultyUpstream:
+    def __init__(self):
+        # status/atraso por request, na ordem; depois do fim, 200 na hora
+        self.script = []
+        self.calls = 0
+        self.cancelled = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        status, delay = self.script.pop(0) if self.script else (200, 0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return httpx.Response(status, json={"call": self.calls})
+
+
+@pytest.fixture
+async def fake():
+    fake = FaultyUpstream()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(fake.handle), base_url="http://upstream") as client:
+        fake.client = client
+        yield fake
+
+
+def upstream(**options):
+    upstream = Upstream("fake", output_failure, attempts=1, **options)
+    upstream.breaker = CircuitBreaker("fake", failures=3, reset_timeout=RESET)
+    return upstream
+
+
+def get(fake):
+    async def attempt():
+        response = await fake.client.get("/output")
+        response.raise_for_status()
+        return response.json()["call"]
+    return attempt
+
+
+async def test_breaker_opens_fails_fast_and_closes_after_probe(fake):
+    up = upstream()
+    fake.script = [(503, 0)] * 3
+
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await up.call(get(fake))
+    assert up.breaker.state == "open"
+
+    # aberto: falha na hora, sem tocar no upstream
+    with pytest.raises(CircuitOpen) as busy:
+        await up.call(get(fake))
+    assert busy.value.retry_after >= 1
+    assert fake.calls == 3 and up.breaker.short_circuited == 1
+
+    await asyncio.sleep(RESET)
+    assert await up.call(get(fake)) == 4
+    assert up.stats()["circuit"] == "closed"
+    assert up.breaker.consecutive_failures == 0
+
+
+async def test_failed_probe_reopens(fake):
+    up = upstream()
+    fake.script = [(500, 0)] * 4
+
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await up.call(get(fake))
+    await asyncio.sleep(RESET)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await up.call(get(fake))
+    assert up.breaker.state == "open" and up.breaker.opened == 2
+
+    with pytest.raises(CircuitOpen):
+        await up.call(get(fake))
+
+
+async def test_half_open_lets_one_probe_through(fake):
+    up = upstream()
+    fake.script = [(503, 0)] * 3 + [(200, 0.05)]
+
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await up.call(get(fake))
+    await asyncio.sleep(RESET)
+
+    results = await asyncio.gather(*(up.call(get(fake)) for _ in range(3)), return_exceptions=True)
+
+    assert results[0] == 4
+    assert all(isinstance(r, CircuitOpen) for r in results[1:])
+    assert fake.calls == 4 and up.breaker.state == "closed"
+
+
+async def test_client_errors_do_not_trip_the_breaker(fake):
+    up = upstream()
+    fake.script = [(404, 0)] * 5
+
+    for _ in range(5):
+        with pytest.raises(httpx.HTTPStatusError):
+            await up.call(get(fake))
+
+    assert up.breaker.state == "closed" and up.failures == 0
+
+
+async def test_idempotent_reads_are_retried_writes_are_not(fake):
+    up = Upstream("fake", output_failure, attempts=3, retry_base=0.01, retry_max=0.02)
+    fake.script = [(503, 0), (503, 0)]
+    assert await up.call(get(fake), idempotent=True) == 3
+    assert up.retries == 2
+
+    fake.script = [(503, 0)]
+    with pytest.raises(httpx.HTTPStatusError):
+        await up.call(get(fake))
+    assert fake.calls == 4
+
+
+async def warm(up, fake, n=20):
+    # latências recentes: o hedge só liga depois de 20 sucessos
+    for _ in range(n):
+        await up.call(get(fake), idempotent=True, hedge=True)
+
+
+async def test_slow_read_is_hedged_and_the_loser_cancelled(fake):
+    up = upstream(hedge_ratio=1.0)
+    await warm(up, fake)
+
+    fake.script = [(200, 1.0)]
+    result = await asyncio.wait_for(up.call(get(fake), idempotent=True, hedge=True), 0.5)
+
+    # o primário (lento) foi cancelado; o backup respondeu
+    assert result == 22
+    assert up.hedges == 1 and up.hedge_wins == 1
+    await asyncio.sleep(0)
+    assert fake.cancelled == 1
+
+
+async def test_hedge_respects_the_ratio(fake):
+    up = upstream(hedge_ratio=0.0)
+    await warm(up, fake)
+
+    fake.script = [(200, 0.1)]
+    assert await up.call(get(fake), idempotent=True, hedge=True) == 21
+    assert up.hedges == 0 and fake.calls == 21
+
+
+async def test_hedge_with_both_attempts_failing_raises(fake):
+    up = upstream(hedge_ratio=1.0)
+    await warm(up, fake)
+
+    fake.script = [(503, 0.2), (503, 0)]
+    with pytest.raises(httpx.HTTPStatusError):
+        await up.call(get(fake), idempotent=True, hedge=True)
+
+    assert up.hedges == 1 and up.failures == 2
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import Base
+from models import Creation, ResultCacheEntry
+from result_cache import ResultCache
+
+# =========================================
+# CACHE DE RESULTADOS: CREATION DE QUEM RECEBE O HIT
+# =========================================
+# Hit e in-flight gravam uma Creation para o solicitante (cached_from =
+# prediction original), que segue o status final da original.
+
+pytestmark = pytest.mark.anyio
+
+KEY = "k" * 64
+
+
+@pytest.fixture
+async def cache(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[Creation.__table__, ResultCacheEntry.__table__])
+
+    result_cache = ResultCache()
+    result_cache.configure(async_sessionmaker(bind=engine, expire_on_commit=False), ResultCacheEntry, Creation)
+    yield result_cache
+    await engine.dispose()
+
+
+async def add_original(cache, **fields):
+    async with cache.session_factory() as db:
+        db.add(Creation(memberstack_id="mem_a", model="m", result_key=KEY, **fields))
+        await db.commit()
+
+
+async def creation(cache, creation_id):
+    async with cache.session_factory() as db:
+        return await db.scalar(select(Creation).where(Creation.id == creation_id))
+
+
+async def test_hit_records_a_succeeded_creation_for_the_caller(cache):
+    await cache.store(KEY, "m", "pred_a", "https://gallery/a.png")
+
+    cached = await cache.lookup(KEY)
+    creation_id = await cache.follow(cached, memberstack_id="mem_b", model="m")
+
+    mine = await creation(cache, creation_id)
+    assert (mine.memberstack_id, mine.status, mine.result_url) == ("mem_b", "succeeded", "https://gallery/a.png")
+    assert mine.cached_from == "pred_a" and mine.replicate_id is None
+
+
+async def test_joined_creation_follows_the_original(cache):
+    await add_original(cache, replicate_id="pred_a", status="processing")
+
+    cached = await cache.lookup(KEY)
+    assert cached["status"] == "processing"
+    creation_id = await cache.follow(cached, memberstack_id="mem_b", model="m")
+    assert (await creation(cache, creation_id)).status == "processing"
+
+    await cache.settle("pred_a", "succeeded", "https://gallery/a.png")
+
+    mine = await creation(cache, creation_id)
+    assert (mine.status, mine.result_url) == ("succeeded", "https://gallery/a.png")
+
+
+async def test_follow_after_the_original_finished_copies_its_status(cache):
+    # lookup viu "processing", mas a original falhou antes do follow
+    await add_original(cache, replicate_id="pred_a", status="failed")
+
+    creation_id = await cache.follow(
+        {"prediction_id": "pred_a", "status": "processing", "output_url": None},
+        memberstack_id="mem_b", model="m"
+    )
+
+    assert (await creation(cache, creation_id)).status == "failed"
+
+
+async def test_unbound_creation_is_not_joined(cache):
+    # Creation registrada antes do create (replicate_id ainda vazio)
+    await add_original(cache, status="processing")
+
+    assert await cache.lookup(KEY) is None
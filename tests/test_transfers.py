@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import transfers
+from database import Base
+from models import Creation
+from transfers import ResultTransferPool
+
+# =========================================
+# TRANSFERÊNCIAS: UM SÓ WORKER COPIA CADA PREDICTION
+# =========================================
+# Dois pools no mesmo banco fazem o papel de dois workers do uvicorn
+# recebendo o mesmo webhook (redelivery) ou poll do /status.
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'transfers.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[Creation.__table__])
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+class FakeGallery:
+    def __init__(self):
+        self.calls = []
+        self.fail = None
+
+    async def cloudinary_call(self, fn, output_url, **options):
+        self.calls.append(output_url)
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise self.fail
+        return {"secure_url": f"https://gallery/{len(self.calls)}.png"}
+
+
+@pytest.fixture
+def gallery(monkeypatch):
+    fake = FakeGallery()
+    monkeypatch.setattr(transfers, "cloudinary_call", fake.cloudinary_call)
+    monkeypatch.setattr(transfers, "TRANSFER_MAX_ATTEMPTS", 1)
+    return fake
+
+
+async def add_creation(session_factory, prediction_id):
+    async with session_factory() as db:
+        db.add(Creation(replicate_id=prediction_id, status="processing", model="m"))
+        await db.commit()
+
+
+async def load(session_factory, prediction_id):
+    async with session_factory() as db:
+        return await db.scalar(select(Creation).where(Creation.replicate_id == prediction_id))
+
+
+async def workers(session_factory, n):
+    pools = []
+    for _ in range(n):
+        pool = ResultTransferPool(workers=1)
+        pool.configure(session_factory, Creation)
+        pool.start()
+        pools.append(pool)
+    return pools
+
+
+async def test_one_copy_across_workers(session_factory, gallery):
+    await add_creation(session_factory, "pred_a")
+    pools = await workers(session_factory, 3)
+
+    for pool in pools:
+        assert pool.submit("pred_a", "https://replicate/out.png")
+    for pool in pools:
+        await pool.stop()
+
+    assert len(gallery.calls) == 1
+    creation = await load(session_factory, "pred_a")
+    assert creation.status == "succeeded" and creation.transfer_claimed_at is None
+
+
+async def test_failed_copy_releases_the_claim(session_factory, gallery):
+    await add_creation(session_factory, "pred_a")
+    [pool] = await workers(session_factory, 1)
+
+    gallery.fail = RuntimeError("cloudinary down")
+    pool.submit("pred_a", "https://replicate/out.png")
+    await asyncio.sleep(0.2)
+    assert (await load(session_factory, "pred_a")).transfer_claimed_at is None
+
+    # o próximo poll/redelivery copia
+    gallery.fail = None
+    pool.submit("pred_a", "https://replicate/out.png")
+    await pool.stop()
+
+    assert len(gallery.calls) == 2
+    assert (await load(session_factory, "pred_a")).status == "succeeded"
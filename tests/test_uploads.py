@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from tempfile import SpooledTemporaryFile
+
+import cloudinary.exceptions
+import cloudinary.uploader
+import pytest
+from starlette.datastructures import UploadFile
+
+import uploads
+from uploads import UPLOAD_CHUNK_SIZE, upload_images
+
+# =========================================
+# UPLOADS: RETRY DO upload_large E LIMITE POR REQUEST
+# =========================================
+# O upload_large_part do SDK é trocado por um fake que grava cada pedaço;
+# nada sai para a rede.
+
+pytestmark = pytest.mark.anyio
+
+
+def upload_file(data):
+    file = SpooledTemporaryFile(max_size=1024)
+    file.write(data)
+    file.seek(0)
+    return UploadFile(file, size=len(data), filename="image.png")
+
+
+class FakeParts:
+    def __init__(self, fail_on=(), delay=0):
+        self.fail_on = set(fail_on)
+        self.delay = delay
+        self.parts = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, file, http_headers=None, **options):
+        _, chunk = file
+        with self._lock:
+            self.parts.append((http_headers["Content-Range"], options.get("public_id"), chunk))
+            n = len(self.parts)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if n in self.fail_on:
+                raise cloudinary.exceptions.Error("read timeout")
+            public_id = options["public_id"]
+            if not public_id.startswith(options["folder"] + "/"):
+                public_id = f"{options['folder']}/{public_id}"
+            return {"public_id": public_id, "secure_url": f"https://res.test/{public_id}"}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+async def test_retry_resends_the_whole_file_to_the_same_asset(monkeypatch):
+    fake = FakeParts(fail_on={2})
+    monkeypatch.setattr(cloudinary.uploader, "upload_large_part", fake)
+    data = os.urandom(UPLOAD_CHUNK_SIZE + 1024)
+    image = upload_file(data)
+
+    [result] = await upload_images([image], folder="retry-temp")
+
+    # tentativa 1: pedaço 1 ok, pedaço 2 falha; tentativa 2: do início
+    assert [part[0].split("/")[0] for part in fake.parts] == [
+        f"bytes 0-{UPLOAD_CHUNK_SIZE - 1}",
+        f"bytes {UPLOAD_CHUNK_SIZE}-{len(data) - 1}",
+        f"bytes 0-{UPLOAD_CHUNK_SIZE - 1}",
+        f"bytes {UPLOAD_CHUNK_SIZE}-{len(data) - 1}",
+    ]
+    assert b"".join(part[2] for part in fake.parts[2:]) == data
+    # mesmo public_id nas duas tentativas: o retry sobrescreve, não duplica
+    assert fake.parts[0][1] == fake.parts[2][1]
+    assert result["public_id"] == f"retry-temp/{fake.parts[0][1]}"
+
+    # o arquivo do request continua aberto e legível depois do upload
+    assert not image.file.closed
+    image.file.seek(0)
+    assert image.file.read() == data
+
+
+async def test_request_uploads_are_bounded(monkeypatch):
+    fake = FakeParts(delay=0.05)
+    monkeypatch.setattr(cloudinary.uploader, "upload_large_part", fake)
+    monkeypatch.setattr(uploads, "UPLOAD_REQUEST_CONCURRENCY", 2)
+
+    images = [upload_file(os.urandom(4096)) for _ in range(6)]
+    results = await upload_images(images, folder="bound-temp")
+
+    assert len(results) == 6
+    assert fake.max_running == 2
@@ -0,0 +1,249 @@
+import os
+import logging
+import time
+import random
+import asyncio
+from datetime import datetime, timedelta
+import cloudinary.uploader
+from sqlalchemy import select, update, or_
+from uploads import release_temp_assets
+from status_cache import status_cache
+from events import prediction_events
+from result_cache import result_cache
+from governor import UpstreamBusy
+from resilience import cloudinary_call
+from model_registry import MODEL_SLUGS
+from observability import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# TRANSFERÊNCIA DO RESULTADO -> GALLERY
+# =========================================
+# O webhook só registra o status e enfileira; um pool de workers copia o
+# output do Replicate para a pasta "gallery" do Cloudinary, com retries.
+# Cada replicate_id entra na fila uma vez só por processo (redeliveries do
+# Replicate e polls do /status não duplicam o upload). Entre workers, quem
+# copia é quem ganha o claim atômico na Creation (transfer_claimed_at, via
+# UPDATE ... RETURNING); um claim mais velho que TRANSFER_CLAIM_TTL é de um
+# processo que morreu no meio e pode ser retomado.
+
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", "4"))
+TRANSFER_QUEUE_SIZE = int(os.getenv("TRANSFER_QUEUE_SIZE", "500"))
+TRANSFER_MAX_ATTEMPTS = int(os.getenv("TRANSFER_MAX_ATTEMPTS", "4"))
+TRANSFER_RETRY_BASE = float(os.getenv("TRANSFER_RETRY_BASE", "2"))
+TRANSFER_DRAIN_TIMEOUT = float(os.getenv("TRANSFER_DRAIN_TIMEOUT", "25"))
+TRANSFER_CLAIM_TTL = float(os.getenv("TRANSFER_CLAIM_TTL", "900"))
+
+
+class ResultTransferPool:
+    def __init__(self, workers=TRANSFER_WORKERS, queue_size=TRANSFER_QUEUE_SIZE):
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._pending = set()
+        self._tasks = []
+        self._accepting = False
+
+        self.session_factory = None
+        self.model = None
+
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+
+    def configure(self, session_factory, model):
+        self.session_factory = session_factory
+        self.model = model
+
+    # -----------------------------
+    # Fila
+    # -----------------------------
+    def submit(self, prediction_id: str, output_url: str):
+        """
+        Enfileira a transferência. Retorna False se a fila estiver cheia
+        (o chamador deve pedir retry ao Replicate).
+        """
+        if prediction_id in self._pending:
+            return True
+
+        if not self._accepting:
+            return False
+
+        try:
+            self._queue.put_nowait((prediction_id, output_url))
+        except asyncio.QueueFull:
+            return False
+
+        self._pending.add(prediction_id)
+        self.submitted += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            prediction_id, output_url = await self._queue.get()
+            try:
+                await self._transfer(prediction_id, output_url)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Transfer error (%s): %s", prediction_id, e)
+            finally:
+                self._pending.discard(prediction_id)
+                self._queue.task_done()
+
+    async def _transfer(self, prediction_id, output_url):
+        # já copiada, sem Creation ou com outro worker copiando
+        if not await self._claim(prediction_id):
+            return
+
+        started = time.perf_counter()
+        try:
+            final_upload = await self._copy(prediction_id, output_url)
+        except BaseException:
+            # devolve o claim: o próximo poll/redelivery tenta de novo
+            await asyncio.shield(self._release_claim(prediction_id))
+            raise
+
+        await self._finish(prediction_id, final_upload, time.perf_counter() - started)
+
+    async def _copy(self, prediction_id, output_url):
+        attempt = 1
+        while True:
+            try:
+                final_upload = await cloudinary_call(
+                    cloudinary.uploader.upload,
+                    output_url,
+                    folder="gallery",
+                    resource_type="auto",
+                    background=True
+                )
+                break
+            except UpstreamBusy as e:
+                # Cloudinary fora (circuito aberto) ou em rate limit: espera
+                # sem gastar tentativa
+                logger.warning("Transfer waiting %ss (%s): %s", e.retry_after, prediction_id, e)
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                if attempt == TRANSFER_MAX_ATTEMPTS:
+                    raise
+                self.retries += 1
+                delay = TRANSFER_RETRY_BASE * 2 ** (attempt - 1)
+                logger.warning("Transfer retry %d (%s): %s", attempt, prediction_id, e)
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+
+        return final_upload
+
+    async def _finish(self, prediction_id, final_upload, elapsed):
+        creation, temp_public_ids = await self._mark_succeeded(prediction_id, final_upload["secure_url"])
+        STAGE_SECONDS.observe(
+            elapsed,
+            stage="result_transfer",
+            model=MODEL_SLUGS.get(creation.model, "unknown") if creation else "unknown"
+        )
+
+        if creation and creation.result_key:
+            try:
+                await result_cache.store(
+                    creation.result_key, creation.model, prediction_id, final_upload["secure_url"]
+                )
+                await result_cache.settle(prediction_id, "succeeded", final_upload["secure_url"])
+            except Exception as e:
+                logger.warning("Result cache store error (%s): %s", prediction_id, e)
+
+        status_cache.set(prediction_id, {
+            "status": "succeeded",
+            "output_url": final_upload["secure_url"]
+        })
+        await prediction_events.publish(prediction_id, "succeeded", final_upload["secure_url"])
+        await release_temp_assets(temp_public_ids)
+        self.succeeded += 1
+
+    # -----------------------------
+    # DB
+    # -----------------------------
+    async def _claim(self, prediction_id):
+        Creation = self.model
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            claimed = await db.scalar(
+                update(Creation)
+                .where(
+                    Creation.replicate_id == prediction_id,
+                    Creation.status != "succeeded",
+                    or_(
+                        Creation.transfer_claimed_at.is_(None),
+                        Creation.transfer_claimed_at < now - timedelta(seconds=TRANSFER_CLAIM_TTL)
+                    )
+                )
+                .values(transfer_claimed_at=now)
+                .returning(Creation.id)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return claimed is not None
+
+    async def _release_claim(self, prediction_id):
+        Creation = self.model
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Creation)
+                .where(Creation.replicate_id == prediction_id, Creation.status != "succeeded")
+                .values(transfer_claimed_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _mark_succeeded(self, prediction_id, result_url):
+        async with self.session_factory() as db:
+            creation = await db.scalar(
+                select(self.model)
+                .where(self.model.replicate_id == prediction_id)
+            )
+            if not creation or creation.status == "succeeded":
+                return None, None
+
+            temp_public_ids = creation.temp_input_public_ids
+
+            creation.status = "succeeded"
+            creation.result_url = result_url
+            creation.completed_at = datetime.utcnow()
+            creation.temp_input_public_ids = None
+            creation.transfer_claimed_at = None
+            await db.commit()
+
+            return creation, temp_public_ids
+
+    # -----------------------------
+    # Lifespan
+    # -----------------------------
+    def start(self):
+        self._accepting = True
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        # para de aceitar e espera a fila esvaziar (até TRANSFER_DRAIN_TIMEOUT);
+        # o que não terminar é refeito pelo próximo poll do /status
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), TRANSFER_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Transfer drain timeout, pendentes: %d", len(self._pending))
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "pending": len(self._pending),
+        }
+
+
+result_transfers = ResultTransferPool()
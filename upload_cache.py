@@ -0,0 +1,260 @@
+import os
+import logging
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select, delete
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# CACHE DE UPLOADS (sha256 -> secure_url)
+# =========================================
+# Imagens de referência idênticas não sobem de novo para o Cloudinary.
+#
+# Regras de consistência com o cleanup dos assets temporários:
+# - cada uso de um asset (upload novo ou hit) faz acquire -> pin += 1
+# - o cleanup chama release(); só destrói quando não há mais pins
+#   E a entrada já expirou (ou nunca foi cacheada)
+# - hits só são aceitos se ainda restar UPLOAD_CACHE_HIT_MARGIN de vida,
+#   para que outro worker (tier DB) não destrua o asset no meio de uma
+#   prediction
+# - o que fica para trás é recolhido pela varredura por idade, que deve
+#   usar uma idade maior que UPLOAD_CACHE_TTL
+
+UPLOAD_CACHE_TTL = int(os.getenv("UPLOAD_CACHE_TTL", "3600"))
+UPLOAD_CACHE_HIT_MARGIN = int(os.getenv("UPLOAD_CACHE_HIT_MARGIN", "1800"))
+UPLOAD_CACHE_MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", "5000"))
+
+
+class UploadCache:
+    def __init__(self, ttl=UPLOAD_CACHE_TTL, max_entries=UPLOAD_CACHE_MAX_ENTRIES,
+                 hit_margin=UPLOAD_CACHE_HIT_MARGIN):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hit_margin = min(hit_margin, ttl)
+        self.db_tier = None
+
+        # sha256 -> {"secure_url", "public_id", "expires_at"}
+        self._entries = OrderedDict()
+        # public_id -> sha256
+        self._by_public_id = {}
+        # public_id -> nº de predictions usando o asset
+        self._pins = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def configure_db_tier(self, session_factory, model):
+        self.db_tier = (session_factory, model)
+
+    # -----------------------------
+    # Lookup / store
+    # -----------------------------
+    async def acquire(self, digest: str):
+        """
+        Retorna a entrada cacheada (e a marca como em uso) ou None.
+        Pode consultar o tier DB.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry and entry["expires_at"] - now < self.hit_margin:
+                self._drop(digest)
+                entry = None
+
+            if entry:
+                self._entries.move_to_end(digest)
+                self._pin(entry["public_id"])
+                self.hits += 1
+                return dict(entry)
+
+        entry = await self._db_get(digest, now)
+
+        with self._lock:
+            if not entry:
+                self.misses += 1
+                return None
+
+            self._store(digest, entry)
+            self._pin(entry["public_id"])
+            self.hits += 1
+            return dict(entry)
+
+    async def put(self, digest: str, secure_url: str, public_id: str):
+        """Registra um upload novo (já em uso pela prediction atual)."""
+        entry = {
+            "secure_url": secure_url,
+            "public_id": public_id,
+            "expires_at": time.time() + self.ttl,
+        }
+
+        with self._lock:
+            self._store(digest, entry)
+            self._pin(public_id)
+
+        await self._db_put(digest, entry)
+
+    # -----------------------------
+    # Cleanup
+    # -----------------------------
+    async def release(self, public_ids):
+        """
+        Solta os pins de uma prediction concluída.
+        Retorna os public_ids que podem ser destruídos agora.
+        """
+        now = time.time()
+        candidates = []
+
+        with self._lock:
+            for public_id in public_ids or []:
+                pins = self._pins.get(public_id, 0) - 1
+                if pins > 0:
+                    self._pins[public_id] = pins
+                    continue
+                self._pins.pop(public_id, None)
+
+                digest = self._by_public_id.get(public_id)
+                entry = self._entries.get(digest) if digest else None
+
+                if entry and entry["expires_at"] > now:
+                    # ainda pode ser servido como hit; fica para a varredura
+                    continue
+
+                if digest:
+                    self._drop(digest)
+                candidates.append(public_id)
+
+        destroyable = []
+        for public_id in candidates:
+            # outro worker pode estar servindo o mesmo asset pelo tier DB
+            if await self._db_live(public_id, now):
+                continue
+            await self._db_delete(public_id)
+            destroyable.append(public_id)
+
+        return destroyable
+
+    def pin(self, public_ids):
+        """Um pin extra por uso adicional (ex.: referência compartilhada num batch)."""
+        with self._lock:
+            for public_id in public_ids:
+                self._pin(public_id)
+
+    def in_use(self, public_id):
+        """True se o asset está pinado ou ainda pode ser servido como hit."""
+        with self._lock:
+            if self._pins.get(public_id):
+                return True
+            digest = self._by_public_id.get(public_id)
+            entry = self._entries.get(digest) if digest else None
+            return bool(entry) and entry["expires_at"] > time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "pinned": len(self._pins),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # -----------------------------
+    # Internos (chamar com lock)
+    # -----------------------------
+    def _pin(self, public_id):
+        self._pins[public_id] = self._pins.get(public_id, 0) + 1
+
+    def _store(self, digest, entry):
+        old = self._entries.pop(digest, None)
+        if old:
+            self._by_public_id.pop(old["public_id"], None)
+
+        self._entries[digest] = entry
+        self._by_public_id[entry["public_id"]] = digest
+
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._by_public_id.pop(evicted["public_id"], None)
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry:
+            self._by_public_id.pop(entry["public_id"], None)
+
+    # -----------------------------
+    # Tier DB (opcional)
+    # -----------------------------
+    async def _db_get(self, digest, now):
+        if not self.db_tier:
+            return None
+
+        session_factory, model = self.db_tier
+        try:
+            async with session_factory() as db:
+                row = await db.get(model, digest)
+            if not row:
+                return None
+
+            expires_at = row.expires_at.timestamp()
+            if expires_at - now < self.hit_margin:
+                return None
+
+            return {
+                "secure_url": row.secure_url,
+                "public_id": row.public_id,
+                "expires_at": expires_at,
+            }
+        except Exception as e:
+            logger.warning("Upload cache DB error: %s", e)
+            return None
+
+    async def _db_live(self, public_id, now):
+        if not self.db_tier:
+            return False
+
+        session_factory, model = self.db_tier
+        try:
+            async with session_factory() as db:
+                expires_at = await db.scalar(
+                    select(model.expires_at).where(model.public_id == public_id).limit(1)
+                )
+            return bool(expires_at) and expires_at.timestamp() > now
+        except Exception as e:
+            logger.warning("Upload cache DB error: %s", e)
+            # na dúvida, não destrói
+            return True
+
+    async def _db_put(self, digest, entry):
+        if not self.db_tier:
+            return
+
+        session_factory, model = self.db_tier
+        try:
+            async with session_factory() as db:
+                await db.merge(model(
+                    sha256=digest,
+                    secure_url=entry["secure_url"],
+                    public_id=entry["public_id"],
+                    expires_at=datetime.fromtimestamp(entry["expires_at"]),
+                ))
+                await db.commit()
+        except Exception as e:
+            logger.warning("Upload cache DB error: %s", e)
+
+    async def _db_delete(self, public_id):
+        if not self.db_tier:
+            return
+
+        session_factory, model = self.db_tier
+        try:
+            async with session_factory() as db:
+                await db.execute(delete(model).where(model.public_id == public_id))
+                await db.commit()
+        except Exception as e:
+            logger.warning("Upload cache DB error: %s", e)
+
+upload_cache = UploadCache()
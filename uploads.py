@@ -0,0 +1,202 @@
+import os
+import logging
+import time
+import asyncio
+import uuid
+import hashlib
+import cloudinary.uploader
+from fastapi import HTTPException
+from upload_cache import upload_cache
+from cleanup import temp_asset_cleaner
+from resilience import cloudinary_call
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# CLOUDINARY - INGESTÃO DE IMAGENS
+# =========================================
+# Uploads rodam em threads (o SDK do Cloudinary é síncrono), em paralelo,
+# limitados por UPLOAD_CONCURRENCY para não estourar o pool de threads.
+#
+# O arquivo já vem do python-multipart em um SpooledTemporaryFile; daqui ele
+# vai para o Cloudinary em pedaços de UPLOAD_CHUNK_SIZE (upload_large), então
+# nunca existe um `bytes` com o arquivo inteiro em memória, só o pedaço da
+# vez (o arquivo todo, se menor que o pedaço). Teto de memória:
+# - por request: UPLOAD_REQUEST_CONCURRENCY * UPLOAD_CHUNK_SIZE
+# - por processo: UPLOAD_CONCURRENCY * UPLOAD_CHUNK_SIZE
+# independente do tamanho e do número de arquivos.
+#
+# O upload_large fecha o arquivo que recebe (`with file_io:`); ele recebe
+# uma visão (_FileView) que começa do início a cada tentativa e não fecha o
+# original. Com public_id fixo por arquivo, o retry sobrescreve o mesmo
+# asset em vez de deixar um órfão.
+#
+# Antes de subir, o arquivo é lido em blocos para calcular o sha256; se a
+# mesma imagem já subiu recentemente, o upload é pulado (ver upload_cache.py).
+
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# Cloudinary exige chunks de no mínimo 5 MB
+UPLOAD_CHUNK_SIZE = max(int(os.getenv("UPLOAD_CHUNK_SIZE", str(6 * 1024 * 1024))), 5 * 1024 * 1024)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# uploads simultâneos de uma mesma request (dentro do limite do processo)
+UPLOAD_REQUEST_CONCURRENCY = int(os.getenv("UPLOAD_REQUEST_CONCURRENCY", "2"))
+
+_upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_file(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+async def hash_files(upload_files):
+    """sha256 de cada UploadFile (em threads), na ordem de entrada."""
+    return await asyncio.gather(*[
+        asyncio.to_thread(_hash_file, upload_file.file)
+        for upload_file in upload_files or []
+    ])
+
+
+class _FileView:
+    """
+    Leitura do arquivo do request para uma tentativa do upload_large:
+    começa do início e o close() não fecha o arquivo de verdade.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        file.seek(0)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _upload_file(file, **options):
+    # uma chamada por tentativa (roda na thread do governor)
+    return cloudinary.uploader.upload_large(_FileView(file), **options)
+
+
+async def _ingest(file, folder: str, digest=None):
+    started = time.perf_counter()
+    if digest is None:
+        digest = await asyncio.to_thread(_hash_file, file)
+
+    cached = await upload_cache.acquire(digest)
+    if cached:
+        return {
+            "secure_url": cached["secure_url"],
+            "public_id": cached["public_id"],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "sha256": digest,
+            "cached": True,
+        }
+
+    result = await cloudinary_call(
+        _upload_file,
+        file,
+        idempotent=True,
+        folder=folder,
+        public_id=uuid.uuid4().hex,
+        resource_type="image",
+        chunk_size=UPLOAD_CHUNK_SIZE
+    )
+    await upload_cache.put(digest, result["secure_url"], result["public_id"])
+
+    return {
+        "secure_url": result["secure_url"],
+        "public_id": result["public_id"],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "sha256": digest,
+        "cached": False,
+    }
+
+
+async def upload_image(upload_file, folder: str, inflight=None, digest=None, request_slots=None):
+    """
+    Sobe um UploadFile para o Cloudinary fora do event loop.
+    `request_slots`: semáforo da request (ver upload_images).
+    Retorna {"secure_url", "public_id", "elapsed_ms", "sha256", "cached"}.
+    """
+    if upload_file.size is not None and upload_file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagem muito grande: {upload_file.filename}"
+        )
+
+    async with request_slots or asyncio.Semaphore(1), _upload_semaphore:
+        job = asyncio.ensure_future(_ingest(upload_file.file, folder, digest))
+        if inflight is not None:
+            inflight.append(job)
+
+        # shield: se cancelado, o upload termina e o resultado fica em `job`
+        return await asyncio.shield(job)
+
+
+async def upload_images(upload_files, folder: str, digests=None):
+    """
+    Sobe várias imagens em paralelo mantendo a ordem de entrada.
+    `digests` (opcional, de hash_files) evita calcular o sha256 de novo.
+    Na primeira falha cancela os uploads irmãos, remove os que já
+    subiram e relança o erro original.
+    """
+    if not upload_files:
+        return []
+
+    tasks = []
+    inflight = []
+    request_slots = asyncio.Semaphore(UPLOAD_REQUEST_CONCURRENCY)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for i, upload_file in enumerate(upload_files):
+                digest = digests[i] if digests else None
+                tasks.append(tg.create_task(upload_image(upload_file, folder, inflight, digest, request_slots)))
+    except* Exception as group:
+        done = await asyncio.gather(*inflight, return_exceptions=True)
+        await release_temp_assets([
+            result["public_id"]
+            for result in done
+            if not isinstance(result, BaseException)
+        ])
+
+        raise group.exceptions[0]
+
+    results = [t.result() for t in tasks]
+
+    logger.info(
+        "📤 %s: %d uploads %s ms, %d do cache",
+        folder, len(results), [r["elapsed_ms"] for r in results], sum(r["cached"] for r in results)
+    )
+
+    return results
+
+
+async def release_temp_assets(public_ids):
+    """
+    Solta os assets temporários de uma prediction e manda para a fila de
+    remoção os que não estão mais em uso nem servindo de cache.
+    """
+    if not public_ids:
+        return
+
+    destroyable = await upload_cache.release(public_ids)
+    temp_asset_cleaner.enqueue(destroyable)